@@ -0,0 +1,84 @@
+"""Compares encode time and payload size of the response formats on synthetic entity linking responses.
+
+    python -m common.benchmark_responses --docs 64 --entities 30
+"""
+import argparse
+import json
+import random
+import time
+from typing import Any, Callable, Dict
+
+import msgpack
+import numpy as np
+import orjson
+
+from common.responses import ORJSON_OPTIONS, columnar, encode_default
+
+
+def entity_linking_response(num_docs: int, num_entities: int, num_candidates: int) -> Dict[str, Any]:
+    """Returns the response of the entity linking service with numpy scores as the linker returns them"""
+    rng = random.Random(0)
+    response = {field: [] for field in ["entity_substr", "conf", "entity_offsets", "entity_ids", "entity_tags",
+                                        "entity_labels", "entity_wiki_types", "entity_wiki_tags", "status"]}
+    for _ in range(num_docs):
+        entities = range(rng.randint(num_entities // 2, num_entities))
+        response["entity_substr"].append([f"сущность {rng.randint(0, 10 ** 6)}" for _ in entities])
+        response["conf"].append([[(np.float64(round(rng.random(), 2)), np.int64(rng.randint(0, 300)),
+                                   np.float32(rng.random())) for _ in range(num_candidates)] for _ in entities])
+        offsets = sorted(rng.sample(range(10000), 2 * len(entities)))
+        response["entity_offsets"].append([[offsets[2 * i], offsets[2 * i + 1]] for i in entities])
+        response["entity_ids"].append([[f"Q{rng.randint(1, 10 ** 8)}" for _ in range(num_candidates)]
+                                       for _ in entities])
+        response["entity_tags"].append([rng.choice(["PER", "LOC", "ORG"]) for _ in entities])
+        response["entity_labels"].append([[f"Название {rng.randint(0, 10 ** 6)}" for _ in range(num_candidates)]
+                                          for _ in entities])
+        response["entity_wiki_types"].append([[f"Q{rng.randint(1, 10 ** 6)}" for _ in range(2)] for _ in entities])
+        response["entity_wiki_tags"].append([rng.choice(["PER", "LOC", "ORG", "AMB"]) for _ in entities])
+        response["status"].append("ok")
+    return response
+
+
+def jsonify(obj: Any) -> Any:
+    # the same conversion as deeppavlov jsonify_data, which walks the whole structure before json.dumps
+    if isinstance(obj, dict):
+        return {key: jsonify(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [jsonify(value) for value in obj]
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    return obj
+
+
+def measure(encode: Callable[[], bytes], repeats: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        payload = encode()
+        times.append(time.perf_counter() - start)
+    return {"encode_ms": round(1000 * min(times), 2), "size_kb": round(len(payload) / 1024, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=64)
+    parser.add_argument("--entities", type=int, default=30)
+    parser.add_argument("--candidates", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    response = entity_linking_response(args.docs, args.entities, args.candidates)
+    encoders = {
+        "jsonify_data + json": lambda: json.dumps(jsonify(response), ensure_ascii=False).encode("utf8"),
+        "orjson": lambda: orjson.dumps(response, default=encode_default, option=ORJSON_OPTIONS),
+        "msgpack": lambda: msgpack.packb(response, default=encode_default, use_bin_type=True),
+        "orjson columnar": lambda: orjson.dumps(columnar(response), default=encode_default, option=ORJSON_OPTIONS),
+        "msgpack columnar": lambda: msgpack.packb(columnar(response), default=encode_default, use_bin_type=True),
+    }
+    print(f"{args.docs} documents, up to {args.entities} entities with {args.candidates} candidates")
+    for name, encode in encoders.items():
+        result = measure(encode, args.repeats)
+        print(f"{name:>20}: {result['encode_ms']:>8} ms {result['size_kb']:>8} KiB")
+
+
+if __name__ == "__main__":
+    main()
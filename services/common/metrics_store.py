@@ -0,0 +1,173 @@
+import csv
+import datetime
+import json
+import sqlite3
+from contextlib import contextmanager
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+log = getLogger(__name__)
+
+LEGACY_COLUMNS = {
+    "ner": ["old_metric", "new_metric"],
+    "entity_linking": ["old_precision", "new_precision", "old_recall", "new_recall"]
+}
+
+
+class MetricsStore:
+    """Append-only history of evaluation metrics shared by the services.
+
+    Metrics are stored in the SQLite database in WAL mode, so several processes can append rows concurrently
+    and the latest row of the service is read by the index without scanning the history.
+
+    Args:
+        db_path: path to the SQLite database
+        legacy_csv_path: path to ``metrics_score_history.csv`` written by the previous versions of the services,
+            its rows are imported once into the database
+        timeout: how many seconds to wait for the lock held by another writer
+    """
+
+    def __init__(self, db_path: Union[str, Path], legacy_csv_path: Optional[Union[str, Path]] = None,
+                 timeout: float = 30.0) -> None:
+        self.db_path = Path(db_path)
+        self.legacy_csv_path = Path(legacy_csv_path) if legacy_csv_path else None
+        self.timeout = timeout
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS metrics ("
+                         "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "service TEXT NOT NULL, "
+                         "model_version INTEGER NOT NULL, "
+                         "time TEXT NOT NULL, "
+                         "metrics TEXT NOT NULL, "
+                         "update_model INTEGER NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS metrics_service ON metrics (service, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS metrics_service_version "
+                         "ON metrics (service, model_version, id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS imports (service TEXT NOT NULL, source TEXT NOT NULL, "
+                         "PRIMARY KEY (service, source))")
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(str(self.db_path), timeout=self.timeout, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def append(self, service: str, metrics: Dict[str, float], update_model: bool = False,
+               model_version: Optional[int] = None, time: Optional[datetime.datetime] = None) -> Dict[str, Any]:
+        """Appends the row of metrics of the service.
+
+        Args:
+            service: name of the service
+            metrics: metric values
+            update_model: whether the evaluated model replaced the previous one
+            model_version: version of the evaluated model, by default the version of the previous row,
+                increased by one if the previous row updated the model
+            time: time of evaluation, current time by default
+
+        Returns:
+            the appended row
+        """
+        time = time or datetime.datetime.now()
+        self.import_legacy_csv(service)
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if model_version is None:
+                    model_version = self._next_version(conn, service)
+                cursor = conn.execute("INSERT INTO metrics (service, model_version, time, metrics, update_model) "
+                                      "VALUES (?, ?, ?, ?, ?)",
+                                      (service, model_version, str(time), json.dumps(metrics), int(update_model)))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return {"id": cursor.lastrowid, "service": service, "model_version": model_version, "time": str(time),
+                "metrics": dict(metrics), "update_model": bool(update_model)}
+
+    def latest(self, service: str) -> Optional[Dict[str, Any]]:
+        """Returns the last row of the service or None if there are no metrics yet"""
+        self.import_legacy_csv(service)
+        with self.connect() as conn:
+            row = conn.execute("SELECT * FROM metrics WHERE service = ? ORDER BY id DESC LIMIT 1",
+                               (service,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def history(self, service: str, model_version: Optional[int] = None,
+                limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Returns rows of the service (of the model version, if given) in the order they were added"""
+        self.import_legacy_csv(service)
+        query, params = "SELECT * FROM metrics WHERE service = ?", [service]
+        if model_version is not None:
+            query += " AND model_version = ?"
+            params.append(model_version)
+        query += " ORDER BY id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self.connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [self._to_dict(row) for row in reversed(rows)]
+
+    def best(self, service: str, old_key: str, new_key: str) -> Optional[float]:
+        """Returns the best value of the metric so far: rows keep the best previous value in ``old_key``,
+        so it is the maximum of the old and the new values in the last row"""
+        last_row = self.latest(service)
+        if last_row is None:
+            return None
+        return max(last_row["metrics"][old_key], last_row["metrics"][new_key])
+
+    def import_legacy_csv(self, service: str) -> None:
+        """Imports the rows of the service from the legacy CSV file. Both services used to write to the same file
+        with different columns, so only the rows which have values of the service columns are taken."""
+        if self.legacy_csv_path is None or not self.legacy_csv_path.exists():
+            return
+        columns = LEGACY_COLUMNS.get(service)
+        if columns is None:
+            return
+        source = str(self.legacy_csv_path)
+        with self.connect() as conn:
+            if conn.execute("SELECT 1 FROM imports WHERE service = ? AND source = ?", (service, source)).fetchone():
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("SELECT 1 FROM imports WHERE service = ? AND source = ?",
+                                (service, source)).fetchone() is None:
+                    num_rows = 0
+                    with open(self.legacy_csv_path, newline="") as fl:
+                        model_version = 0
+                        for row in csv.DictReader(fl):
+                            if any(not row.get(column) for column in columns):
+                                continue
+                            metrics = {column: float(row[column]) for column in columns}
+                            update_model = row.get("update_model") == "True"
+                            conn.execute("INSERT INTO metrics (service, model_version, time, metrics, update_model) "
+                                         "VALUES (?, ?, ?, ?, ?)",
+                                         (service, model_version, row.get("time", ""), json.dumps(metrics),
+                                          int(update_model)))
+                            model_version += int(update_model)
+                            num_rows += 1
+                    conn.execute("INSERT INTO imports (service, source) VALUES (?, ?)", (service, source))
+                    log.info(f"imported {num_rows} rows of {service} metrics from {source}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _next_version(self, conn: sqlite3.Connection, service: str) -> int:
+        row = conn.execute("SELECT model_version, update_model FROM metrics WHERE service = ? "
+                           "ORDER BY id DESC LIMIT 1", (service,)).fetchone()
+        if row is None:
+            return 0
+        return row["model_version"] + row["update_model"]
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        return {"id": row["id"], "service": row["service"], "model_version": row["model_version"],
+                "time": row["time"], "metrics": json.loads(row["metrics"]),
+                "update_model": bool(row["update_model"])}
@@ -0,0 +1,68 @@
+from typing import Any, Dict, List
+
+import msgpack
+import numpy as np
+import orjson
+from starlette.requests import Request
+from starlette.responses import Response
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def encode_default(obj: Any) -> Any:
+    """Converts the objects which the encoders do not support natively: numpy arrays which are not C-contiguous,
+    numpy scalars (for msgpack) and sets"""
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Type is not serializable: {type(obj)}")
+
+
+def columnar(content: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the response with the fields which have a list for every document (in the response and in its nested
+    dicts) replaced with the concatenation of the lists of the documents and their offsets: the values of
+    the document i are values[offsets[i]:offsets[i + 1]]"""
+    columns = {}
+    for field, value in content.items():
+        if isinstance(value, dict):
+            columns[field] = columnar(value)
+        elif isinstance(value, (list, tuple)) and value and all(isinstance(doc, (list, tuple)) for doc in value):
+            offsets = [0]
+            values = []
+            for doc in value:
+                values.extend(doc)
+                offsets.append(len(values))
+            columns[field] = {"values": values, "offsets": offsets}
+        else:
+            columns[field] = value
+    return columns
+
+
+def encode_response(request: Request, content: Any, status_code: int = 200) -> Response:
+    """Encodes the response in the format of the Accept header of the request: msgpack for application/msgpack,
+    otherwise JSON encoded with orjson. Dict responses are returned in the columnar layout (see columnar) if the request
+    has the query parameter layout=columnar."""
+    if isinstance(content, dict) and request.query_params.get("layout") == "columnar":
+        content = columnar(content)
+    accept = request.headers.get("accept", "")
+    if any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES):
+        return Response(msgpack.packb(content, default=encode_default, use_bin_type=True), status_code=status_code,
+                        media_type="application/msgpack")
+    return Response(orjson.dumps(content, default=encode_default, option=ORJSON_OPTIONS), status_code=status_code,
+                    media_type="application/json")
+
+
+def decode_columnar(columns: Dict[str, Any]) -> Dict[str, List]:
+    """Restores the lists of the documents from the columnar layout"""
+    content = {}
+    for field, value in columns.items():
+        if isinstance(value, dict) and set(value) == {"values", "offsets"}:
+            offsets = value["offsets"]
+            content[field] = [value["values"][start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+        elif isinstance(value, dict):
+            content[field] = decode_columnar(value)
+        else:
+            content[field] = value
+    return content
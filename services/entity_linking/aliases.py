@@ -4,7 +4,8 @@ from logging import getLogger
 from pathlib import Path
 from typing import Dict, List
 
-from constants import ALIASES_PATH
+from caches import publish_version
+from constants import ALIASES_PATH, INDEX_VERSION_PATH
 
 log = getLogger(__file__)
 
@@ -47,3 +48,4 @@ class Aliases:
         with open(self.aliases_path, 'wb') as fout:
             pickle.dump(self.aliases, fout)
         self.mtime = datetime.fromtimestamp(self.aliases_path.stat().st_mtime)
+        publish_version(INDEX_VERSION_PATH)
@@ -0,0 +1,125 @@
+import asyncio
+from concurrent.futures import Executor
+from logging import getLogger
+from typing import Callable, List, Optional, Tuple
+
+log = getLogger(__name__)
+
+
+class LinkingOverloaded(Exception):
+    """The queue of linking requests is full"""
+
+
+class LinkingBatcher:
+    """Coalesces concurrent linking requests into batches and runs the model in the executor, so that the event
+    loop is never blocked by the model. Requests wait in a bounded queue: a request is rejected if the queue is
+    full, and it is dropped from the queue if its deadline passes before its batch is started. If the
+    model fails on the batch, the requests of the batch are linked one by one and only the failing request gets
+    the error.
+
+    Args:
+        model: the model which takes lists of documents of every input field and returns lists of documents of
+            every output field
+        executor: executor which runs the model, one worker keeps the model single-threaded
+        max_batch_docs: the batch is started when it has at least max_batch_docs documents
+        batch_wait: maximal time in seconds the first request of the batch waits for the other requests
+        queue_size: maximal number of waiting requests
+    """
+
+    def __init__(self, model: Callable, executor: Executor, max_batch_docs: int = 32, batch_wait: float = 0.01,
+                 queue_size: int = 64) -> None:
+        self.model = model
+        self.executor = executor
+        self.max_batch_docs = max_batch_docs
+        self.batch_wait = batch_wait
+        self.queue_size = queue_size
+        self.queue = None
+        self.next_get = None
+        self.task = None
+
+    def start(self) -> None:
+        """Starts the batching task, it is called from the running event loop"""
+        self.queue = asyncio.Queue(self.queue_size)
+        self.task = asyncio.ensure_future(self.run())
+
+    async def link(self, inputs: Tuple[List, ...], timeout: float) -> tuple:
+        """Returns the outputs of the model for the documents of the request.
+
+        Raises:
+            LinkingOverloaded: if the queue is full
+            asyncio.TimeoutError: if the outputs are not ready in timeout seconds
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        try:
+            self.queue.put_nowait((inputs, future, loop.time() + timeout))
+        except asyncio.QueueFull:
+            raise LinkingOverloaded(f"{self.queue_size} linking requests are waiting")
+        return await asyncio.wait_for(future, timeout)
+
+    async def next_request(self, timeout: Optional[float] = None) -> Optional[tuple]:
+        # the pending get is kept between the calls, cancelling it on timeout could lose the request
+        if self.next_get is None:
+            self.next_get = asyncio.ensure_future(self.queue.get())
+        done, _ = await asyncio.wait({self.next_get}, timeout=timeout)
+        if not done:
+            return None
+        request = self.next_get.result()
+        self.next_get = None
+        return request
+
+    async def run(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            requests = [await self.next_request()]
+            num_docs = len(requests[0][0][0])
+            batch_deadline = loop.time() + self.batch_wait
+            while num_docs < self.max_batch_docs and loop.time() < batch_deadline:
+                request = await self.next_request(batch_deadline - loop.time())
+                if request is None:
+                    break
+                requests.append(request)
+                num_docs += len(request[0][0])
+            # the requests which timed out are cancelled by asyncio.wait_for in link
+            requests = [request for request in requests if not request[1].done() and loop.time() < request[2]]
+            if not requests:
+                continue
+            await self.run_batch(requests)
+
+    async def run_batch(self, requests: List[tuple]) -> None:
+        loop = asyncio.get_event_loop()
+        num_fields = len(requests[0][0])
+        inputs = [[doc for request_inputs, _, _ in requests for doc in request_inputs[field]]
+                  for field in range(num_fields)]
+        try:
+            outputs = await loop.run_in_executor(self.executor, self.model, *inputs)
+        except Exception as e:
+            if len(requests) == 1:
+                log.exception("linking of the request failed")
+                self.set_exception(requests[0][1], e)
+                return
+            # the requests are linked one by one, so that only the request which fails gets the error
+            log.exception(f"linking of the batch of {len(requests)} requests failed, linking them one by one")
+            for request_inputs, future, _ in requests:
+                if future.done():
+                    continue
+                try:
+                    outputs = await loop.run_in_executor(self.executor, self.model, *request_inputs)
+                except Exception as e:
+                    log.exception("linking of the request failed")
+                    self.set_exception(future, e)
+                    continue
+                if not future.done():
+                    future.set_result(tuple(outputs))
+            return
+        start = 0
+        for request_inputs, future, _ in requests:
+            end = start + len(request_inputs[0])
+            if not future.done():
+                future.set_result(tuple(output[start:end] for output in outputs))
+            start = end
+
+    @staticmethod
+    def set_exception(future: asyncio.Future, exception: Exception) -> None:
+        if not future.done():
+            future.set_exception(exception)
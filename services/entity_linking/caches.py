@@ -0,0 +1,113 @@
+import hashlib
+import os
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Hashable, Union
+
+
+class LRUCache:
+    """Thread-safe dict with limited size which drops the least recently used items, counts hits and misses
+
+    Args:
+        maxsize: maximal number of items, 0 disables the cache
+    """
+
+    def __init__(self, maxsize: int = 100000) -> None:
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.items.clear()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.misses
+        return {"size": len(self.items), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0}
+
+
+class TTLCache(LRUCache):
+    """LRUCache which also drops the items older than ttl seconds, counts expired items
+
+    Args:
+        maxsize: maximal number of items, 0 disables the cache
+        ttl: lifetime of the items in seconds, 0 for the items which never expire
+    """
+
+    def __init__(self, maxsize: int = 100000, ttl: float = 3600.0) -> None:
+        super().__init__(maxsize)
+        self.ttl = ttl
+        self.expired = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            if key in self.items:
+                put_time, value = self.items[key]
+                if not self.ttl or time.monotonic() - put_time <= self.ttl:
+                    self.items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.items[key]
+                self.expired += 1
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        super().put(key, (time.monotonic(), value))
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({"ttl": self.ttl, "expired": self.expired})
+        return stats
+
+
+def text_key(text: str) -> bytes:
+    """Returns the digest of the text which is used as a cache key instead of the text"""
+    return hashlib.blake2b(text.encode("utf8"), digest_size=16).digest()
+
+
+def read_version(path: Union[str, Path]) -> str:
+    """Returns the version written to the file by publish_version or an empty string if there is no file"""
+    try:
+        with open(path) as fl:
+            return fl.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def publish_version(path: Union[str, Path]) -> str:
+    """Writes a new unique version to the file, the caches of the services which depend on the data of the version
+    are cleared when they see it"""
+    version = uuid.uuid4().hex
+    tmp_path = Path(f"{path}.tmp")
+    with open(tmp_path, "w") as out:
+        out.write(version)
+    os.replace(tmp_path, path)
+    return version
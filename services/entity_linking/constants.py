@@ -26,5 +26,17 @@ CONTAINERS_CONFIG_PATH = DATA_PATH / 'containers.yaml'
 LOGS_PATH = DATA_PATH / 'logs'
 
 METRICS_FILENAME = DATA_PATH / "metrics_score_history.csv"
+METRICS_DB_PATH = DATA_PATH / "metrics_history.sqlite"
 
 LOCKFILE = DATA_PATH / 'lockfile'
+INDEX_VERSION_PATH = DATA_PATH / 'index_version'
+
+# precompute nominative forms of the words of the entity dicts on model update
+PRECOMPUTE_LEMMAS = getenv('PRECOMPUTE_LEMMAS', '0') == '1'
+
+# linking requests are coalesced into batches of at least EL_MAX_BATCH_DOCS documents or waiting EL_BATCH_WAIT
+# seconds, at most EL_QUEUE_SIZE requests wait for the model, a request gets 503 after EL_REQUEST_TIMEOUT seconds
+EL_MAX_BATCH_DOCS = int(getenv('EL_MAX_BATCH_DOCS', '32'))
+EL_BATCH_WAIT = float(getenv('EL_BATCH_WAIT', '0.01'))
+EL_QUEUE_SIZE = int(getenv('EL_QUEUE_SIZE', '64'))
+EL_REQUEST_TIMEOUT = float(getenv('EL_REQUEST_TIMEOUT', '60'))
@@ -0,0 +1,80 @@
+import re
+from bisect import bisect_left, bisect_right
+from typing import List, Tuple
+
+
+class SentenceWindows:
+    """Sentences of a document with precomputed offsets and token counts for building the contexts of mentions.
+    The sentence of the mention is found with a binary search over the sentence offsets, the paragraph around it
+    is grown with the prefix sums of token counts, which are computed once for the document.
+
+    Args:
+        sentences_list: sentences of the document
+        sentences_offsets_list: start and end offsets of the sentences
+        re_tokenizer: regular expression of tokens
+    """
+
+    def __init__(self, sentences_list: List[str], sentences_offsets_list: List[Tuple[int, int]],
+                 re_tokenizer: re.Pattern) -> None:
+        self.sentences_list = sentences_list
+        self.re_tokenizer = re_tokenizer
+        num_sentences = min(len(sentences_list), len(sentences_offsets_list))
+        self.starts = [offsets[0] for offsets in sentences_offsets_list[:num_sentences]]
+        self.ends = [offsets[1] for offsets in sentences_offsets_list[:num_sentences]]
+        # binary search gives the first containing sentence only if both offsets are sorted
+        self.is_sorted = all(self.starts[i] <= self.starts[i + 1] and self.ends[i] <= self.ends[i + 1]
+                             for i in range(num_sentences - 1))
+        self.prefix_lens = None
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def find(self, entity_start_offset: int, entity_end_offset: int) -> int:
+        """Returns the number of the first sentence which contains the entity, -1 if there is no such sentence"""
+        if self.is_sorted:
+            # sentences which start before the entity are a prefix, sentences which end after it are a suffix
+            last_num = bisect_right(self.starts, entity_start_offset) - 1
+            first_num = bisect_left(self.ends, entity_end_offset)
+            return first_num if first_num <= last_num else -1
+        for num, (sent_start_offset, sent_end_offset) in enumerate(zip(self.starts, self.ends)):
+            if entity_start_offset >= sent_start_offset and entity_end_offset <= sent_end_offset:
+                return num
+        return -1
+
+    def num_tokens(self, text: str) -> int:
+        return len(re.findall(self.re_tokenizer, text))
+
+    def expand(self, sentence_num: int, cur_len: int, max_len: int) -> Tuple[int, int]:
+        """Grows the paragraph around the sentence by adding the next and the previous sentences by turns while
+        the number of tokens is less than max_len.
+
+        Returns:
+            numbers of the first and the last sentences of the paragraph
+        """
+        if self.prefix_lens is None:
+            self.prefix_lens = [0]
+            for sentence in self.sentences_list:
+                self.prefix_lens.append(self.prefix_lens[-1] + self.num_tokens(sentence))
+        prefix_lens = self.prefix_lens
+        num_sentences = len(self.sentences_list)
+        first_num, last_num = sentence_num, sentence_num
+        can_add_last, can_add_first = True, True
+        # a side which can not be grown never can, since the paragraph only grows
+        while can_add_last and can_add_first:
+            can_add_last = last_num < num_sentences - 1 and \
+                cur_len + prefix_lens[last_num + 2] - prefix_lens[last_num + 1] < max_len
+            if can_add_last:
+                cur_len += prefix_lens[last_num + 2] - prefix_lens[last_num + 1]
+                last_num += 1
+            can_add_first = first_num > 0 and cur_len + prefix_lens[first_num] - prefix_lens[first_num - 1] < max_len
+            if can_add_first:
+                cur_len += prefix_lens[first_num] - prefix_lens[first_num - 1]
+                first_num -= 1
+        if can_add_last:
+            # the largest last sentence number with cur_len + prefix_lens[num + 1] - prefix_lens[last_num + 1] < max_len
+            last_num = max(last_num, min(bisect_left(prefix_lens, max_len - cur_len + prefix_lens[last_num + 1]) - 2,
+                                         num_sentences - 1))
+        elif can_add_first:
+            # the smallest first sentence number with cur_len + prefix_lens[first_num] - prefix_lens[num] < max_len
+            first_num = min(first_num, bisect_right(prefix_lens, prefix_lens[first_num] + cur_len - max_len))
+        return first_num, last_num
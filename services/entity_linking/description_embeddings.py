@@ -0,0 +1,103 @@
+import json
+from logging import getLogger
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+
+from mmap_store import QID_REGEX, pack_q_ids, store_dir
+
+log = getLogger(__name__)
+
+DTYPES = {"float16": np.float16, "int8": np.int8}
+
+
+class DescriptionEmbeddings:
+    """Read-only matrix of embeddings of entity descriptions, memory-mapped from disk. Rows of the matrix are
+    the dense ids of the entities: the positions of their Q-id numbers in the sorted array. Embeddings are stored
+    as float16 or as int8 with a scale for every row.
+
+    Args:
+        path: directory with the matrix files
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        with open(self.path / "meta.json") as fl:
+            self.meta = json.load(fl)
+        self.q_nums = np.load(self.path / "q_nums.npy", mmap_mode="r")
+        self.embeddings = np.load(self.path / "embeddings.npy", mmap_mode="r")
+        self.scales = None
+        if self.meta["dtype"] == "int8":
+            self.scales = np.load(self.path / "scales.npy", mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.q_nums)
+
+    @property
+    def dim(self) -> int:
+        return self.embeddings.shape[1]
+
+    def lookup(self, entities: List[str]) -> np.ndarray:
+        """Returns float32 embeddings of the entities, zero vectors for the entities without description"""
+        q_nums = np.array([int(entity[1:]) if QID_REGEX.fullmatch(entity) else -1 for entity in entities],
+                          dtype=np.int64)
+        embeddings = np.zeros((len(entities), self.dim), dtype=np.float32)
+        if not len(self.q_nums) or not len(entities):
+            return embeddings
+        dense = np.minimum(np.searchsorted(self.q_nums, q_nums), len(self.q_nums) - 1)
+        found = np.nonzero(self.q_nums[dense] == q_nums)[0]
+        rows = dense[found]
+        embeddings[found] = self.embeddings[rows]
+        if self.scales is not None:
+            embeddings[found] *= self.scales[rows][:, None]
+        return embeddings
+
+    def scores(self, candidate_entities_list: List[List[str]], context_embs: np.ndarray) -> List[np.ndarray]:
+        """Returns the dot products of the embeddings of the candidate entities of every mention and the embedding
+        of the context of the mention, the candidates of all the mentions are gathered at once"""
+        entities = [entity for candidate_entities in candidate_entities_list for entity in candidate_entities]
+        lengths = [len(candidate_entities) for candidate_entities in candidate_entities_list]
+        mention_nums = np.repeat(np.arange(len(candidate_entities_list)), lengths)
+        context_embs = np.asarray(context_embs, dtype=np.float32)[:, :self.dim]
+        dots = np.einsum("ij,ij->i", self.lookup(entities), context_embs[mention_nums]) if entities \
+            else np.zeros(0, dtype=np.float32)
+        return np.split(dots, np.cumsum(lengths)[:-1])
+
+
+def save_description_embeddings(entities: List[str], embeddings: np.ndarray, path: Union[str, Path],
+                                dtype: str = "float16") -> bool:
+    """Saves the matrix of embeddings of entity descriptions. Returns False if some entity id is not a Q-id and
+    can not be interned."""
+    path = Path(path)
+    if not all(QID_REGEX.fullmatch(entity) for entity in entities):
+        log.warning(f"description embeddings {path} are not saved, not all entity ids are Q-ids")
+        return False
+    q_nums = pack_q_ids(entities)
+    order = np.argsort(q_nums, kind="stable")
+    embeddings = np.asarray(embeddings, dtype=np.float32)[order]
+    with store_dir(path) as tmp_path:
+        np.save(tmp_path / "q_nums.npy", q_nums[order])
+        if dtype == "int8":
+            scales = np.abs(embeddings).max(axis=1) / 127.0
+            scales[scales == 0.0] = 1.0
+            np.save(tmp_path / "embeddings.npy", np.round(embeddings / scales[:, None]).astype(np.int8))
+            np.save(tmp_path / "scales.npy", scales.astype(np.float32))
+        else:
+            np.save(tmp_path / "embeddings.npy", embeddings.astype(DTYPES[dtype]))
+        with open(tmp_path / "meta.json", "w") as out:
+            json.dump({"kind": "description_embeddings", "dtype": dtype, "num_entities": len(q_nums),
+                       "dim": embeddings.shape[1] if embeddings.ndim == 2 else 0}, out)
+    return True
+
+
+def load_description_embeddings(path: Union[str, Path]) -> Optional[DescriptionEmbeddings]:
+    path = Path(path)
+    if not (path / "meta.json").exists():
+        return None
+    log.info(f"loading description embeddings {path}")
+    return DescriptionEmbeddings(path)
+
+
+def description_embeddings_path(descr_to_emb_filename: Union[str, Path]) -> Path:
+    return Path(descr_to_emb_filename).with_suffix(".emb")
@@ -6,6 +6,9 @@ from nltk.corpus import stopwords
 from deeppavlov.core.models.serializable import Serializable
 from deeppavlov.core.common.file import load_pickle, save_pickle
 from deeppavlov.core.commands.utils import expand_path
+from entity_index import save_entity_index
+from lemmatizer import save_lemma_vocab
+from mmap_store import mmap_path, save_mmap
 
 log = getLogger(__name__)
 
@@ -20,6 +23,8 @@ class EntitiesParser(Serializable):
                  entities_descr_filename: str = "q_to_descr_vx.pickle",
                  types_dict_filename: str = "types_dict.pickle",
                  subclass_dict_filename: str = "subclass_dict.pickle",
+                 entity_index_filename: str = "entity_index",
+                 lemma_vocab_filename: str = "",
                  log_filename: str = "/data/entities_parse_log.txt",
                  filter_tags: bool = True):
 
@@ -35,6 +40,8 @@ class EntitiesParser(Serializable):
         self.q_to_label_filename = q_to_label_filename
         self.types_dict_filename = types_dict_filename
         self.subclass_dict_filename = subclass_dict_filename
+        self.entity_index_filename = entity_index_filename
+        self.lemma_vocab_filename = lemma_vocab_filename
         self.log_filename = log_filename
 
         self.name_to_idlist = defaultdict(list)
@@ -112,6 +119,17 @@ class EntitiesParser(Serializable):
         save_pickle(self.q_to_label, self.save_path / self.q_to_label_filename)
         save_pickle(self.types_dict, self.save_path / self.types_dict_filename)
         save_pickle(self.subclass_dict, self.save_path / self.subclass_dict_filename)
+        # memory-mapped copies of the dicts used by the entity linker
+        save_mmap(self.word_to_idlist, mmap_path(self.save_path / self.word_to_idlist_filename))
+        save_mmap(self.entities_ranking_dict, mmap_path(self.save_path / self.entities_ranking_dict_filename))
+        save_mmap(self.entities_descr, mmap_path(self.save_path / self.entities_descr_filename))
+        save_mmap(self.entities_types_sets, mmap_path(self.save_path / self.entities_types_sets_filename),
+                  set_dict=True)
+        save_mmap(self.q_to_label, mmap_path(self.save_path / self.q_to_label_filename))
+        save_entity_index(self.word_to_idlist, self.entities_types_sets, self.entities_ranking_dict,
+                          self.save_path / self.entity_index_filename)
+        if self.lemma_vocab_filename:
+            save_lemma_vocab(self.word_to_idlist, self.save_path / self.lemma_vocab_filename)
         print("saved files", flush=True)
         
     def log_to_file(self, log_str):
@@ -0,0 +1,131 @@
+import json
+from collections.abc import Mapping
+from logging import getLogger
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from mmap_store import QID_REGEX, MmapStringSet, pack_q_ids, store_dir
+
+log = getLogger(__name__)
+
+TAG_BITS = {"PER": 1, "LOC": 2, "ORG": 4, "AMB": 8}
+
+
+class EntityIndex:
+    """Read-only index of entities interned to dense integer ids. Entities are the rows of the sorted array of
+    Q-id numbers, so the dense id of the Q-id is found with a binary search. Tags of the entities are stored as
+    bitsets (one bit for every tag of TAG_BITS), entities of the words of word_to_idlist are stored as arrays of
+    Q-id numbers and numbers of words in the entity label.
+
+    Args:
+        path: directory with the index files
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.words = MmapStringSet(self.path)
+        self.q_nums = np.load(self.path / "q_nums.npy", mmap_mode="r")
+        self.tag_bits = np.load(self.path / "tag_bits.npy", mmap_mode="r")
+        self.ranking = np.load(self.path / "ranking.npy", mmap_mode="r")
+        self.word_offsets = np.load(self.path / "word_offsets.npy", mmap_mode="r")
+        self.word_q_nums = np.load(self.path / "word_q_nums.npy", mmap_mode="r")
+        self.word_num_words = np.load(self.path / "word_num_words.npy", mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.q_nums)
+
+    def dense_ids(self, q_nums: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns dense ids of the entities and the mask of the entities which are in the index"""
+        q_nums = np.asarray(q_nums, dtype=np.int64)
+        if not len(self.q_nums):
+            return np.zeros(len(q_nums), dtype=np.int64), np.zeros(len(q_nums), dtype=bool)
+        dense = np.minimum(np.searchsorted(self.q_nums, q_nums), len(self.q_nums) - 1)
+        return dense, self.q_nums[dense] == q_nums
+
+    def tags_mask(self, q_nums: np.ndarray, tags: List[str]) -> np.ndarray:
+        """Returns the mask of the entities which have one of the tags or the ambiguous tag"""
+        bits = TAG_BITS["AMB"]
+        for tag in tags:
+            bits |= TAG_BITS.get(tag, 0)
+        dense, found = self.dense_ids(q_nums)
+        return found & ((self.tag_bits[dense] & bits) != 0)
+
+    def word_row(self, word: str) -> int:
+        return self.words.find(word)
+
+    def word_entities(self, rows: List[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns Q-id numbers of the entities of the words in the rows, numbers of words in the entity labels and
+        the positions of the rows the entities belong to"""
+        starts = [int(self.word_offsets[row]) for row in rows]
+        ends = [int(self.word_offsets[row + 1]) for row in rows]
+        if not rows or sum(ends) == sum(starts):
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+        positions = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+        row_positions = np.repeat(np.arange(len(rows)), np.subtract(ends, starts))
+        return self.word_q_nums[positions], self.word_num_words[positions], row_positions
+
+
+def q_nums_of(q_ids: List[str]) -> np.ndarray:
+    """Returns Q-id numbers of the entity ids, -1 for the ids which are not Q-ids"""
+    return np.array([int(q_id[1:]) if QID_REGEX.fullmatch(q_id) else -1 for q_id in q_ids], dtype=np.int64)
+
+
+def save_entity_index(word_to_idlist: Mapping, entities_types_sets: Dict[str, Set[str]],
+                      entities_ranking_dict: Mapping, path: Union[str, Path]) -> bool:
+    """Saves the entity index. Returns False if some entity id is not a Q-id and can not be interned."""
+    path = Path(path)
+    words = list(word_to_idlist)
+    word_entities = [list(word_to_idlist[word]) for word in words]
+    q_ids = {q_id for entities in word_entities for q_id, _ in entities}
+    for tag in TAG_BITS:
+        q_ids.update(entities_types_sets.get(tag, set()))
+    if not all(QID_REGEX.fullmatch(q_id) for q_id in q_ids):
+        log.warning(f"entity index {path} is not saved, not all entity ids are Q-ids")
+        return False
+    q_nums = np.sort(pack_q_ids(list(q_ids)))
+    tag_bits = np.zeros(len(q_nums), dtype=np.uint8)
+    for tag, bit in TAG_BITS.items():
+        tag_q_nums = pack_q_ids(list(entities_types_sets.get(tag, set())))
+        tag_bits[np.searchsorted(q_nums, tag_q_nums)] |= bit
+
+    ranking = np.zeros(len(q_nums), dtype=np.int32)
+    ranked_ids = [q_id for q_id in entities_ranking_dict if QID_REGEX.fullmatch(q_id)]
+    if ranked_ids and len(q_nums):
+        ranked_nums = pack_q_ids(ranked_ids).astype(np.int64)
+        dense = np.minimum(np.searchsorted(q_nums, ranked_nums), len(q_nums) - 1)
+        found = q_nums[dense] == ranked_nums
+        ranks = np.array([entities_ranking_dict[q_id] for q_id in ranked_ids], dtype=np.int32)
+        ranking[dense[found]] = ranks[found]
+
+    word_offsets = np.zeros(len(words) + 1, dtype=np.int64)
+    np.cumsum([len(entities) for entities in word_entities], out=word_offsets[1:])
+    with store_dir(path) as tmp_path:
+        MmapStringSet.save_keys(tmp_path, words)
+        np.save(tmp_path / "q_nums.npy", q_nums)
+        np.save(tmp_path / "tag_bits.npy", tag_bits)
+        np.save(tmp_path / "ranking.npy", ranking)
+        np.save(tmp_path / "word_offsets.npy", word_offsets)
+        np.save(tmp_path / "word_q_nums.npy",
+                pack_q_ids([q_id for entities in word_entities for q_id, _ in entities]))
+        np.save(tmp_path / "word_num_words.npy",
+                np.array([num_words for entities in word_entities for _, num_words in entities], dtype=np.int32))
+        with open(tmp_path / "meta.json", "w") as out:
+            json.dump({"kind": "entity_index", "tag_bits": TAG_BITS, "num_entities": len(q_nums),
+                       "num_words": len(words)}, out)
+    return True
+
+
+def load_entity_index(path: Union[str, Path], num_words: int = None) -> Optional[EntityIndex]:
+    """Loads the entity index if it exists and it has num_words words"""
+    path = Path(path)
+    if not (path / "meta.json").exists():
+        return None
+    entity_index = EntityIndex(path)
+    if num_words is not None and len(entity_index.words) != num_words:
+        log.warning(f"entity index {path} has {len(entity_index.words)} words, word_to_idlist has {num_words}")
+        return None
+    log.info(f"loading entity index {path}")
+    return entity_index
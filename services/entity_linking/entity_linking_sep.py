@@ -12,19 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import multiprocessing
 import re
 import time
 from logging import getLogger
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Tuple, Any, Optional
 from collections import defaultdict
 from string import punctuation
 
 import numpy as np
-import pymorphy2
 import faiss
 import fasttext
 from nltk.corpus import stopwords
-from rapidfuzz import fuzz
 from sklearn.feature_extraction.text import TfidfVectorizer
 from tqdm import tqdm
 
@@ -37,8 +36,45 @@ from deeppavlov.core.common.file import load_pickle, save_pickle
 from deeppavlov.models.kbqa.entity_detection_parser import EntityDetectionParser
 from deeppavlov.models.tokenizers.utils import detokenize
 
+from caches import LRUCache, TTLCache, read_version, text_key
+from context_window import SentenceWindows
+from description_embeddings import description_embeddings_path, load_description_embeddings, \
+    save_description_embeddings
+from entity_index import load_entity_index, q_nums_of
+from faiss_index_factory import build_faiss_index, index_params_path, index_spec, load_index_params, same_structure, \
+    save_index_params, search_parameter, set_search_params
+from fuzzy_matcher import FuzzyMatcher
+from lemmatizer import get_lemmatizer
+from mmap_store import MmapDict, build_label_to_q, label_index_path, label_vectors_path, load_label_index, \
+    load_store, save_label_index
+from sparse_tfidf_index import SparseTfidfIndex, sparse_index_path
+from top_k import top_k_lexicographic
+
 log = getLogger(__name__)
 
+EMBEDDING_SHARD_SIZE = 10000
+EMBEDDING_VECTORIZER = None
+CANDIDATES_LINKER = None
+
+
+def embed_shard(labels: List[str]) -> np.ndarray:
+    """Returns fasttext vectors of the labels, the vectorizer is set by the process which forks the workers"""
+    vectors = np.zeros((len(labels), EMBEDDING_VECTORIZER.get_dimension()), dtype=np.float32)
+    for i, label in enumerate(labels):
+        vectors[i] = EMBEDDING_VECTORIZER.get_word_vector(EntityLinkerSep.ft_word(label))
+    return vectors
+
+
+def init_candidates_worker() -> None:
+    # the workers search in parallel, OpenMP threads of every worker would oversubscribe the cores
+    faiss.omp_set_num_threads(1)
+
+
+def find_candidates_shard(items: List[Tuple[List[str], str, float]]) -> List[Optional[tuple]]:
+    """Finds candidate entities of the shard of entity substrings, the linker is set by the process which forks
+    the workers"""
+    return CANDIDATES_LINKER.find_candidates(items)
+
 
 @register('ner_chunk_model')
 class NerChunkModel(Component):
@@ -203,7 +239,7 @@ class NerChunkModel(Component):
 @register('ner_postprocessor')
 class NerPostprocessor:
     def __init__(self, lemmatize: bool = False, **kwargs):
-        self.morph = pymorphy2.MorphAnalyzer()
+        self.lemmatizer = get_lemmatizer()
         self.lemmatize = lemmatize
         
     def __call__(self, text_batch: List[str], entity_substr_batch: List[List[str]],
@@ -270,7 +306,7 @@ class NerPostprocessor:
                         entity_substr = entity_substr.replace(elem[0], elem[1])
                     if self.lemmatize:
                         entity_substr_tokens = entity_substr.split()
-                        entity_substr_tokens = [self.morph.parse(tok)[0].normal_form for tok in entity_substr_tokens]
+                        entity_substr_tokens = [self.lemmatizer.normal_form(tok) for tok in entity_substr_tokens]
                         lemm_entity_substr = detokenize(entity_substr_tokens)
                     else:
                         lemm_entity_substr = entity_substr
@@ -313,9 +349,12 @@ class EntityLinkerSep(Component, Serializable):
                  fasttext_vectorizer_filename: str,
                  fasttext_faiss_index_filename: str,
                  q_to_label_out_filename: str = '',
+                 entity_index_filename: str = 'entity_index',
+                 lemma_vocab_filename: str = 'lemma_vocab',
                  entity_ranker=None,
                  bert_embedder=None,
                  descr_to_emb_filename: str = None,
+                 descr_emb_dtype: str = "float16",
                  num_ft_faiss_candidate_entities: int = 50,
                  num_tfidf_faiss_candidate_entities: int = 10,
                  num_entities_for_bert_ranking: int = 50,
@@ -323,7 +362,9 @@ class EntityLinkerSep(Component, Serializable):
                  num_ft_faiss_cells: int = 50,
                  tfidf_index_nprobe: int = 3,
                  fasttext_index_nprobe: int = 3,
-                 use_gpu: bool = True,
+                 fasttext_index_type: str = "ivf_flat",
+                 fasttext_index_params: dict = None,
+                 fasttext_index_ef_search: int = 128,
                  save_path: str = None,
                  fit_tfidf_vectorizer: bool = False,
                  fit_fasttext_vectorizer: bool = False,
@@ -342,6 +383,17 @@ class EntityLinkerSep(Component, Serializable):
                  rank_in_runtime: bool = False,
                  tag_thres_probas: dict = {"PER": 0.79, "LOC": 0.79, "ORG": 0.79},
                  bert_emb_batch_size: int = 100,
+                 ranking_batch_tokens: int = 8192,
+                 context_cache_size: int = 10000,
+                 context_cache_ttl: float = 3600.0,
+                 ranker_version: str = '',
+                 num_workers: int = 1,
+                 faiss_num_threads: int = 0,
+                 ft_cache_size: int = 100000,
+                 embedding_num_workers: int = 1,
+                 previous_fasttext_faiss_index_filename: str = '',
+                 candidates_cache_size: int = 50000,
+                 index_version_filename: str = '',
                  log_filename: str = "/data/log_faiss.txt",
                  **kwargs) -> None:
         """
@@ -354,15 +406,23 @@ class EntityLinkerSep(Component, Serializable):
             entities_types_sets_filename: file with entities split into sets of PER, LOC, ORG entity types
             q_to_label_filename: file with labels of entities
             tfidf_vectorizer_filename: filename with TfidfVectorizer data
-            tfidf_faiss_index_filename: file with tfidf Faiss index of words
+            tfidf_faiss_index_filename: file with tfidf Faiss index of words, the sparse tfidf index of words is
+                stored next to it with ".sparse" suffix
             fasttext_vectorizer_filename: filename with fasttext data
             fasttext_faiss_index_filename: file with fasttext Faiss index of entity titles
+            entity_index_filename: directory with the index of entities interned to integer ids, entities are
+                filtered by tags with the index if it exists
             entity_ranker: component deeppavlov.models.kbqa.rel_ranking_bert_infer
             num_faiss_candidate_entities: number of nearest neighbors for the entity substring from the text
             num_entities_for_bert_ranking: number of candidate entities for BERT ranking using description and context
             num_tfidf_faiss_cells: number of Voronoi cells for tfidf Faiss index
             num_ft_faiss_cells: number of Voronoi cells for fasttext Faiss index
-            use_gpu: whether to use GPU for faster search of candidate entities
+            fasttext_index_type: type of the fasttext Faiss index which is built: "ivf_flat", "ivf_pq", "ivf_sq" or
+                "hnsw" (see faiss_index_factory.build_faiss_index)
+            fasttext_index_params: build parameters of the fasttext Faiss index type
+            fasttext_index_ef_search: efSearch of the HNSW fasttext index, fasttext_index_nprobe is used for
+                the IVF indexes; the search parameter tuned by faiss_index_factory and saved with the index is used
+                instead if it exists
             save_path: path to folder with inverted index files
             fit_tfidf_vectorizer: whether to build tfidf index with Faiss library
             fit_fasttext_vectorizer: whether to build fasttext index with Faiss library
@@ -375,21 +435,44 @@ class EntityLinkerSep(Component, Serializable):
             return_confidences: whether to return confidences of entities
             max_text_len: maximum length of text for ranking by context and description
             lemmatize: whether to lemmatize tokens
+            lemma_vocab_filename: directory with precomputed nominative forms of the words of word_to_idlist
+            descr_emb_dtype: "float16" or "int8", type of the matrix of description embeddings which is built from
+                the embeddings of descr_to_emb_filename
+            ranking_batch_tokens: maximal number of tokens (with padding) in a batch of contexts of the ranker or
+                the embedder, the contexts of all the documents of the request are ranked together
+            context_cache_size: maximal number of cached context embeddings (or ranker scores of the context and
+                the candidate entities if rank_in_runtime)
+            context_cache_ttl: lifetime of the cached context embeddings and ranker scores in seconds
+            ranker_version: version of the ranker (or the embedder) model, the cached results of other versions are
+                not used
+            num_workers: number of processes which search candidate entities, the processes are forked when
+                the linker is loaded and share its memory-mapped stores and indexes, ranking stays in the main process
+            faiss_num_threads: number of OpenMP threads of Faiss search, 0 to use the Faiss default
+            ft_cache_size: maximal number of cached fasttext vectors of entity substrings
+            embedding_num_workers: number of processes which embed the labels when the fasttext index is built
+            previous_fasttext_faiss_index_filename: fasttext Faiss index of the previous version, the saved vectors
+                of its labels are reused when the fasttext index is built
+            candidates_cache_size: maximal number of cached candidate entities lists of entity substrings
+            index_version_filename: file with the version of the index, the cache of candidate entities is cleared
+                when the version changes
             **kwargs:
         """
         super().__init__(save_path=save_path, load_path=load_path)
-        self.morph = pymorphy2.MorphAnalyzer()
+        self.lemmatizer = get_lemmatizer()
         self.lemmatize = lemmatize
+        self.lemma_vocab_filename = lemma_vocab_filename
         self.word_to_idlist_filename = word_to_idlist_filename
         self.entities_ranking_filename = entities_ranking_filename
         self.entities_types_sets_filename = entities_types_sets_filename
         self.q_to_label_filename = q_to_label_filename
         self.q_to_label_out_filename = q_to_label_out_filename
+        self.entity_index_filename = entity_index_filename
         self.q_to_descr_filename = q_to_descr_filename
         self.q_to_types_filename = q_to_types_filename
         self.type_to_tag_filename = type_to_tag_filename
         self.type_to_label_filename = type_to_label_filename
         self.descr_to_emb_filename = descr_to_emb_filename
+        self.descr_emb_dtype = descr_emb_dtype
         self.tfidf_vectorizer_filename = tfidf_vectorizer_filename
         self.tfidf_faiss_index_filename = tfidf_faiss_index_filename
         self.fasttext_vectorizer_filename = fasttext_vectorizer_filename
@@ -398,10 +481,18 @@ class EntityLinkerSep(Component, Serializable):
         self.num_tfidf_faiss_candidate_entities = num_tfidf_faiss_candidate_entities
         self.num_ft_faiss_candidate_entities = num_ft_faiss_candidate_entities
         self.num_tfidf_faiss_cells = num_tfidf_faiss_cells
+        # IVF index of the previous versions used L2 distance, flat index used inner product
+        self.tfidf_metric = "l2" if self.num_tfidf_faiss_cells > 1 else "ip"
         self.num_ft_faiss_cells = num_ft_faiss_cells
         self.tfidf_index_nprobe = tfidf_index_nprobe
         self.fasttext_index_nprobe = fasttext_index_nprobe
-        self.use_gpu = use_gpu
+        self.fasttext_index_type = fasttext_index_type
+        self.fasttext_index_params = fasttext_index_params
+        self.fasttext_index_ef_search = fasttext_index_ef_search
+        if kwargs.get("use_gpu"):
+            # candidate search runs on CPU: the sparse tfidf index and the Faiss indexes are searched in the forked
+            # workers, use_gpu of the configs of the previous versions is ignored
+            log.warning("use_gpu is deprecated and ignored, candidate entities are searched on CPU")
         self.entity_ranker = entity_ranker
         self.bert_embedder = bert_embedder
         self.fit_tfidf_vectorizer = fit_tfidf_vectorizer
@@ -427,9 +518,22 @@ class EntityLinkerSep(Component, Serializable):
         self.rank_in_runtime = rank_in_runtime
         self.tag_thres_probas = tag_thres_probas
         self.bert_emb_batch_size = bert_emb_batch_size
+        self.ranking_batch_tokens = ranking_batch_tokens
+        self.context_cache = TTLCache(context_cache_size, context_cache_ttl)
+        self.ranker_version = ranker_version
+        self.ft_vectors_cache = LRUCache(ft_cache_size)
+        self.fuzzy_matcher = FuzzyMatcher()
+        self.candidates_cache = LRUCache(candidates_cache_size)
+        self.index_version_filename = index_version_filename
+        self.index_version = None
+        self.embedding_num_workers = embedding_num_workers
+        self.previous_fasttext_faiss_index_filename = previous_fasttext_faiss_index_filename
+        if faiss_num_threads > 0:
+            faiss.omp_set_num_threads(faiss_num_threads)
         self.log_filename = log_filename
         self.q_to_descr = {}
         self.descr_to_emb = {}
+        self.description_embeddings = None
 
         self.load()
 
@@ -440,98 +544,147 @@ class EntityLinkerSep(Component, Serializable):
             self.tfidf_vectorizer.fit(self.word_list)
             self.matrix = self.tfidf_vectorizer.transform(self.word_list)
             self.log_to_file("tfidf vectorizer, transformed")
-            self.dense_matrix = self.matrix.toarray()
-            if self.num_tfidf_faiss_cells > 1:
-                quantizer = faiss.IndexFlatIP(self.max_tfidf_features)
-                self.tfidf_faiss_index = faiss.IndexIVFFlat(quantizer, self.max_tfidf_features,
-                                                            self.num_tfidf_faiss_cells)
-                self.tfidf_faiss_index.train(self.dense_matrix.astype(np.float32))
-            else:
-                self.tfidf_faiss_index = faiss.IndexFlatIP(self.max_tfidf_features)
-            self.tfidf_faiss_index.add(self.dense_matrix.astype(np.float32))
+            self.tfidf_index = SparseTfidfIndex.build(self.matrix, self.tfidf_metric)
             self.log_to_file("built tfidf index")
             self.save_tfidf_vectorizer_data()
             self.log_to_file("saved tfidf index")
-            if self.use_gpu:
-                res = faiss.StandardGpuResources()
-                self.tfidf_faiss_index = faiss.index_cpu_to_gpu(res, 0, self.tfidf_faiss_index)
 
         if self.fit_fasttext_vectorizer:
             self.log_to_file("started fasttext vectorizer")
-            labels_fasttext_vectors = []
-            with tqdm(total=len(self.labels_list)) as pbar:
-                for label in self.labels_list:
-                    labels_fasttext_vectors.append(self.alies2ft_vec(label))
-                    pbar.update(1)
+            labels_fasttext_vectors = self.embed_labels(self.labels_list)
             self.log_to_file("fasttext vectorizer, processed")
-            fasttext_dim = self.fasttext_vectorizer.get_dimension()
-            quantizer = faiss.IndexFlatIP(fasttext_dim)
-            self.fasttext_faiss_index = faiss.IndexIVFFlat(quantizer, fasttext_dim, self.num_ft_faiss_cells)
-            self.fasttext_faiss_index.train(np.array(labels_fasttext_vectors))
-            self.fasttext_faiss_index.add(np.array(labels_fasttext_vectors))
-            self.log_to_file("built fasttext index")
+            self.fasttext_faiss_index = build_faiss_index(labels_fasttext_vectors, self.fasttext_index_type,
+                                                          self.num_ft_faiss_cells, self.fasttext_index_params)
+            self.log_to_file(f"built fasttext {self.fasttext_index_type} index")
+            self.fasttext_index_spec = self.built_index_spec()
             faiss.write_index(self.fasttext_faiss_index, str(expand_path(self.fasttext_faiss_index_filename)))
+            save_index_params(self.fasttext_index_spec,
+                              index_params_path(expand_path(self.fasttext_faiss_index_filename)))
+            save_label_index(self.label_to_q, label_index_path(expand_path(self.fasttext_faiss_index_filename)))
+            np.save(label_vectors_path(expand_path(self.fasttext_faiss_index_filename)), labels_fasttext_vectors)
             self.log_to_file("saved fasttext index")
 
         if self.fit_bert_embedder:
             q_to_descr_list = list(self.q_to_descr.items())
             descr_length = len(q_to_descr_list)
+            descr_entities = [el[0] for el in q_to_descr_list]
+            descr_embs = np.zeros((descr_length, 100), dtype=np.float32)
 
             num_chunks = descr_length // self.bert_emb_batch_size + int(descr_length % self.bert_emb_batch_size > 0)
             for chunk_num in range(num_chunks):
                 cur_chunk = q_to_descr_list[
                             chunk_num * self.bert_emb_batch_size:(chunk_num + 1) * self.bert_emb_batch_size]
-                batch_entities = [el[0] for el in cur_chunk]
                 batch_descr = [el[1] for el in cur_chunk]
-                context_embs_res = list(self.bert_embedder(batch_descr)[:, :100])
-                for cur_entity, emb in zip(batch_entities, context_embs_res):
-                    self.descr_to_emb[cur_entity] = emb
-            save_pickle(self.descr_to_emb, self.save_path / self.descr_to_emb_filename)
+                descr_embs[chunk_num * self.bert_emb_batch_size:
+                           chunk_num * self.bert_emb_batch_size + len(cur_chunk)] = \
+                    self.bert_embedder(batch_descr)[:, :100]
+            embeddings_path = description_embeddings_path(self.save_path / self.descr_to_emb_filename)
+            if save_description_embeddings(descr_entities, descr_embs, embeddings_path, self.descr_emb_dtype):
+                self.description_embeddings = load_description_embeddings(embeddings_path)
+                self.descr_to_emb = {}
+            else:
+                self.descr_to_emb = dict(zip(descr_entities, descr_embs))
+                save_pickle(self.descr_to_emb, self.save_path / self.descr_to_emb_filename)
 
-        self.tfidf_faiss_index.nprobe = self.tfidf_index_nprobe
-        self.fasttext_faiss_index.nprobe = self.fasttext_index_nprobe
+        if self.fasttext_index_spec is not None:
+            set_search_params(self.fasttext_faiss_index, self.fasttext_index_spec["search"])
+        else:
+            # the downloaded index is the IVF flat index without saved parameters
+            self.fasttext_faiss_index.nprobe = self.fasttext_index_nprobe
+
+        self.num_workers = num_workers
+        self.candidates_pool = None
+        # the linker which builds the indexes is used by the update scripts only and does not need the workers
+        if self.num_workers > 1 and not (self.fit_tfidf_vectorizer or self.fit_fasttext_vectorizer
+                                         or self.fit_bert_embedder):
+            self.start_candidates_pool()
+
+    def start_candidates_pool(self) -> None:
+        """Forks the processes which search candidate entities. They are forked before the first search, so that
+        they copy the loaded linker (the stores and Faiss indexes are shared copy-on-write) and not the state of
+        the OpenMP threads of the search."""
+        global CANDIDATES_LINKER
+        CANDIDATES_LINKER = self
+        self.candidates_pool = multiprocessing.get_context("fork").Pool(self.num_workers,
+                                                                        initializer=init_candidates_worker)
+        log.info(f"started {self.num_workers} candidates search workers")
 
     def load(self) -> None:
-        self.word_to_idlist = load_pickle(self.load_path / self.word_to_idlist_filename)
-        self.word_list = list(self.word_to_idlist.keys())
-        self.entities_ranking_dict = load_pickle(self.load_path / self.entities_ranking_filename)
-        self.entities_types_sets = load_pickle(self.load_path / self.entities_types_sets_filename)
-        self.q_to_label = load_pickle(self.load_path / self.q_to_label_filename)
-        self.q_to_types = load_pickle(self.load_path / self.q_to_types_filename)
-        self.type_to_tag = load_pickle(self.load_path / self.type_to_tag_filename)
-        self.type_to_label = load_pickle(self.load_path / self.type_to_label_filename)
+        # memory-mapped stores built by EntitiesParser.save (or by initial_setup from the downloaded pickles)
+        # are used if they exist, otherwise the pickles are loaded
+        self.word_to_idlist = load_store(self.load_path / self.word_to_idlist_filename)
+        if isinstance(self.word_to_idlist, MmapDict):
+            self.word_list = self.word_to_idlist.keys_list()
+        else:
+            self.word_list = list(self.word_to_idlist.keys())
+        self.entities_ranking_dict = load_store(self.load_path / self.entities_ranking_filename)
+        self.entities_types_sets = load_store(self.load_path / self.entities_types_sets_filename)
+        self.q_to_label = load_store(self.load_path / self.q_to_label_filename)
+        self.q_to_types = load_store(self.load_path / self.q_to_types_filename)
+        self.type_to_tag = load_store(self.load_path / self.type_to_tag_filename)
+        self.type_to_label = load_store(self.load_path / self.type_to_label_filename)
         self.q_to_label_out = None
         if self.q_to_label_out_filename:
-            self.q_to_label_out = load_pickle(self.load_path / self.q_to_label_out_filename)
-        self.label_to_q = {}
-        for q_id in self.q_to_label:
-            for label in self.q_to_label[q_id]:
-                if label in self.label_to_q:
-                    self.label_to_q[label].append(q_id)
-                else:
-                    self.label_to_q[label] = [q_id]
-        self.labels_list = list(self.label_to_q.keys())
+            self.q_to_label_out = load_store(self.load_path / self.q_to_label_out_filename)
         if not self.fit_tfidf_vectorizer:
             self.tfidf_vectorizer = load_pickle(expand_path(self.tfidf_vectorizer_filename))
-            self.tfidf_faiss_index = faiss.read_index(str(expand_path(self.tfidf_faiss_index_filename)))
-            if self.use_gpu:
-                res = faiss.StandardGpuResources()
-                self.tfidf_faiss_index = faiss.index_cpu_to_gpu(res, 0, self.tfidf_faiss_index)
+            self.tfidf_index = SparseTfidfIndex.load(sparse_index_path(expand_path(self.tfidf_faiss_index_filename)))
+            if self.tfidf_index is None or self.tfidf_index.ntotal != len(self.word_list):
+                # the sparse index replaces the dense Faiss index of the previous versions, it is built once
+                # with the saved vectorizer
+                self.log_to_file("building sparse tfidf index")
+                self.tfidf_index = SparseTfidfIndex.build(self.tfidf_vectorizer.transform(self.word_list),
+                                                          self.tfidf_metric)
+                self.tfidf_index.save(sparse_index_path(expand_path(self.tfidf_faiss_index_filename)))
 
         self.fasttext_vectorizer = fasttext.load_model(str(expand_path(self.fasttext_vectorizer_filename)))
+        self.label_to_q = None
+        self.fasttext_index_spec = None
         if not self.fit_fasttext_vectorizer:
             self.fasttext_faiss_index = faiss.read_index(str(expand_path(self.fasttext_faiss_index_filename)))
+            self.fasttext_index_spec = load_index_params(
+                index_params_path(expand_path(self.fasttext_faiss_index_filename)))
+            # the reverse index of labels is built together with the fasttext index, its rows are aligned
+            # with the rows of the index
+            self.label_to_q = load_label_index(label_index_path(expand_path(self.fasttext_faiss_index_filename)),
+                                               self.fasttext_faiss_index.ntotal)
+        self.lower_labels_list = None
+        self.has_label_tokens = False
+        if self.label_to_q is not None:
+            self.labels_list = self.label_to_q.labels_list
+            self.lower_labels_list = self.label_to_q.lower_labels_list
+            self.has_label_tokens = self.label_to_q.tokens is not None
+        else:
+            self.label_to_q = build_label_to_q(self.q_to_label)
+            self.labels_list = list(self.label_to_q.keys())
+
+        if self.lemma_vocab_filename:
+            self.lemmatizer.load_vocab(self.load_path / self.lemma_vocab_filename)
+
+        self.entity_index = None
+        if self.entity_index_filename:
+            self.entity_index = load_entity_index(self.load_path / self.entity_index_filename, len(self.word_list))
 
         if self.q_to_descr_filename:
-            self.q_to_descr = load_pickle(self.load_path / self.q_to_descr_filename)
+            self.q_to_descr = load_store(self.load_path / self.q_to_descr_filename)
 
         if self.descr_to_emb_filename:
-            self.descr_to_emb = load_pickle(self.load_path / self.descr_to_emb_filename)
+            embeddings_path = description_embeddings_path(self.load_path / self.descr_to_emb_filename)
+            self.description_embeddings = load_description_embeddings(embeddings_path)
+            if self.description_embeddings is None:
+                self.descr_to_emb = load_pickle(self.load_path / self.descr_to_emb_filename)
+                # the pickle is converted to the matrix once, it is loaded by the next starts of the service
+                if self.descr_to_emb and save_description_embeddings(
+                        list(self.descr_to_emb), np.stack([np.asarray(emb)[:100] for emb in self.descr_to_emb.values()]),
+                        embeddings_path, self.descr_emb_dtype):
+                    self.description_embeddings = load_description_embeddings(embeddings_path)
+                    self.descr_to_emb = {}
 
     def save(self) -> None:
         pass
 
-    def alies2ft_vec(self, alies):
+    @staticmethod
+    def ft_word(alies) -> str:
         if isinstance(alies, str):
             alies = '_'.join(alies.split(' ')).lower()
         elif isinstance(alies, list):
@@ -539,12 +692,70 @@ class EntityLinkerSep(Component, Serializable):
                 alies = '_'.join(alies).lower()
             else:
                 alies = "_"
-        vec = self.fasttext_vectorizer.get_word_vector(alies)
-        return vec.astype('float32')
+        return alies
+
+    def alies2ft_vec(self, alies):
+        alies = self.ft_word(alies)
+        vec = self.ft_vectors_cache.get(alies)
+        if vec is None:
+            vec = self.fasttext_vectorizer.get_word_vector(alies).astype('float32')
+            self.ft_vectors_cache.put(alies, vec)
+        return vec
+
+    def embed_labels(self, labels: List[str]) -> np.ndarray:
+        """Returns the matrix of fasttext vectors of the labels. Vectors of the labels of the previous fasttext
+        index are taken from its saved matrix, the other labels are embedded in embedding_num_workers processes."""
+        fasttext_dim = self.fasttext_vectorizer.get_dimension()
+        vectors = np.zeros((len(labels), fasttext_dim), dtype=np.float32)
+        new_rows = list(range(len(labels)))
+        if self.previous_fasttext_faiss_index_filename:
+            previous_index_filename = expand_path(self.previous_fasttext_faiss_index_filename)
+            previous_labels = load_label_index(label_index_path(previous_index_filename))
+            previous_vectors_path = label_vectors_path(previous_index_filename)
+            if previous_labels is not None and previous_vectors_path.exists():
+                previous_vectors = np.load(previous_vectors_path, mmap_mode="r")
+                if previous_vectors.shape == (len(previous_labels), fasttext_dim):
+                    previous_rows = [previous_labels.keys_set.find(label) for label in labels]
+                    reused_rows = [row for row, previous_row in enumerate(previous_rows) if previous_row >= 0]
+                    vectors[reused_rows] = previous_vectors[[previous_rows[row] for row in reused_rows]]
+                    new_rows = [row for row, previous_row in enumerate(previous_rows) if previous_row < 0]
+        self.log_to_file(f"embedding {len(new_rows)} labels, {len(labels) - len(new_rows)} vectors are reused")
+
+        new_labels = [labels[row] for row in new_rows]
+        shards = [new_labels[i:i + EMBEDDING_SHARD_SIZE] for i in range(0, len(new_labels), EMBEDDING_SHARD_SIZE)]
+        global EMBEDDING_VECTORIZER
+        EMBEDDING_VECTORIZER = self.fasttext_vectorizer
+        if self.embedding_num_workers > 1 and len(shards) > 1:
+            # forked workers share the fasttext model of the parent process
+            with multiprocessing.get_context("fork").Pool(self.embedding_num_workers) as pool:
+                shard_vectors = list(tqdm(pool.imap(embed_shard, shards), total=len(shards)))
+        else:
+            shard_vectors = [embed_shard(shard) for shard in tqdm(shards)]
+        if shard_vectors:
+            vectors[new_rows] = np.concatenate(shard_vectors)
+        return vectors
+
+    def built_index_spec(self) -> Dict[str, Any]:
+        """Returns the parameters of the built fasttext index. The search parameter tuned for the previous index
+        is kept if the previous index has the same type and build parameters."""
+        if search_parameter(self.fasttext_index_type) == "efSearch":
+            search_value = self.fasttext_index_ef_search
+        else:
+            search_value = self.fasttext_index_nprobe
+        spec = index_spec(self.fasttext_index_type, self.num_ft_faiss_cells, self.fasttext_index_params,
+                          search_value)
+        if self.previous_fasttext_faiss_index_filename:
+            previous_spec = load_index_params(
+                index_params_path(expand_path(self.previous_fasttext_faiss_index_filename)))
+            if same_structure(spec, previous_spec):
+                spec["search"] = previous_spec["search"]
+                if "tuning" in previous_spec:
+                    spec["tuning"] = previous_spec["tuning"]
+        return spec
 
     def save_tfidf_vectorizer_data(self) -> None:
         save_pickle(self.tfidf_vectorizer, expand_path(self.tfidf_vectorizer_filename))
-        faiss.write_index(self.tfidf_faiss_index, str(expand_path(self.tfidf_faiss_index_filename)))
+        self.tfidf_index.save(sparse_index_path(expand_path(self.tfidf_faiss_index_filename)))
         
 
     def __call__(self, entity_substr_batch: List[List[str]],
@@ -790,149 +1001,29 @@ class EntityLinkerSep(Component, Serializable):
                                 for entity_substr in entity_substr_list]
                                for entity_substr_list in entity_substr_batch]
 
+        tm_search_st = time.time()
+        candidates_batch = self.candidate_entities_batch(entity_substr_batch, tags_batch, probas_batch)
+        log.info(f"candidates search time {time.time() - tm_search_st}, "
+                 f"candidates cache {self.candidates_cache.stats()}, fasttext cache {self.ft_vectors_cache.stats()}, "
+                 f"lemmatizer {self.lemmatizer.stats()}")
+
         entity_ids_batch = []
         conf_batch = []
-        for entity_substr_list, entity_offsets_list, sentences_list, sentences_offsets_list, tags_list, probas_list in \
-                zip(entity_substr_batch, entity_offsets_batch, sentences_batch, sentences_offsets_batch, tags_batch,
-                    probas_batch):
-            entity_ids_list, conf_list = [], []
+        ranking_batch = []
+        for entity_substr_list, entity_offsets_list, sentences_list, sentences_offsets_list, doc_candidates in \
+                zip(entity_substr_batch, entity_offsets_batch, sentences_batch, sentences_offsets_batch,
+                    candidates_batch):
+            entity_ids_list, conf_list, ranking = [], [], None
             if entity_substr_list:
                 try:
                     tm_ind_st = time.time()
-                    ft_entity_emb_list = [self.alies2ft_vec(entity_substr) for entity_substr in entity_substr_list]
-                    ft_res = []
-                    if ft_entity_emb_list:
-                        ft_res = self.fasttext_faiss_index.search(np.array(ft_entity_emb_list),
-                                                                  self.num_ft_faiss_candidate_entities)
-                    D_ft_all, I_ft_all = [], []
-                    if len(ft_res) == 2:
-                        D_ft_all, I_ft_all = ft_res
-                    words = []
-                    entity_substr_num = []
-                    for i, entity_substr in enumerate(entity_substr_list):
-                        words += entity_substr
-                        entity_substr_num += [i for _ in entity_substr]
-
-                    ent_substr_tfidfs = self.tfidf_vectorizer.transform(words).toarray().astype(np.float32)
-                    D_all, I_all = self.tfidf_faiss_index.search(ent_substr_tfidfs, self.num_tfidf_faiss_candidate_entities)
-
-                    ind_i = 0
-                    candidate_entities_dict = {index: [] for index in range(len(entity_substr_list))}
-                    candidate_entities_ft_total = [[] for _ in entity_substr_list]
+                    if doc_candidates is None:
+                        raise ValueError("search of candidate entities failed")
                     substr_lens = [len(entity_substr) for entity_substr in entity_substr_list]
-                    for i, (entity_substr, tag, proba, cand_entity_len) in \
-                            enumerate(zip(entity_substr_list, tags_list, probas_list, substr_lens)):
-                        for word in entity_substr:
-                            candidate_entities = {}
-                            entities_set = set()
-                            if self.lemmatize:
-                                morph_parsed_word = self.morph_parse(word)
-                            else:
-                                morph_parsed_word = word
-                            if word in self.word_to_idlist or morph_parsed_word in self.word_to_idlist:
-                                entities_set = self.word_to_idlist.get(word, set())
-                                if tag == "ORG":
-                                    entities_set_1 = self.filter_entities_by_tags(entities_set, "ORG", proba)
-                                    entities_set_2 = self.filter_entities_by_tags(entities_set, "LOC", proba)
-                                    entities_set = entities_set_1.union(entities_set_2)
-                                else:
-                                    entities_set = self.filter_entities_by_tags(entities_set, tag, proba)
-                                if word != morph_parsed_word:
-                                    entities_set = entities_set.union(self.word_to_idlist.get(morph_parsed_word, set()))
-                                    if tag == "ORG":
-                                        entities_set_1 = self.filter_entities_by_tags(entities_set, "ORG", proba)
-                                        entities_set_2 = self.filter_entities_by_tags(entities_set, "LOC", proba)
-                                        entities_set = entities_set_1.union(entities_set_2)
-                                    else:
-                                        entities_set = self.filter_entities_by_tags(entities_set, tag, proba)
-                                for entity in entities_set:
-                                    candidate_entities[entity] = 1.0
-                            else:
-                                scores_list = D_all[ind_i]
-                                ind_list = I_all[ind_i]
-                                if self.num_tfidf_faiss_cells > 1:
-                                    scores_list = [1.0 - score for score in scores_list]
-                                for ind, score in zip(ind_list, scores_list):
-                                    entities_set = self.word_to_idlist[self.word_list[ind]]
-                                    entities_set = self.filter_entities_by_tags(entities_set, tag, proba)
-                                    for entity in entities_set:
-                                        if entity in candidate_entities:
-                                            if score > candidate_entities[entity]:
-                                                candidate_entities[entity] = score
-                                        else:
-                                            candidate_entities[entity] = score
-                            candidate_entities_dict[i] += [(entity, cand_entity_len, score)
-                                                           for (entity, cand_entity_len), score
-                                                           in candidate_entities.items()]
-                            ind_i += 1
-
-                    if isinstance(D_ft_all, np.ndarray):
-                        candidate_entities_ft_dict = {index: [] for index in range(len(entity_substr_list))}
-                        for index, (entity_substr, scores_list, ind_list, tag, proba) \
-                                in enumerate(zip(entity_substr_list, D_ft_all, I_ft_all, tags_list, probas_list)):
-                            entities_set = set()
-                            for ind, score in zip(ind_list, scores_list):
-                                if score < 400.0:
-                                    entity_label = self.labels_list[ind]
-                                    cur_entity_tokens = set([token.lower() for token in entity_substr])
-                                    cur_entity_label_tokens = set(entity_label.lower().split())
-                                    inters_tokens = cur_entity_tokens.intersection(cur_entity_label_tokens)
-                                    num_matches = 0
-                                    for cur_entity_tok in cur_entity_tokens:
-                                        for cur_entity_label_tok in cur_entity_label_tokens:
-                                            if cur_entity_tok[:2] == cur_entity_label_tok[:2] \
-                                                    and (fuzz.ratio(cur_entity_tok, cur_entity_label_tok) > 70.0 \
-                                                    or (len(cur_entity_tok) == 3 and len(cur_entity_label_tok) == 3)):
-                                                num_matches += 1
-                                                break
-                                    if (len(cur_entity_tokens) == 1 and num_matches == 1) \
-                                            or (len(cur_entity_tokens) == 2 and num_matches == 2) \
-                                            or (len(cur_entity_tokens) > 2 and abs(num_matches - len(cur_entity_tokens)) <= 1):
-                                        if inters_tokens:
-                                            fuzz_ratio = len(inters_tokens) / max(len(cur_entity_tokens),
-                                                                                  len(cur_entity_label_tokens))
-                                        else:
-                                            fuzz_ratio = fuzz.ratio(' '.join(entity_substr).lower(),
-                                                                    entity_label.lower()) * 0.01
-                                        for entity_id in self.label_to_q[entity_label]:
-                                            entities_set.add((entity_id, fuzz_ratio))
-                            entities_set = self.filter_entities_by_tags(entities_set, tag, proba)
-                            candidate_entities_ft_dict[index] = list(entities_set)
-                        candidate_entities_ft_total = list(candidate_entities_ft_dict.values())
-
-                    candidate_entities_total = candidate_entities_dict.values()
-                    candidate_entities_total = [self.sum_scores(candidate_entities, substr_len)
-                                                for candidate_entities, substr_len in
-                                                zip(candidate_entities_total, substr_lens)]
-                    candidate_entities_total = [list(candidate_entities) for candidate_entities in candidate_entities_total]
-
                     candidate_entities_list = []
                     entities_scores_list = []
-                    for entity_substr, candidate_entities, candidate_entities_ft \
-                            in zip(entity_substr_list, candidate_entities_total, candidate_entities_ft_total):
-                        log.info(f"{entity_substr} candidate_entities before ranking {candidate_entities[:10]}")
-                        candidate_entities_dict = {}
-                        for entity, score in candidate_entities:
-                            candidate_entities_dict[entity] = score
-                        for entity, fuzz_score in candidate_entities_ft:
-                            if entity in candidate_entities_dict:
-                                score = candidate_entities_dict[entity]
-                                candidate_entities_dict[entity] = max(score, fuzz_score)
-                            else:
-                                candidate_entities_dict[entity] = fuzz_score
-                        candidate_entities = candidate_entities_dict.items()
-
-                        candidate_entities = [candidate_entity + (self.entities_ranking_dict.get(candidate_entity[0], 0),)
-                                              for candidate_entity in candidate_entities]
-                        candidate_entities = sorted(candidate_entities, key=lambda x: (x[1], x[2]), reverse=True)
-
-                        log.info(f"candidate_entities {candidate_entities[:10]}")
-                        entities_scores = {entity: (substr_score, pop_score)
-                                           for entity, substr_score, pop_score in candidate_entities}
-                        candidate_entities = [candidate_entity[0] for candidate_entity
-                                              in candidate_entities][:self.num_entities_for_bert_ranking]
-                        conf = [candidate_entity[1:] for candidate_entity
-                                in candidate_entities][:self.num_entities_for_bert_ranking]
+                    for entity_substr, (candidate_entities, conf, entities_scores) in \
+                            zip(entity_substr_list, doc_candidates):
                         log.info(f"{entity_substr} candidate_entities before bert ranking {candidate_entities[:10]}")
                         candidate_entities_list.append(candidate_entities)
                         if self.num_entities_to_return == 1 and candidate_entities:
@@ -944,59 +1035,365 @@ class EntityLinkerSep(Component, Serializable):
                         entities_scores_list.append(entities_scores)
                     tm_ind_end = time.time()
                     log.info(f"search by index time {tm_ind_end - tm_ind_st}")
-                    tm_descr_st = time.time()
                     if self.use_descriptions:
-                        if self.rank_in_runtime:
-                            entity_ids_list, conf_list = self.rank_by_description_runtime(entity_substr_list,
-                                                                                          entity_offsets_list,
-                                                                                          candidate_entities_list,
-                                                                                          tags_list,
-                                                                                          entities_scores_list,
-                                                                                          sentences_list,
-                                                                                          sentences_offsets_list,
-                                                                                          substr_lens)
-                        else:
-                            entity_ids_list, conf_list = self.rank_by_description(entity_substr_list, entity_offsets_list,
-                                                                                  candidate_entities_list, tags_list,
-                                                                                  entities_scores_list, sentences_list,
-                                                                                  sentences_offsets_list, substr_lens)
-                    tm_descr_end = time.time()
-                    log.info(f"description time {tm_descr_end - tm_descr_st}")
+                        sentence_windows = SentenceWindows(sentences_list, sentences_offsets_list, self.re_tokenizer)
+                        contexts = [self.description_context(entity_offsets, sentence_windows)
+                                    for entity_offsets in entity_offsets_list]
+                        ranking = (contexts, candidate_entities_list, entities_scores_list, substr_lens)
                 except:
-                    if self.num_entities_to_return == 1:
-                        entity_ids_list = ["ERROR" for _ in entity_substr_list]
-                        conf_list = [(0.0, 0, 0.0) for _ in entity_substr_list]
-                    else:
-                        entity_ids_list = [["ERROR"] for _ in entity_substr_list]
-                        conf_list = [[(0.0, 0, 0.0)] for _ in entity_substr_list]
-                if entity_substr_list and entity_ids_list[0] == []:
-                    entity_ids_list = [["Not Found"] for _ in entity_substr_list]
-                    conf_list = [[(0.0, 0, 0.0)] for _ in entity_substr_list]
-                
-                corr_entity_ids_list = []
-                corr_conf_list = []
-                for entity_ids, conf in zip(entity_ids_list, conf_list):
-                    if entity_ids == []:
-                        corr_entity_ids_list.append(["Not Found"])
-                        corr_conf_list.append([(0.0, 0, 0.0)])
-                    else:
-                        corr_entity_ids_list.append(entity_ids)
-                        corr_conf_list.append(conf)
-                entity_ids_list = corr_entity_ids_list
-                conf_list = corr_conf_list
-
+                    entity_ids_list, conf_list = self.error_entities(entity_substr_list)
             entity_ids_batch.append(entity_ids_list)
             conf_batch.append(conf_list)
+            ranking_batch.append(ranking)
+
+        tm_descr_st = time.time()
+        scores_batch = self.description_scores_batch(ranking_batch)
+        log.info(f"description time {time.time() - tm_descr_st}, context cache {self.context_cache.stats()}")
+
+        for doc_num, (entity_substr_list, tags_list, ranking, scores_list) in \
+                enumerate(zip(entity_substr_batch, tags_batch, ranking_batch, scores_batch)):
+            if not entity_substr_list:
+                continue
+            entity_ids_list, conf_list = entity_ids_batch[doc_num], conf_batch[doc_num]
+            if ranking is not None:
+                _, candidate_entities_list, entities_scores_list, substr_lens = ranking
+                try:
+                    if scores_list is None:
+                        raise ValueError("ranking by description failed")
+                    if self.rank_in_runtime:
+                        entity_ids_list, conf_list = self.select_by_description_runtime(
+                            entity_substr_list, candidate_entities_list, tags_list, entities_scores_list, substr_lens,
+                            scores_list)
+                    else:
+                        entity_ids_list, conf_list = self.select_by_description(
+                            entity_substr_list, candidate_entities_list, tags_list, entities_scores_list, substr_lens,
+                            scores_list)
+                except:
+                    entity_ids_list, conf_list = self.error_entities(entity_substr_list)
+            if entity_substr_list and entity_ids_list[0] == []:
+                entity_ids_list = [["Not Found"] for _ in entity_substr_list]
+                conf_list = [[(0.0, 0, 0.0)] for _ in entity_substr_list]
+
+            corr_entity_ids_list = []
+            corr_conf_list = []
+            for entity_ids, conf in zip(entity_ids_list, conf_list):
+                if entity_ids == []:
+                    corr_entity_ids_list.append(["Not Found"])
+                    corr_conf_list.append([(0.0, 0, 0.0)])
+                else:
+                    corr_entity_ids_list.append(entity_ids)
+                    corr_conf_list.append(conf)
+            entity_ids_batch[doc_num] = corr_entity_ids_list
+            conf_batch[doc_num] = corr_conf_list
 
         return entity_ids_batch, conf_batch
 
-    def morph_parse(self, word):
-        morph_parse_tok = self.morph.parse(word)[0]
-        if morph_parse_tok.tag.POS in {"NOUN", "ADJ", "ADJF"}:
-            normal_form = morph_parse_tok.inflect({"nomn"}).word
+    def error_entities(self, entity_substr_list: List[List[str]]) -> Tuple[list, list]:
+        if self.num_entities_to_return == 1:
+            return ["ERROR" for _ in entity_substr_list], [(0.0, 0, 0.0) for _ in entity_substr_list]
+        return [["ERROR"] for _ in entity_substr_list], [[(0.0, 0, 0.0)] for _ in entity_substr_list]
+
+    def description_scores_batch(self, ranking_batch: List[Optional[tuple]]) -> List[Optional[list]]:
+        """Scores the candidate entities of the mentions of all the documents of the batch with one batch-wide
+        call of the ranker (or the embedder). If it fails, the documents are scored one by one, so the error of one
+        document does not fail the others.
+
+        Args:
+            ranking_batch: for every document None if it is not ranked, otherwise (contexts of the mentions,
+                candidate entities of the mentions, dicts of entities scores, lengths of the substrings)
+
+        Returns:
+            for every ranked document the lists of (entity, score) of the mentions, None if the scoring failed
+        """
+        doc_nums = [doc_num for doc_num, ranking in enumerate(ranking_batch) if ranking is not None]
+        scores_batch = [None] * len(ranking_batch)
+        if not doc_nums:
+            return scores_batch
+        scores_func = self.ranker_scores_batch if self.rank_in_runtime else self.embedder_scores_batch
+        try:
+            docs_scores = scores_func([ranking_batch[doc_num][0] for doc_num in doc_nums],
+                                      [ranking_batch[doc_num][1] for doc_num in doc_nums])
+            for doc_num, scores_list in zip(doc_nums, docs_scores):
+                scores_batch[doc_num] = scores_list
+        except Exception as e:
+            log.warning(f"batch ranking by description failed: {e}, ranking documents one by one")
+            for doc_num in doc_nums:
+                try:
+                    scores_batch[doc_num] = scores_func([ranking_batch[doc_num][0]], [ranking_batch[doc_num][1]])[0]
+                except Exception as e:
+                    log.warning(f"ranking by description of document {doc_num} failed: {e}")
+        return scores_batch
+
+    def check_index_version(self) -> None:
+        """Clears the cache of candidate entities if update_faiss or aliases update published a new index version"""
+        if not self.index_version_filename:
+            return
+        index_version = read_version(expand_path(self.index_version_filename))
+        if index_version != self.index_version:
+            log.info(f"index version changed from {self.index_version} to {index_version}, clearing candidates cache")
+            self.candidates_cache.clear()
+            if self.rank_in_runtime:
+                # ranker scores depend on the descriptions of the entities
+                self.context_cache.clear()
+            self.index_version = index_version
+
+    def candidates_key(self, entity_substr: List[str], tag: str, proba: float) -> tuple:
+        """Candidate entities depend on the tokens of the substring, the tag and which thresholds of tags the
+        probability of the tag exceeds"""
+        return tuple(entity_substr), tag, tuple(proba > thres for _, thres in sorted(self.tag_thres_probas.items()))
+
+    def candidate_entities_batch(self, entity_substr_batch: List[List[List[str]]], tags_batch: List[List[str]],
+                                 probas_batch: List[List[float]]) -> List[Optional[List[tuple]]]:
+        """Returns context-independent candidate entities of the entity substrings of every document: the cached
+        ones or found with one search per index for all not cached substrings of the batch (or of the shard of
+        the batch if the substrings are sharded across num_workers processes).
+
+        Returns:
+            for every document None if the search failed, otherwise list of (candidate entities, their scores,
+            dict of entities and scores) for every entity substring
+        """
+        self.check_index_version()
+        keys_batch = [[self.candidates_key(entity_substr, tag, proba)
+                       for entity_substr, tag, proba in zip(entity_substr_list, tags_list, probas_list)]
+                      for entity_substr_list, tags_list, probas_list in
+                      zip(entity_substr_batch, tags_batch, probas_batch)]
+        found_candidates, not_cached = {}, {}
+        for entity_substr_list, tags_list, probas_list, keys in \
+                zip(entity_substr_batch, tags_batch, probas_batch, keys_batch):
+            for entity_substr, tag, proba, key in zip(entity_substr_list, tags_list, probas_list, keys):
+                if key in found_candidates or key in not_cached:
+                    continue
+                candidates = self.candidates_cache.get(key)
+                if candidates is None:
+                    not_cached[key] = (entity_substr, tag, proba)
+                else:
+                    found_candidates[key] = candidates
+
+        if not_cached:
+            if self.candidates_pool is not None:
+                items = list(not_cached.values())
+                shard_size = -(-len(items) // self.num_workers)
+                shards = [items[i:i + shard_size] for i in range(0, len(items), shard_size)]
+                try:
+                    candidates_list = [candidates for shard_candidates in
+                                       self.candidates_pool.map(find_candidates_shard, shards)
+                                       for candidates in shard_candidates]
+                except Exception:
+                    log.exception("search of candidate entities in the workers failed")
+                    candidates_list = []
+            else:
+                candidates_list = self.find_candidates(list(not_cached.values()))
+            for key, candidates in zip(not_cached, candidates_list):
+                if candidates is not None:
+                    found_candidates[key] = candidates
+                    self.candidates_cache.put(key, candidates)
+
+        candidates_batch = []
+        for keys in keys_batch:
+            if all(key in found_candidates for key in keys):
+                candidates_batch.append([found_candidates[key] for key in keys])
+            else:
+                candidates_batch.append(None)
+        return candidates_batch
+
+    def find_candidates(self, items: List[Tuple[List[str], str, float]]) -> List[Optional[tuple]]:
+        """Finds candidate entities of the entity substrings with one search per index.
+
+        Args:
+            items: (tokens of the entity substring, tag, probability of the tag)
+
+        Returns:
+            for every entity substring None if the search failed, otherwise (candidate entities, their scores,
+            dict of entities and scores)
+        """
+        try:
+            search_results = self.search_batch([entity_substr for entity_substr, _, _ in items])
+        except Exception:
+            log.exception("search of candidate entities failed")
+            return [None for _ in items]
+        candidates_list = []
+        for (entity_substr, tag, proba), search_result in zip(items, search_results):
+            try:
+                candidates_list.append(self.mention_candidates(entity_substr, tag, proba, *search_result))
+            except Exception:
+                log.exception(f"search of candidate entities of {entity_substr} failed")
+                candidates_list.append(None)
+        return candidates_list
+
+    def search_batch(self, entity_substrs: List[List[str]]) \
+            -> List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """Searches fasttext vectors of the entity substrings and tfidf vectors of their words with one search
+        per index.
+
+        Args:
+            entity_substrs: tokenized entity substrings
+
+        Returns:
+            fasttext distances, fasttext ids, tfidf distances and tfidf ids for every entity substring, tfidf results
+            have a row for every word of the substring
+        """
+        words = [word for entity_substr in entity_substrs for word in entity_substr]
+        D_ft = np.zeros((0, self.num_ft_faiss_candidate_entities), dtype=np.float32)
+        I_ft = np.zeros((0, self.num_ft_faiss_candidate_entities), dtype=np.int64)
+        D_tfidf = np.zeros((0, self.num_tfidf_faiss_candidate_entities), dtype=np.float32)
+        I_tfidf = np.zeros((0, self.num_tfidf_faiss_candidate_entities), dtype=np.int64)
+        if entity_substrs:
+            ft_entity_emb_list = [self.alies2ft_vec(entity_substr) for entity_substr in entity_substrs]
+            D_ft, I_ft = self.fasttext_faiss_index.search(np.array(ft_entity_emb_list),
+                                                          self.num_ft_faiss_candidate_entities)
+        if words:
+            D_tfidf, I_tfidf = self.tfidf_index.search(self.tfidf_vectorizer.transform(words),
+                                                       self.num_tfidf_faiss_candidate_entities)
+
+        search_results = []
+        word_start = 0
+        for i, entity_substr in enumerate(entity_substrs):
+            word_end = word_start + len(entity_substr)
+            search_results.append((D_ft[i], I_ft[i], D_tfidf[word_start:word_end], I_tfidf[word_start:word_end]))
+            word_start = word_end
+        return search_results
+
+    def mention_candidates(self, entity_substr: List[str], tag: str, proba: float,
+                           D_ft: np.ndarray, I_ft: np.ndarray, D_words: np.ndarray, I_words: np.ndarray) \
+            -> Tuple[List[str], List[Tuple[float, int]], Dict[str, Tuple[float, int]]]:
+        """Finds candidate entities of the entity substring by tfidf search of its words and fasttext search of
+        the substring, selects the top ones by the substring match score and popularity.
+
+        Returns:
+            top num_entities_for_bert_ranking candidate entities, their (substring score, popularity) and the dict
+            of the candidate entities and their scores
+        """
+        substr_len = len(entity_substr)
+        candidate_entities_words = []
+        for word, word_scores, word_inds in zip(entity_substr, D_words, I_words):
+            if self.lemmatize:
+                morph_parsed_word = self.morph_parse(word)
+            else:
+                morph_parsed_word = word
+            scores_list = word_scores
+            if self.num_tfidf_faiss_cells > 1:
+                scores_list = [1.0 - score for score in scores_list]
+            if self.entity_index is not None:
+                candidate_entities = self.word_candidate_entities_ids(word, morph_parsed_word, tag, proba,
+                                                                      word_inds, scores_list)
+            else:
+                candidate_entities = self.word_candidate_entities(word, morph_parsed_word, tag, proba, word_inds,
+                                                                  scores_list)
+            candidate_entities_words += [(entity, cand_entity_len, score)
+                                         for (entity, cand_entity_len), score in candidate_entities.items()]
+
+        entities_set = set()
+        close_inds = [ind for ind, score in zip(I_ft, D_ft) if score < 400.0]
+        entity_labels = [self.labels_list[ind] for ind in close_inds]
+        lower_labels, labels_tokens = None, None
+        if self.has_label_tokens:
+            # the label is lowercased by the matcher only if it is accepted without common tokens
+            labels_tokens = [self.label_to_q.label_tokens(ind) for ind in close_inds]
+        elif self.lower_labels_list is not None:
+            lower_labels = [self.lower_labels_list[ind] for ind in close_inds]
+        fuzz_ratios = self.fuzzy_matcher.match(entity_substr, entity_labels, lower_labels, labels_tokens)
+        for entity_label, fuzz_ratio in zip(entity_labels, fuzz_ratios):
+            if fuzz_ratio is not None:
+                for entity_id in self.label_to_q[entity_label]:
+                    entities_set.add((entity_id, fuzz_ratio))
+        candidate_entities_ft = list(self.filter_entities_by_tags(entities_set, tag, proba))
+
+        candidate_entities = list(self.sum_scores(candidate_entities_words, substr_len))
+        log.info(f"{entity_substr} candidate_entities before ranking {candidate_entities[:10]}")
+        candidate_entities_dict = {}
+        for entity, score in candidate_entities:
+            candidate_entities_dict[entity] = score
+        for entity, fuzz_score in candidate_entities_ft:
+            if entity in candidate_entities_dict:
+                score = candidate_entities_dict[entity]
+                candidate_entities_dict[entity] = max(score, fuzz_score)
+            else:
+                candidate_entities_dict[entity] = fuzz_score
+
+        entities = list(candidate_entities_dict)
+        substr_scores = list(candidate_entities_dict.values())
+        pop_scores = self.popularity(entities)
+        top = top_k_lexicographic([substr_scores, pop_scores], self.num_entities_for_bert_ranking)
+        candidate_entities = [(entities[i], substr_scores[i], pop_scores[i]) for i in top.tolist()]
+        log.info(f"candidate_entities {candidate_entities[:10]}")
+        # only the scores of the top candidates are used by ranking
+        entities_scores = {entity: (substr_score, pop_score) for entity, substr_score, pop_score in candidate_entities}
+        conf = [candidate_entity[1:] for candidate_entity in candidate_entities]
+        candidate_entities = [candidate_entity[0] for candidate_entity in candidate_entities]
+        return candidate_entities, conf, entities_scores
+
+    def popularity(self, entities: List[str]) -> List[int]:
+        """Returns popularity scores of the entities, they are taken from the ranking array of the entity index for
+        the entities of the index and from entities_ranking_dict for the rest"""
+        if self.entity_index is None:
+            return [self.entities_ranking_dict.get(entity, 0) for entity in entities]
+        dense, found = self.entity_index.dense_ids(q_nums_of(entities))
+        pop_scores = self.entity_index.ranking[dense].tolist()
+        return [pop_score if is_found else self.entities_ranking_dict.get(entity, 0)
+                for entity, pop_score, is_found in zip(entities, pop_scores, found.tolist())]
+
+    def word_candidate_entities(self, word: str, morph_parsed_word: str, tag: str, proba: float,
+                                ind_list: List[int], scores_list: List[float]) -> Dict[Tuple[str, int], float]:
+        candidate_entities = {}
+        if word in self.word_to_idlist or morph_parsed_word in self.word_to_idlist:
+            entities_set = self.word_to_idlist.get(word, set())
+            if tag == "ORG":
+                entities_set_1 = self.filter_entities_by_tags(entities_set, "ORG", proba)
+                entities_set_2 = self.filter_entities_by_tags(entities_set, "LOC", proba)
+                entities_set = entities_set_1.union(entities_set_2)
+            else:
+                entities_set = self.filter_entities_by_tags(entities_set, tag, proba)
+            if word != morph_parsed_word:
+                entities_set = entities_set.union(self.word_to_idlist.get(morph_parsed_word, set()))
+                if tag == "ORG":
+                    entities_set_1 = self.filter_entities_by_tags(entities_set, "ORG", proba)
+                    entities_set_2 = self.filter_entities_by_tags(entities_set, "LOC", proba)
+                    entities_set = entities_set_1.union(entities_set_2)
+                else:
+                    entities_set = self.filter_entities_by_tags(entities_set, tag, proba)
+            for entity in entities_set:
+                candidate_entities[entity] = 1.0
+        else:
+            for ind, score in zip(ind_list, scores_list):
+                if ind < 0:
+                    continue
+                entities_set = self.word_to_idlist[self.word_list[ind]]
+                entities_set = self.filter_entities_by_tags(entities_set, tag, proba)
+                for entity in entities_set:
+                    if entity in candidate_entities:
+                        if score > candidate_entities[entity]:
+                            candidate_entities[entity] = score
+                    else:
+                        candidate_entities[entity] = score
+        return candidate_entities
+
+    def word_candidate_entities_ids(self, word: str, morph_parsed_word: str, tag: str, proba: float,
+                                    ind_list: List[int], scores_list: List[float]) -> Dict[Tuple[str, int], float]:
+        """The same as word_candidate_entities, entities of the words are filtered by tags with one vectorized
+        mask over the arrays of the entity index"""
+        rows = list({self.entity_index.word_row(word), self.entity_index.word_row(morph_parsed_word)} - {-1})
+        exact_match = bool(rows)
+        if exact_match:
+            tags = ["ORG", "LOC"] if tag == "ORG" else [tag]
+            row_scores = np.ones(len(rows), dtype=np.float32)
         else:
-            normal_form = morph_parse_tok.normal_form
-        return normal_form
+            tags = [tag]
+            rows = [int(ind) for ind in ind_list if ind >= 0]
+            row_scores = np.array([score for ind, score in zip(ind_list, scores_list) if ind >= 0], dtype=np.float32)
+        q_nums, num_words, row_positions = self.entity_index.word_entities(rows)
+        if proba > self.tag_thres_probas[tag]:
+            mask = self.entity_index.tags_mask(q_nums, tags)
+            q_nums, num_words, row_positions = q_nums[mask], num_words[mask], row_positions[mask]
+        candidate_entities = {}
+        for q_num, entity_num_words, score in zip(q_nums.tolist(), num_words.tolist(),
+                                                  row_scores[row_positions].tolist()):
+            entity = (f"Q{q_num}", entity_num_words)
+            if score > candidate_entities.get(entity, -np.inf):
+                candidate_entities[entity] = score
+        return candidate_entities
+
+    def morph_parse(self, word):
+        return self.lemmatizer.nominative(word)
 
     def sum_scores(self, candidate_entities: List[Tuple[str, int]], substr_len: int) -> List[Tuple[str, float]]:
         entities_with_scores_sum = defaultdict(int)
@@ -1015,6 +1412,172 @@ class EntityLinkerSep(Component, Serializable):
 
         return entities_with_scores
 
+    def description_context(self, entity_offsets: List[int], sentence_windows: SentenceWindows) -> Tuple[str, str]:
+        """Returns the context of the entity for ranking by description and the numbers of the sentences of
+        the context"""
+        entity_start_offset, entity_end_offset = entity_offsets
+        context_sent_nums = set()
+        log.info(f"entity_offsets {entity_start_offset}, {entity_end_offset}")
+        sentence = ""
+        rel_start_offset = 0
+        rel_end_offset = 0
+        found_sentence_num = sentence_windows.find(entity_start_offset, entity_end_offset)
+        if found_sentence_num >= 0:
+            sentence = sentence_windows.sentences_list[found_sentence_num]
+            sent_start_offset = sentence_windows.starts[found_sentence_num]
+            rel_start_offset = entity_start_offset - sent_start_offset
+            rel_end_offset = entity_end_offset - sent_start_offset
+        log.info(f"rank, found sentence {sentence}")
+        log.info(f"rank, relative offsets {rel_start_offset}, {rel_end_offset}")
+        context = ""
+        if sentence:
+            context_sent_nums.add(found_sentence_num)
+            start_of_sentence = 0
+            end_of_sentence = len(sentence)
+            if len(sentence) > self.max_text_len:
+                start_of_sentence = max(rel_start_offset - self.max_text_len // 2, 0)
+                end_of_sentence = min(rel_end_offset + self.max_text_len // 2, len(sentence))
+            if self.include_mention:
+                context = sentence[start_of_sentence:rel_start_offset] + "[ENT]" + \
+                          sentence[rel_start_offset:rel_end_offset] + "[ENT]" + \
+                          sentence[rel_end_offset:end_of_sentence]
+            else:
+                context = sentence[start_of_sentence:rel_start_offset] + "[ENT]" + \
+                          sentence[rel_end_offset:end_of_sentence]
+            if self.full_paragraph:
+                cur_sent_len = self.num_tokens(context)
+                first_sentence_num, last_sentence_num = sentence_windows.expand(found_sentence_num, cur_sent_len,
+                                                                                self.max_paragraph_len)
+                context_sent_nums.update(range(first_sentence_num, last_sentence_num + 1))
+                sentences_list = sentence_windows.sentences_list
+                context = ' '.join(sentences_list[first_sentence_num:found_sentence_num] + [context] +
+                                   sentences_list[found_sentence_num + 1:last_sentence_num + 1])
+
+        log.info(f"rank, context: {context}")
+        return context, str(context_sent_nums)
+
+    def num_tokens(self, text: str) -> int:
+        return len(re.findall(self.re_tokenizer, text))
+
+    def token_budget_batches(self, costs: List[int]) -> List[List[int]]:
+        """Splits the samples into batches which have at most ranking_batch_tokens tokens with padding, the samples
+        are sorted by the number of tokens, so the samples of similar length are padded together"""
+        batches, batch = [], []
+        for num in sorted(range(len(costs)), key=lambda num: costs[num]):
+            if batch and costs[num] * (len(batch) + 1) > self.ranking_batch_tokens:
+                batches.append(batch)
+                batch = []
+            batch.append(num)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def embedder_scores_batch(self, contexts_batch: List[List[Tuple[str, str]]],
+                              candidate_entities_batch: List[List[List[str]]]) -> List[List[List[Tuple[str, float]]]]:
+        """Scores the candidate entities of the mentions of all the documents by the dot product of the embeddings of
+        their descriptions and the embeddings of the contexts. Identical contexts are embedded once, the contexts are
+        embedded in batches limited by the number of tokens, the embeddings are cached across requests.
+
+        Args:
+            contexts_batch: for every document the contexts of the mentions and the numbers of their sentences
+            candidate_entities_batch: for every document the candidate entities of the mentions
+
+        Returns:
+            for every document the lists of (entity, score) of the mentions
+        """
+        unique_contexts = {}
+        samples_batch = []
+        for contexts in contexts_batch:
+            doc_contexts = {}
+            samples = []
+            for context, context_sent_nums in contexts:
+                # the mentions in the same sentences of the document share the context of the first of them
+                context = doc_contexts.setdefault(context_sent_nums, context)
+                samples.append(unique_contexts.setdefault(context, len(unique_contexts)))
+            samples_batch.append(samples)
+        texts = list(unique_contexts)
+        keys = [(self.ranker_version, text_key(text)) for text in texts]
+        context_embs = [self.context_cache.get(key) for key in keys]
+        not_cached = [num for num, context_emb in enumerate(context_embs) if context_emb is None]
+        for batch in self.token_budget_batches([self.num_tokens(texts[num]) for num in not_cached]):
+            batch = [not_cached[num] for num in batch]
+            batch_embs = self.bert_embedder([texts[num] for num in batch])[:, :100]
+            for num, context_emb in zip(batch, batch_embs):
+                context_embs[num] = context_emb
+                self.context_cache.put(keys[num], context_emb)
+
+        if self.description_embeddings is not None:
+            return self.matrix_scores_batch(samples_batch, candidate_entities_batch, context_embs)
+
+        scores_batch = []
+        for samples, candidate_entities_list in zip(samples_batch, candidate_entities_batch):
+            scores_list = []
+            for num, candidate_entities in zip(samples, candidate_entities_list):
+                candidate_entities_emb = [self.descr_to_emb.get(entity, np.zeros(100, dtype=float))
+                                          for entity in candidate_entities]
+                scores = [np.dot(candidate_entity_emb, context_embs[num])
+                          for candidate_entity_emb in candidate_entities_emb]
+                scores = [max(min((score + 13.0) * 0.05, 1.0), 0.0) for score in scores]
+                scores = [(entity, round(score, 4)) for entity, score in zip(candidate_entities, scores)]
+                scores_list.append(scores)
+            scores_batch.append(scores_list)
+        return scores_batch
+
+    def matrix_scores_batch(self, samples_batch: List[List[int]], candidate_entities_batch: List[List[List[str]]],
+                            context_embs: List[np.ndarray]) -> List[List[List[Tuple[str, float]]]]:
+        """Scores the candidate entities of the mentions of all the documents with one gather of the rows of
+        the description embeddings matrix and one batched dot product"""
+        candidate_entities_list = [candidate_entities for candidate_entities_list in candidate_entities_batch
+                                   for candidate_entities in candidate_entities_list]
+        mention_context_embs = np.stack([context_embs[num] for samples in samples_batch for num in samples]) \
+            if candidate_entities_list else np.zeros((0, self.description_embeddings.dim), dtype=np.float32)
+        mention_scores = iter(self.description_embeddings.scores(candidate_entities_list, mention_context_embs))
+        scores_batch = []
+        for candidate_entities_list in candidate_entities_batch:
+            scores_list = []
+            for candidate_entities in candidate_entities_list:
+                scores = np.clip((next(mention_scores) + 13.0) * 0.05, 0.0, 1.0).tolist()
+                scores_list.append([(entity, round(score, 4)) for entity, score in zip(candidate_entities, scores)])
+            scores_batch.append(scores_list)
+        return scores_batch
+
+    def ranker_scores_batch(self, contexts_batch: List[List[Tuple[str, str]]],
+                            candidate_entities_batch: List[List[List[str]]]) -> List[List[List[Tuple[str, float]]]]:
+        """Scores the candidate entities of the mentions of all the documents with the entity ranker. Identical pairs
+        of the context and the candidate entities are ranked once, the pairs are ranked in batches limited by
+        the number of tokens of the context multiplied by the number of candidate entities, the scores are cached
+        across requests.
+
+        Args:
+            contexts_batch: for every document the contexts of the mentions and the numbers of their sentences
+            candidate_entities_batch: for every document the candidate entities of the mentions
+
+        Returns:
+            for every document the lists of (entity, score) of the mentions
+        """
+        unique_samples = {}
+        samples_batch = []
+        for contexts, candidate_entities_list in zip(contexts_batch, candidate_entities_batch):
+            samples_batch.append([unique_samples.setdefault((context, tuple(candidate_entities)), len(unique_samples))
+                                  for (context, _), candidate_entities in zip(contexts, candidate_entities_list)])
+        samples = list(unique_samples)
+        keys = [(self.ranker_version, text_key(context), candidate_entities) for context, candidate_entities in samples]
+        scores = [self.context_cache.get(key) for key in keys]
+        not_cached = [num for num, sample_scores in enumerate(scores) if sample_scores is None]
+        costs = [self.num_tokens(samples[num][0]) * max(len(samples[num][1]), 1) for num in not_cached]
+        for batch in self.token_budget_batches(costs):
+            batch = [not_cached[num] for num in batch]
+            contexts = [samples[num][0] for num in batch]
+            candidate_entities_list = [list(samples[num][1]) for num in batch]
+            if hasattr(self.entity_ranker, "batch_rank_rels"):
+                batch_scores = self.entity_ranker.batch_rank_rels(contexts, candidate_entities_list)
+            else:
+                batch_scores = self.entity_ranker(contexts, candidate_entities_list)
+            for num, sample_scores in zip(batch, batch_scores):
+                scores[num] = sample_scores
+                self.context_cache.put(keys[num], sample_scores)
+        return [[scores[num] for num in doc_samples] for doc_samples in samples_batch]
+
     def rank_by_description(self, entity_substr_list: List[str],
                             entity_offsets_list: List[List[int]],
                             candidate_entities_list: List[List[str]],
@@ -1023,105 +1586,22 @@ class EntityLinkerSep(Component, Serializable):
                             sentences_list: List[str],
                             sentences_offsets_list: List[Tuple[int, int]],
                             substr_lens: List[int]) -> List[List[str]]:
-        log.info(f"rank, entity pos {entity_offsets_list}")
-        log.info(f"rank, sentences_list {sentences_list}")
-        log.info(f"rank, sent offsets {sentences_offsets_list}")
+        sentence_windows = SentenceWindows(sentences_list, sentences_offsets_list, self.re_tokenizer)
+        contexts = [self.description_context(entity_offsets, sentence_windows) for entity_offsets in entity_offsets_list]
+        scores_list = self.embedder_scores_batch([contexts], [candidate_entities_list])[0]
+        return self.select_by_description(entity_substr_list, candidate_entities_list, tags, entities_scores_list,
+                                          substr_lens, scores_list)
+
+    def select_by_description(self, entity_substr_list: List[str],
+                              candidate_entities_list: List[List[str]],
+                              tags: List[str],
+                              entities_scores_list: List[Dict[str, Tuple[int, float]]],
+                              substr_lens: List[int],
+                              scores_list: List[List[Tuple[str, float]]]) -> List[List[str]]:
+        """Selects the entities of the mentions of the document by substring, context and popularity scores"""
         log.info(f"rank, substr_lens {substr_lens}")
         entity_ids_list = []
         conf_list = []
-        contexts = []
-        sentences_to_nums = {}
-        samples_to_contexts = []
-        contexts_count = 0
-        for sample_num, (entity_substr, (entity_start_offset, entity_end_offset), candidate_entities) in \
-                enumerate(zip(entity_substr_list, entity_offsets_list, candidate_entities_list)):
-            context_sent_nums = set()
-            log.info(f"entity_offsets {entity_start_offset}, {entity_end_offset}")
-            log.info(f"candidate_entities {candidate_entities[:10]}")
-            sentence = ""
-            rel_start_offset = 0
-            rel_end_offset = 0
-            found_sentence_num = 0
-            for num, (sent, (sent_start_offset, sent_end_offset)) in \
-                    enumerate(zip(sentences_list, sentences_offsets_list)):
-                if entity_start_offset >= sent_start_offset and entity_end_offset <= sent_end_offset:
-                    sentence = sent
-                    found_sentence_num = num
-                    rel_start_offset = entity_start_offset - sent_start_offset
-                    rel_end_offset = entity_end_offset - sent_start_offset
-                    break
-            log.info(f"rank, found sentence {sentence}")
-            log.info(f"rank, relative offsets {rel_start_offset}, {rel_end_offset}")
-            context = ""
-            if sentence:
-                context_sent_nums.add(found_sentence_num)
-                start_of_sentence = 0
-                end_of_sentence = len(sentence)
-                if len(sentence) > self.max_text_len:
-                    start_of_sentence = max(rel_start_offset - self.max_text_len // 2, 0)
-                    end_of_sentence = min(rel_end_offset + self.max_text_len // 2, len(sentence))
-                if self.include_mention:
-                    context = sentence[start_of_sentence:rel_start_offset] + "[ENT]" + \
-                              sentence[rel_start_offset:rel_end_offset] + "[ENT]" + \
-                              sentence[rel_end_offset:end_of_sentence]
-                else:
-                    context = sentence[start_of_sentence:rel_start_offset] + "[ENT]" + \
-                              sentence[rel_end_offset:end_of_sentence]
-                if self.full_paragraph:
-                    cur_sent_len = len(re.findall(self.re_tokenizer, context))
-                    first_sentence_num = found_sentence_num
-                    last_sentence_num = found_sentence_num
-                    context = [context]
-                    while True:
-                        added = False
-                        if last_sentence_num < len(sentences_list) - 1:
-                            last_sentence_len = len(
-                                re.findall(self.re_tokenizer, sentences_list[last_sentence_num + 1]))
-                            if cur_sent_len + last_sentence_len < self.max_paragraph_len:
-                                context.append(sentences_list[last_sentence_num + 1])
-                                cur_sent_len += last_sentence_len
-                                context_sent_nums.add(last_sentence_num + 1)
-                                last_sentence_num += 1
-                                added = True
-                        if first_sentence_num > 0:
-                            first_sentence_len = len(
-                                re.findall(self.re_tokenizer, sentences_list[first_sentence_num - 1]))
-                            if cur_sent_len + first_sentence_len < self.max_paragraph_len:
-                                context = [sentences_list[first_sentence_num - 1]] + context
-                                cur_sent_len += first_sentence_len
-                                context_sent_nums.add(first_sentence_num - 1)
-                                first_sentence_num -= 1
-                                added = True
-                        if not added:
-                            break
-                    context = ' '.join(context)
-
-            log.info(f"rank, context: {context}")
-            context_sent_nums = str(context_sent_nums)
-            if context_sent_nums not in sentences_to_nums:
-                sentences_to_nums[context_sent_nums] = contexts_count
-                samples_to_contexts.append(contexts_count)
-                contexts_count += 1
-                contexts.append(context)
-            else:
-                samples_to_contexts.append(sentences_to_nums[context_sent_nums])
-
-        scores_list = []
-
-        context_embs_res = self.bert_embedder(contexts)[:, :100]
-        context_embs = []
-        for num in samples_to_contexts:
-            context_embs.append(context_embs_res[num])
-
-        for entity_substr, candidate_entities, context_emb in \
-                zip(entity_substr_list, candidate_entities_list, context_embs):
-            candidate_entities_emb = [self.descr_to_emb.get(entity, np.zeros(100, dtype=float)) for entity in
-                                      candidate_entities]
-            scores = [np.dot(candidate_entity_emb, context_emb) for candidate_entity_emb in candidate_entities_emb]
-            scores = [max(min((score + 13.0) * 0.05, 1.0), 0.0) for score in scores]
-            scores = [(entity, round(score, 4)) for entity, score in zip(candidate_entities, scores)]
-            scores_list.append(scores)
-
         for entity_substr, candidate_entities, tag, substr_len, entities_scores, scores in \
                 zip(entity_substr_list, candidate_entities_list, tags, substr_lens, entities_scores_list, scores_list):
             log.info(f"len candidate entities {len(candidate_entities)}")
@@ -1190,80 +1670,22 @@ class EntityLinkerSep(Component, Serializable):
                                     sentences_list: List[str],
                                     sentences_offsets_list: List[Tuple[int, int]],
                                     substr_lens: List[int]) -> List[List[str]]:
-        log.info(f"rank, entity pos {entity_offsets_list}")
-        log.info(f"rank, sentences_list {sentences_list}")
-        log.info(f"rank, sent offsets {sentences_offsets_list}")
+        sentence_windows = SentenceWindows(sentences_list, sentences_offsets_list, self.re_tokenizer)
+        contexts = [self.description_context(entity_offsets, sentence_windows) for entity_offsets in entity_offsets_list]
+        scores_list = self.ranker_scores_batch([contexts], [candidate_entities_list])[0]
+        return self.select_by_description_runtime(entity_substr_list, candidate_entities_list, tags,
+                                                  entities_scores_list, substr_lens, scores_list)
+
+    def select_by_description_runtime(self, entity_substr_list: List[str],
+                                      candidate_entities_list: List[List[str]],
+                                      tags: List[str],
+                                      entities_scores_list: List[Dict[str, Tuple[int, float]]],
+                                      substr_lens: List[int],
+                                      scores_list: List[List[Tuple[str, float]]]) -> List[List[str]]:
+        """Selects the entities of the mentions of the document by substring, ranker and popularity scores"""
         log.info(f"rank, substr_lens {substr_lens}")
         entity_ids_list = []
         conf_list = []
-        contexts = []
-        for entity_substr, (entity_start_offset, entity_end_offset), candidate_entities in \
-                zip(entity_substr_list, entity_offsets_list, candidate_entities_list):
-            log.info(f"entity_offsets {entity_start_offset}, {entity_end_offset}")
-            log.info(f"candidate_entities {candidate_entities[:10]}")
-            sentence = ""
-            rel_start_offset = 0
-            rel_end_offset = 0
-            found_sentence_num = 0
-            for num, (sent, (sent_start_offset, sent_end_offset)) in \
-                    enumerate(zip(sentences_list, sentences_offsets_list)):
-                if entity_start_offset >= sent_start_offset and entity_end_offset <= sent_end_offset:
-                    sentence = sent
-                    found_sentence_num = num
-                    rel_start_offset = entity_start_offset - sent_start_offset
-                    rel_end_offset = entity_end_offset - sent_start_offset
-                    break
-            log.info(f"rank, found sentence {sentence}")
-            log.info(f"rank, relative offsets {rel_start_offset}, {rel_end_offset}")
-            context = ""
-            if sentence:
-                start_of_sentence = 0
-                end_of_sentence = len(sentence)
-                if len(sentence) > self.max_text_len:
-                    start_of_sentence = max(rel_start_offset - self.max_text_len // 2, 0)
-                    end_of_sentence = min(rel_end_offset + self.max_text_len // 2, len(sentence))
-                if self.include_mention:
-                    context = sentence[start_of_sentence:rel_start_offset] + "[ENT]" + \
-                              sentence[rel_start_offset:rel_end_offset] + "[ENT]" + \
-                              sentence[rel_end_offset:end_of_sentence]
-                else:
-                    context = sentence[start_of_sentence:rel_start_offset] + "[ENT]" + \
-                              sentence[rel_end_offset:end_of_sentence]
-                if self.full_paragraph:
-                    cur_sent_len = len(re.findall(self.re_tokenizer, context))
-                    first_sentence_num = found_sentence_num
-                    last_sentence_num = found_sentence_num
-                    context = [context]
-                    while True:
-                        added = False
-                        if last_sentence_num < len(sentences_list) - 1:
-                            last_sentence_len = len(
-                                re.findall(self.re_tokenizer, sentences_list[last_sentence_num + 1]))
-                            if cur_sent_len + last_sentence_len < self.max_paragraph_len:
-                                context.append(sentences_list[last_sentence_num + 1])
-                                cur_sent_len += last_sentence_len
-                                last_sentence_num += 1
-                                added = True
-                        if first_sentence_num > 0:
-                            first_sentence_len = len(
-                                re.findall(self.re_tokenizer, sentences_list[first_sentence_num - 1]))
-                            if cur_sent_len + first_sentence_len < self.max_paragraph_len:
-                                context = [sentences_list[first_sentence_num - 1]] + context
-                                cur_sent_len += first_sentence_len
-                                first_sentence_num -= 1
-                                added = True
-                        if not added:
-                            break
-                    context = ' '.join(context)
-
-            log.info(f"rank, context: {context}")
-            contexts.append(context)
-
-        if hasattr(self.entity_ranker, "batch_rank_rels"):
-            scores_list = self.entity_ranker.batch_rank_rels(contexts, candidate_entities_list)
-        else:
-            scores_list = self.entity_ranker(contexts, candidate_entities_list)
-
         for entity_substr, candidate_entities, tag, substr_len, entities_scores, scores in \
                 zip(entity_substr_list, candidate_entities_list, tags, substr_lens, entities_scores_list, scores_list):
             log.info(f"len candidate entities {len(candidate_entities)}")
@@ -1388,7 +1810,11 @@ class EntityLinkerSep(Component, Serializable):
         return entity_wiki_types_batch, entity_wiki_tags_batch
 
     def filter_entities_by_tags(self, entities_set, tag, proba):
-        if proba > self.tag_thres_probas[tag]:
+        if proba > self.tag_thres_probas[tag] and self.entity_index is not None:
+            entities = list(entities_set)
+            mask = self.entity_index.tags_mask(q_nums_of([entity[0] for entity in entities]), [tag])
+            entities_set = {entity for entity, in_tags in zip(entities, mask) if in_tags}
+        elif proba > self.tag_thres_probas[tag]:
             entities_set = {entity for entity in entities_set if (entity[0] in self.entities_types_sets[tag]
                                                                   or entity[0] in self.entities_types_sets["AMB"])}
         return entities_set
@@ -0,0 +1,236 @@
+"""Faiss indexes of fasttext vectors of entity labels and the tuner of their search parameters.
+
+The parameters of an index (its type, build and search parameters) are saved next to the index file, the search
+parameters are applied when the index is loaded. The tuner measures recall@k against the exact flat index and
+the search latency on a sample of mentions:
+
+    python faiss_index_factory.py --index /data/faiss/fasstext_faiss_vectors_cpu.index \
+        --fasttext /data/downloads/faiss/fasttext_dim100_ws10 --mentions mentions.txt --recall 0.95 --save
+
+    python faiss_index_factory.py ... --compare ivf_flat ivf_pq ivf_sq hnsw
+"""
+import argparse
+import json
+import time
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import faiss
+import numpy as np
+
+log = getLogger(__name__)
+
+INDEX_TYPES = ("ivf_flat", "ivf_pq", "ivf_sq", "hnsw")
+# build parameters of the index types which are not set in the config
+DEFAULT_BUILD_PARAMS = {"ivf_flat": {},
+                        "ivf_pq": {"pq_m": 20, "pq_nbits": 8},
+                        "ivf_sq": {"sq_type": "QT_8bit"},
+                        "hnsw": {"hnsw_m": 32, "ef_construction": 80}}
+# values of the search parameter which are tried by the tuner
+SEARCH_VALUES = {"nprobe": [1, 2, 4, 8, 10, 16, 32, 64, 128],
+                 "efSearch": [16, 32, 64, 128, 256, 512]}
+
+
+def search_parameter(index_type: str) -> str:
+    """Returns the name of the parameter which trades recall of the search for its speed"""
+    return "efSearch" if index_type == "hnsw" else "nprobe"
+
+
+def build_params(index_type: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"unknown Faiss index type {index_type}, expected one of {INDEX_TYPES}")
+    return {**DEFAULT_BUILD_PARAMS[index_type], **(params or {})}
+
+
+def build_faiss_index(vectors: np.ndarray, index_type: str = "ivf_flat", num_cells: int = 1000,
+                      params: Optional[Dict[str, Any]] = None) -> faiss.Index:
+    """Builds the index of the vectors with L2 distance (the linker selects the labels by the threshold of
+    the squared L2 distance).
+
+    Args:
+        vectors: float32 matrix of the vectors
+        index_type: "ivf_flat", "ivf_pq" (product quantization, pq_m codes of pq_nbits bits for every vector),
+            "ivf_sq" (scalar quantization of sq_type) or "hnsw" (graph with hnsw_m links of every vector, built with
+            ef_construction neighbours)
+        num_cells: number of Voronoi cells of IVF indexes
+        params: build parameters of the index type, the defaults are in DEFAULT_BUILD_PARAMS
+    """
+    params = build_params(index_type, params)
+    dim = vectors.shape[1]
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["hnsw_m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+    elif index_type == "ivf_flat":
+        # the same index as the indexes of the previous versions, its cells are assigned by inner product
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, num_cells)
+    else:
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf_pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, num_cells, params["pq_m"], params["pq_nbits"])
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, num_cells,
+                                                  getattr(faiss.ScalarQuantizer, params["sq_type"]),
+                                                  faiss.METRIC_L2)
+    index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def set_search_params(index: faiss.Index, search_params: Dict[str, int]) -> None:
+    parameter_space = faiss.ParameterSpace()
+    for name, value in search_params.items():
+        parameter_space.set_index_parameter(index, name, value)
+
+
+def index_spec(index_type: str, num_cells: int, params: Optional[Dict[str, Any]], search_value: int) \
+        -> Dict[str, Any]:
+    """Returns the parameters of the index which are saved with it"""
+    return {"index_type": index_type,
+            "num_cells": num_cells if index_type != "hnsw" else 0,
+            "build": build_params(index_type, params),
+            "search": {search_parameter(index_type): search_value}}
+
+
+def same_structure(spec: Dict[str, Any], other_spec: Optional[Dict[str, Any]]) -> bool:
+    return other_spec is not None and all(spec[key] == other_spec.get(key) for key in ("index_type", "num_cells",
+                                                                                       "build"))
+
+
+def index_params_path(faiss_index_filename: Union[str, Path]) -> Path:
+    """Returns the path of the parameters of the index which are saved next to the index file"""
+    return Path(faiss_index_filename).with_suffix(".params.json")
+
+
+def save_index_params(spec: Dict[str, Any], path: Union[str, Path]) -> None:
+    with open(path, "w") as fl:
+        json.dump(spec, fl, indent=2)
+
+
+def load_index_params(path: Union[str, Path]) -> Optional[Dict[str, Any]]:
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path) as fl:
+        return json.load(fl)
+
+
+def index_memory(index: faiss.Index) -> int:
+    return faiss.serialize_index(index).nbytes
+
+
+def index_vectors(index: faiss.Index, vectors_path: Path) -> np.ndarray:
+    """Returns the indexed vectors: the matrix saved with the index by update_faiss or the vectors reconstructed
+    from the IVF flat index"""
+    if vectors_path.exists():
+        return np.load(vectors_path)
+    log.info(f"{vectors_path} does not exist, reconstructing the vectors from the index")
+    ivf_index = faiss.extract_index_ivf(index)
+    ivf_index.make_direct_map()
+    return ivf_index.reconstruct_n(0, index.ntotal)
+
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int, true_ids: np.ndarray) -> Tuple[float, float]:
+    """Returns recall@k of the search results (the fraction of the exact k nearest neighbours which are found) and
+    the search latency in milliseconds per query"""
+    start = time.perf_counter()
+    _, found_ids = index.search(queries, k)
+    latency = 1000 * (time.perf_counter() - start) / len(queries)
+    found = sum(len(np.intersect1d(found_row, true_row)) for found_row, true_row in zip(found_ids, true_ids))
+    return found / true_ids.size, latency
+
+
+def tune_search(index: faiss.Index, index_type: str, queries: np.ndarray, k: int, true_ids: np.ndarray,
+                target_recall: float) -> Tuple[int, List[Dict[str, Any]]]:
+    """Measures recall and latency of the index with the values of its search parameter, returns the fastest value
+    with the target recall (the value with the best recall if no value reaches it) and the measurements"""
+    name = search_parameter(index_type)
+    values = SEARCH_VALUES[name]
+    if name == "nprobe":
+        values = [value for value in values if value <= faiss.extract_index_ivf(index).nlist]
+    else:
+        values = [value for value in values if value >= k] or [k]
+    rows = []
+    for value in values:
+        set_search_params(index, {name: value})
+        # warm-up search, the first search touches the memory of the index
+        index.search(queries[:100], k)
+        recall, latency = measure(index, queries, k, true_ids)
+        rows.append({"index_type": index_type, name: value, "recall": round(recall, 4),
+                     "latency_ms": round(latency, 4)})
+    passed = [row for row in rows if row["recall"] >= target_recall]
+    if passed:
+        best = min(passed, key=lambda row: row["latency_ms"])
+    else:
+        best = max(rows, key=lambda row: row["recall"])
+    return best[name], rows
+
+
+def embed_mentions(fasttext_filename: str, mentions_filename: str, max_mentions: int) -> np.ndarray:
+    import fasttext
+
+    from entity_linking_sep import EntityLinkerSep
+
+    with open(mentions_filename) as fl:
+        mentions = list(dict.fromkeys(line.strip() for line in fl if line.strip()))[:max_mentions]
+    vectorizer = fasttext.load_model(fasttext_filename)
+    return np.array([vectorizer.get_word_vector(EntityLinkerSep.ft_word(mention)) for mention in mentions],
+                    dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tunes search parameters of the fasttext Faiss index by recall@k "
+                                                 "against the exact flat index and latency on a sample of mentions")
+    parser.add_argument("--index", required=True, help="fasttext Faiss index file")
+    parser.add_argument("--fasttext", required=True, help="fasttext model file")
+    parser.add_argument("--mentions", required=True, help="file with an entity mention in every line")
+    parser.add_argument("--max-mentions", type=int, default=5000)
+    parser.add_argument("--k", type=int, default=50, help="num_ft_faiss_candidate_entities of the linker")
+    parser.add_argument("--recall", type=float, default=0.95, help="target recall@k")
+    parser.add_argument("--compare", nargs="*", choices=INDEX_TYPES, default=[],
+                        help="index types which are built on the vectors of the index and tuned for comparison")
+    parser.add_argument("--num-cells", type=int, default=1000)
+    parser.add_argument("--save", action="store_true",
+                        help="save the tuned search parameter with the index, it is applied when the index is loaded")
+    args = parser.parse_args()
+
+    from mmap_store import label_vectors_path
+
+    index = faiss.read_index(args.index)
+    vectors = index_vectors(index, label_vectors_path(args.index))
+    queries = embed_mentions(args.fasttext, args.mentions, args.max_mentions)
+    flat_index = faiss.IndexFlatL2(vectors.shape[1])
+    flat_index.add(vectors)
+    _, true_ids = flat_index.search(queries, args.k)
+
+    spec = load_index_params(index_params_path(args.index))
+    index_type = spec["index_type"] if spec else "ivf_flat"
+    value, rows = tune_search(index, index_type, queries, args.k, true_ids, args.recall)
+    memory = {index_type: index_memory(index)}
+    for compared_type in args.compare:
+        compared_index = build_faiss_index(vectors, compared_type, args.num_cells)
+        memory[compared_type] = index_memory(compared_index)
+        rows += tune_search(compared_index, compared_type, queries, args.k, true_ids, args.recall)[1]
+
+    print(f"recall@{args.k} against the flat index on {len(queries)} mentions")
+    for row in rows:
+        name = search_parameter(row["index_type"])
+        print(f"{row['index_type']:>8} {name}={row[name]:<4} recall {row['recall']:.4f} "
+              f"latency {row['latency_ms']:.4f} ms memory {memory[row['index_type']] / 2 ** 20:.0f} MiB")
+    name = search_parameter(index_type)
+    print(f"selected {name}={value} for {args.index}")
+    if args.save:
+        if spec is None:
+            # the downloaded index is the IVF flat index, its build parameters are those of the config
+            spec = index_spec(index_type, faiss.extract_index_ivf(index).nlist, None, value)
+        spec["search"] = {name: value}
+        chosen = next(row for row in rows if row["index_type"] == index_type and row[name] == value)
+        spec["tuning"] = {"k": args.k, "mentions": len(queries), "recall": chosen["recall"],
+                          "latency_ms": chosen["latency_ms"]}
+        save_index_params(spec, index_params_path(args.index))
+        print(f"saved {index_params_path(args.index)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+
+class FuzzyMatcher:
+    """Matches the tokens of the entity substring with the tokens of the labels of fasttext candidates.
+
+    A token of the substring matches a token of the label if they have the same first prefix_len characters and
+    their fuzz.ratio is greater than ratio_threshold (or both of them have 3 characters). The label is accepted if
+    all the tokens of the substring have matches (one or two tokens) or all but one (more than two tokens). Token
+    pairs are scored with one process.cdist call per prefix bucket instead of the loop over all pairs.
+
+    Args:
+        ratio_threshold: minimal fuzz.ratio of matching tokens (exclusive)
+        prefix_len: length of the prefix which matching tokens share
+    """
+
+    def __init__(self, ratio_threshold: float = 70.0, prefix_len: int = 2) -> None:
+        self.ratio_threshold = ratio_threshold
+        self.prefix_len = prefix_len
+
+    def match(self, entity_substr: List[str], labels: List[str], lower_labels: Optional[List[str]] = None,
+              labels_tokens: Optional[List[List[str]]] = None) -> List[Optional[float]]:
+        """
+        Args:
+            entity_substr: tokens of the entity substring
+            labels: labels of the candidate entities
+            lower_labels: lowercased labels if they are precomputed
+            labels_tokens: tokens of the lowercased labels if they are precomputed
+
+        Returns:
+            for every label None if it is not accepted, otherwise the score of the label: the share of common tokens
+            or 0.01 * fuzz.ratio of the substring and the label if they have no common tokens
+        """
+        substr_tokens = list({token.lower() for token in entity_substr})
+        if labels_tokens is None:
+            if lower_labels is None:
+                lower_labels = [label.lower() for label in labels]
+            labels_tokens = [label.split() for label in lower_labels]
+        labels_tokens = [set(label_tokens) for label_tokens in labels_tokens]
+        matched = self.matched_tokens(substr_tokens, labels_tokens)
+
+        num_tokens = len(substr_tokens)
+        scores = []
+        for i, label_tokens in enumerate(labels_tokens):
+            num_matches = sum(any(label_token in label_tokens for label_token in matched[token])
+                              for token in substr_tokens)
+            if (num_tokens == 1 and num_matches == 1) or (num_tokens == 2 and num_matches == 2) \
+                    or (num_tokens > 2 and abs(num_matches - num_tokens) <= 1):
+                inters_tokens = label_tokens.intersection(substr_tokens)
+                if inters_tokens:
+                    scores.append(len(inters_tokens) / max(num_tokens, len(label_tokens)))
+                else:
+                    lower_label = lower_labels[i] if lower_labels is not None else labels[i].lower()
+                    scores.append(fuzz.ratio(' '.join(entity_substr).lower(), lower_label) * 0.01)
+            else:
+                scores.append(None)
+        return scores
+
+    def matched_tokens(self, substr_tokens: List[str], labels_tokens: List[set]) -> Dict[str, set]:
+        """Returns the tokens of the labels which match every token of the substring"""
+        buckets = defaultdict(set)
+        for label_tokens in labels_tokens:
+            for label_token in label_tokens:
+                buckets[label_token[:self.prefix_len]].add(label_token)
+        matched = {token: set() for token in substr_tokens}
+        substr_buckets = defaultdict(list)
+        for token in substr_tokens:
+            substr_buckets[token[:self.prefix_len]].append(token)
+        for prefix, tokens in substr_buckets.items():
+            bucket_tokens = list(buckets.get(prefix, ()))
+            if not bucket_tokens:
+                continue
+            ratios = process.cdist(tokens, bucket_tokens, scorer=fuzz.ratio, processor=None,
+                                   score_cutoff=self.ratio_threshold, dtype=np.float32)
+            lengths = np.array([len(bucket_token) for bucket_token in bucket_tokens])
+            for token, token_ratios in zip(tokens, ratios):
+                is_match = token_ratios > self.ratio_threshold
+                if len(token) == 3:
+                    is_match |= lengths == 3
+                matched[token].update(bucket_tokens[i] for i in np.nonzero(is_match)[0])
+        return matched
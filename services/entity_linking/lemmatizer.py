@@ -0,0 +1,91 @@
+from logging import getLogger
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Iterable, Optional, Union
+
+import pymorphy2
+
+from caches import LRUCache
+from mmap_store import load_mmap, save_mmap
+
+log = getLogger(__name__)
+
+INFLECTED_POS = {"NOUN", "ADJ", "ADJF"}
+
+
+class Lemmatizer:
+    """pymorphy2 lemmatization with LRU caches of the normal forms and the nominative forms of the words.
+    Nominative forms can be precomputed for a vocabulary (see save_lemma_vocab), then they are looked up in
+    the memory-mapped vocabulary first.
+
+    Args:
+        cache_size: maximal number of cached forms of every kind
+    """
+
+    def __init__(self, cache_size: int = 200000) -> None:
+        self.morph = pymorphy2.MorphAnalyzer()
+        self.normal_forms = LRUCache(cache_size)
+        self.nominative_forms = LRUCache(cache_size)
+        self.vocab = None
+        self.vocab_hits = 0
+
+    def load_vocab(self, path: Union[str, Path]) -> None:
+        if (Path(path) / "meta.json").exists():
+            log.info(f"loading lemma vocabulary {path}")
+            self.vocab = load_mmap(path)
+
+    def normal_form(self, word: str) -> str:
+        normal_form = self.normal_forms.get(word)
+        if normal_form is None:
+            normal_form = self.morph.parse(word)[0].normal_form
+            self.normal_forms.put(word, normal_form)
+        return normal_form
+
+    def nominative(self, word: str) -> str:
+        """Returns the nominative form of nouns and adjectives and the normal form of the other words"""
+        if self.vocab is not None:
+            nominative = self.vocab.get(word)
+            if nominative is not None:
+                self.vocab_hits += 1
+                return nominative
+        nominative = self.nominative_forms.get(word)
+        if nominative is None:
+            nominative = self.parse_nominative(word)
+            self.nominative_forms.put(word, nominative)
+        return nominative
+
+    def parse_nominative(self, word: str) -> str:
+        morph_parse_tok = self.morph.parse(word)[0]
+        if morph_parse_tok.tag.POS in INFLECTED_POS:
+            return morph_parse_tok.inflect({"nomn"}).word
+        return morph_parse_tok.normal_form
+
+    def stats(self) -> Dict[str, Any]:
+        return {"normal_forms": self.normal_forms.stats(), "nominative_forms": self.nominative_forms.stats(),
+                "vocab_hits": self.vocab_hits}
+
+
+LEMMATIZER = None
+LEMMATIZER_LOCK = Lock()
+
+
+def get_lemmatizer(cache_size: int = 200000) -> Lemmatizer:
+    """Returns the lemmatizer shared by the components of the process, it is created by the first call"""
+    global LEMMATIZER
+    with LEMMATIZER_LOCK:
+        if LEMMATIZER is None:
+            LEMMATIZER = Lemmatizer(cache_size)
+        return LEMMATIZER
+
+
+def save_lemma_vocab(words: Iterable[str], path: Union[str, Path], lemmatizer: Optional[Lemmatizer] = None) -> None:
+    """Precomputes nominative forms of the words and saves them as a memory-mapped dict"""
+    lemmatizer = lemmatizer or Lemmatizer(cache_size=0)
+    vocab = {}
+    for word in words:
+        try:
+            vocab[word] = lemmatizer.parse_nominative(word)
+        except AttributeError:
+            # the word has no nominative form, it is lemmatized (and fails) at runtime as before
+            continue
+    save_mmap(vocab, path)
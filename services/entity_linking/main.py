@@ -4,13 +4,16 @@ from pathlib import Path
 from shutil import rmtree, copytree
 
 from aliases import Aliases
+from caches import publish_version
 from constants import WIKIDATA_PATH, WIKIDATA_URL, PARSED_WIKIDATA_PATH, PARSED_WIKIDATA_OLD_PATH, \
     PARSED_WIKIDATA_NEW_PATH, ENTITIES_PATH, ENTITIES_OLD_PATH, ENTITIES_NEW_PATH, FAISS_PATH, FAISS_OLD_PATH, \
-    FAISS_NEW_PATH, DATA_PATH, LOGS_PATH
+    FAISS_NEW_PATH, DATA_PATH, DOWNLOADS_PATH, INDEX_VERSION_PATH, LOGS_PATH, PRECOMPUTE_LEMMAS
 from deeppavlov import build_model
 from deeppavlov.core.commands.utils import parse_config
 from deeppavlov.core.data.utils import simple_download
 from entities_parse import EntitiesParser
+from entity_index import save_entity_index
+from mmap_store import build_label_to_q, convert_pickle, label_index_path, load_store, save_label_index
 from deeppavlov.models.entity_linking.download_parse_utils.wikidata_parse import WikidataParser
 
 log = logging.getLogger(__file__)
@@ -21,6 +24,14 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 ch.setFormatter(formatter)
 log.addHandler(ch)
 
+ENTITIES_PICKLES = ['word_to_idlist_vx.pickle', 'entities_ranking_dict_vx.pickle', 'entities_types_sets.pickle',
+                    'q_to_label_vx.pickle', 'q_to_descr_vx.pickle']
+WIKIDATA_TYPES_PICKLES = ['q_to_types_vx.pickle', 'type_to_tag_vx.pickle', 'type_to_label_vx.pickle']
+FASTTEXT_FAISS_INDEX_FILENAME = 'fasstext_faiss_vectors_cpu.index'
+# the fasttext index is built with the index settings of the service config
+FASTTEXT_INDEX_SETTINGS = ['num_ft_faiss_cells', 'fasttext_index_type', 'fasttext_index_params', 'fasttext_index_nprobe',
+                           'fasttext_index_ef_search']
+
 
 def download_wikidata() -> None:
     print('Wikidate update started', flush=True)
@@ -52,7 +63,8 @@ def parse_entities() -> None:
     ENTITIES_NEW_PATH.mkdir(parents=True, exist_ok=True)
     entities_parser = EntitiesParser(load_path=PARSED_WIKIDATA_PATH,
                                      old_load_path=ENTITIES_PATH,
-                                     save_path=ENTITIES_NEW_PATH)
+                                     save_path=ENTITIES_NEW_PATH,
+                                     lemma_vocab_filename='lemma_vocab' if PRECOMPUTE_LEMMAS else '')
     entities_parser.load()
     log.info("----- loaded parser")
     entities_parser.parse()
@@ -76,12 +88,18 @@ def update_faiss():
     config['chainer']['pipe'][-1]['load_path'] = config['chainer']['pipe'][-1]['save_path'] = str(ENTITIES_PATH)
     config['chainer']['pipe'][-1]['fit_tfidf_vectorizer'] = True
     config['chainer']['pipe'][-1]['fit_fasttext_vectorizer'] = True
+    service_linker_config = parse_config('entity_linking.json')['chainer']['pipe'][-1]
+    for setting in FASTTEXT_INDEX_SETTINGS:
+        if setting in service_linker_config:
+            config['chainer']['pipe'][-1][setting] = service_linker_config[setting]
     config['chainer']['pipe'][-1]['tfidf_vectorizer_filename'] = \
         FAISS_NEW_PATH / Path(config['chainer']['pipe'][-1]['tfidf_vectorizer_filename']).name
     config['chainer']['pipe'][-1]['fasttext_faiss_index_filename'] = \
         FAISS_NEW_PATH / Path(config['chainer']['pipe'][-1]['fasttext_faiss_index_filename']).name
     config['chainer']['pipe'][-1]['tfidf_faiss_index_filename'] = \
         FAISS_NEW_PATH / Path(config['chainer']['pipe'][-1]['tfidf_faiss_index_filename']).name
+    config['chainer']['pipe'][-1]['previous_fasttext_faiss_index_filename'] = \
+        FAISS_PATH / Path(config['chainer']['pipe'][-1]['fasttext_faiss_index_filename']).name
     fasttext_vectorizer_filename = FAISS_PATH / Path(config['chainer']['pipe'][-1]['fasttext_vectorizer_filename']).name
     if fasttext_vectorizer_filename.exists():
         shutil.copy(fasttext_vectorizer_filename, FAISS_NEW_PATH)
@@ -91,6 +109,7 @@ def update_faiss():
     if FAISS_PATH.exists():
         FAISS_PATH.rename(FAISS_OLD_PATH)
     FAISS_NEW_PATH.rename(FAISS_PATH)
+    publish_version(INDEX_VERSION_PATH)
     print('Faiss update finished')
 
 
@@ -103,3 +122,34 @@ def initial_setup():
         copytree(f'{DATA_PATH}/downloads/parsed_wikidata', PARSED_WIKIDATA_PATH)
     if not LOGS_PATH.exists():
         LOGS_PATH.mkdir(parents=True)
+    convert_entities_to_mmap()
+    build_label_index()
+    build_entity_index()
+
+
+def convert_entities_to_mmap() -> None:
+    """Builds memory-mapped stores of the downloaded entity dicts which have no store yet"""
+    for filename in ENTITIES_PICKLES:
+        convert_pickle(ENTITIES_PATH / filename, set_dict=filename == 'entities_types_sets.pickle')
+    for filename in WIKIDATA_TYPES_PICKLES:
+        convert_pickle(DOWNLOADS_PATH / 'wikidata_rus' / filename)
+
+
+def build_label_index() -> None:
+    """Builds the reverse index of labels for the downloaded fasttext Faiss index, new indices are saved with it
+    by update_faiss"""
+    index_path = label_index_path(FAISS_PATH / FASTTEXT_FAISS_INDEX_FILENAME)
+    if not index_path.exists():
+        log.info(f"building labels index {index_path}")
+        save_label_index(build_label_to_q(load_store(ENTITIES_PATH / 'q_to_label_vx.pickle')), index_path)
+
+
+def build_entity_index() -> None:
+    """Builds the index of entities interned to integer ids for the downloaded entity dicts, new indices are saved
+    by the entities parser"""
+    index_path = ENTITIES_PATH / 'entity_index'
+    if not index_path.exists():
+        log.info(f"building entity index {index_path}")
+        save_entity_index(load_store(ENTITIES_PATH / 'word_to_idlist_vx.pickle'),
+                          load_store(ENTITIES_PATH / 'entities_types_sets.pickle'),
+                          load_store(ENTITIES_PATH / 'entities_ranking_dict_vx.pickle'), index_path)
@@ -0,0 +1,394 @@
+import hashlib
+import json
+import re
+import shutil
+from collections.abc import Mapping, Set
+from contextlib import contextmanager
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from deeppavlov.core.common.file import load_pickle
+
+log = getLogger(__name__)
+
+MMAP_SUFFIX = ".mmap"
+QID_REGEX = re.compile(r"Q\d+")
+
+
+def key_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf8"), digest_size=8).digest(), "little")
+
+
+def pack_q_ids(q_ids: List[str]) -> np.ndarray:
+    """Packs Q-ids as numbers, uint32 if all the numbers fit it"""
+    nums = np.array([int(q_id[1:]) for q_id in q_ids], dtype=np.int64)
+    return nums.astype(np.uint32) if not len(nums) or nums.max() < 2 ** 32 else nums
+
+
+@contextmanager
+def store_dir(path: Union[str, Path]) -> Iterator[Path]:
+    """Yields a temporary directory for the files of the store and replaces the store directory with it when
+    the files are written, so that the running services never see a half-written store"""
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+    yield tmp_path
+    if path.exists():
+        shutil.rmtree(path)
+    tmp_path.rename(path)
+
+
+class StringTable:
+    """Read-only table of strings stored as one utf8 blob and an array of offsets"""
+
+    def __init__(self, path: Path, name: str) -> None:
+        self.blob = np.load(path / f"{name}_blob.npy", mmap_mode="r")
+        self.offsets = np.load(path / f"{name}_offsets.npy", mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf8")
+
+    def __iter__(self) -> Iterator[str]:
+        batch_size = 10000
+        for start in range(0, len(self), batch_size):
+            yield from self.slice(start, min(start + batch_size, len(self)))
+
+    def slice(self, start: int, end: int) -> List[str]:
+        offsets = self.offsets[start:end + 1]
+        chunk = self.blob[offsets[0]:offsets[-1]].tobytes()
+        offsets = offsets - offsets[0]
+        return [chunk[offsets[i]:offsets[i + 1]].decode("utf8") for i in range(end - start)]
+
+    @staticmethod
+    def save(path: Path, name: str, strings: List[str]) -> None:
+        encoded = [string.encode("utf8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        np.save(path / f"{name}_blob.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        np.save(path / f"{name}_offsets.npy", offsets)
+
+
+class MmapStringSet(Set):
+    """Read-only set of strings on disk. Lookup is a binary search over the sorted array of key hashes,
+    iteration follows the order of insertion.
+
+    Args:
+        path: directory with the store files
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.keys_table = StringTable(self.path, "keys")
+        self.hashes = np.load(self.path / "hashes.npy", mmap_mode="r")
+        self.order = np.load(self.path / "order.npy", mmap_mode="r")
+
+    def find(self, key: str) -> int:
+        """Returns the row of the key or -1 if the key is absent"""
+        if not isinstance(key, str):
+            return -1
+        h = np.uint64(key_hash(key))
+        i = int(np.searchsorted(self.hashes, h))
+        while i < len(self.hashes) and self.hashes[i] == h:
+            row = int(self.order[i])
+            if self.keys_table[row] == key:
+                return row
+            i += 1
+        return -1
+
+    def __contains__(self, key: Any) -> bool:
+        return self.find(key) >= 0
+
+    def __len__(self) -> int:
+        return len(self.keys_table)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys_table)
+
+    @staticmethod
+    def save_keys(path: Path, keys: List[str]) -> None:
+        StringTable.save(path, "keys", keys)
+        hashes = np.array([key_hash(key) for key in keys], dtype=np.uint64)
+        order = np.argsort(hashes, kind="stable")
+        np.save(path / "hashes.npy", hashes[order])
+        np.save(path / "order.npy", order.astype(np.int64))
+
+
+class MmapDict(Mapping):
+    """Read-only dict with string keys on disk with the same lookup semantics as the dict it was built from.
+
+    Values are stored in flat arrays, the kind of values is one of:
+        "int" - integer,
+        "str" - string,
+        "str_list" - list (or set) of strings,
+        "str_int_list" - list (or set) of (string, integer) pairs.
+
+    Args:
+        path: directory with the store files
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        with open(self.path / "meta.json") as fl:
+            self.meta = json.load(fl)
+        self.kind = self.meta["kind"]
+        self.container = set if self.meta.get("container") == "set" else list
+        self.keys_set = MmapStringSet(self.path)
+        if self.kind == "int":
+            self.values_arr = np.load(self.path / "values.npy", mmap_mode="r")
+        elif self.kind == "str":
+            self.values_table = StringTable(self.path, "values")
+        else:
+            self.values_table = StringTable(self.path, "values")
+            self.value_offsets = np.load(self.path / "value_offsets.npy", mmap_mode="r")
+            if self.kind == "str_int_list":
+                self.values_arr = np.load(self.path / "values.npy", mmap_mode="r")
+
+    def value(self, row: int) -> Any:
+        if self.kind == "int":
+            return int(self.values_arr[row])
+        if self.kind == "str":
+            return self.values_table[row]
+        start, end = int(self.value_offsets[row]), int(self.value_offsets[row + 1])
+        strings = self.values_table.slice(start, end) if end > start else []
+        if self.kind == "str_list":
+            return self.container(strings)
+        return self.container(zip(strings, self.values_arr[start:end].tolist()))
+
+    def __getitem__(self, key: str) -> Any:
+        row = self.keys_set.find(key)
+        if row < 0:
+            raise KeyError(key)
+        return self.value(row)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        row = self.keys_set.find(key)
+        return self.value(row) if row >= 0 else default
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.keys_set
+
+    def __len__(self) -> int:
+        return len(self.keys_set)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys_set)
+
+    def keys_list(self) -> StringTable:
+        """Returns the keys in the order of insertion as a read-only list-like table"""
+        return self.keys_set.keys_table
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        for row, key in enumerate(self.keys_set):
+            yield key, self.value(row)
+
+    def values(self) -> Iterator[Any]:
+        for row in range(len(self)):
+            yield self.value(row)
+
+
+class MmapLabelIndex(Mapping):
+    """Read-only reverse index of entity labels (keys) and lists of entity ids (values). Rows of the labels are
+    aligned with the rows of the fasttext Faiss index of labels, entity ids are packed as numbers of Q-ids.
+
+    Args:
+        path: directory with the index files
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.keys_set = MmapStringSet(self.path)
+        self.labels_list = self.keys_set.keys_table
+        self.ids_offsets = np.load(self.path / "ids_offsets.npy", mmap_mode="r")
+        self.ids = np.load(self.path / "ids.npy", mmap_mode="r")
+        # lowercased labels and their tokens for fuzzy matching, the indices of the previous versions have no them
+        self.lower_labels_list = StringTable(self.path, "lower") if (self.path / "lower_blob.npy").exists() else None
+        self.tokens = None
+        if (self.path / "tokens_blob.npy").exists():
+            self.tokens = StringTable(self.path, "tokens")
+            self.label_tokens_offsets = np.load(self.path / "label_tokens_offsets.npy", mmap_mode="r")
+
+    def label_tokens(self, row: int) -> List[str]:
+        """Returns the tokens of the lowercased label of the row"""
+        return self.tokens.slice(self.label_tokens_offsets[row], self.label_tokens_offsets[row + 1])
+
+    def row_ids(self, row: int) -> List[str]:
+        return [f"Q{num}" for num in self.ids[self.ids_offsets[row]:self.ids_offsets[row + 1]].tolist()]
+
+    def __getitem__(self, label: str) -> List[str]:
+        row = self.keys_set.find(label)
+        if row < 0:
+            raise KeyError(label)
+        return self.row_ids(row)
+
+    def __contains__(self, label: Any) -> bool:
+        return label in self.keys_set
+
+    def __len__(self) -> int:
+        return len(self.keys_set)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys_set)
+
+
+def build_label_to_q(q_to_label: Mapping) -> Dict[str, List[str]]:
+    """Builds the reverse index of entity labels, the order of the labels defines the rows of the fasttext
+    Faiss index"""
+    label_to_q = {}
+    for q_id, labels in q_to_label.items():
+        for label in labels:
+            if label in label_to_q:
+                label_to_q[label].append(q_id)
+            else:
+                label_to_q[label] = [q_id]
+    return label_to_q
+
+
+def label_index_path(faiss_index_filename: Union[str, Path]) -> Path:
+    return Path(faiss_index_filename).with_suffix(".labels")
+
+
+def label_vectors_path(faiss_index_filename: Union[str, Path]) -> Path:
+    """Path of the matrix of fasttext vectors of the labels, rows are aligned with the labels index"""
+    return Path(faiss_index_filename).with_suffix(".vectors.npy")
+
+
+def save_label_index(label_to_q: Dict[str, List[str]], path: Union[str, Path]) -> bool:
+    """Saves the reverse index of entity labels. Returns False if some entity id is not a Q-id and the index
+    can not be packed."""
+    path = Path(path)
+    ids = [q_id for q_ids in label_to_q.values() for q_id in q_ids]
+    if not all(QID_REGEX.fullmatch(q_id) for q_id in ids):
+        log.warning(f"labels index {path} is not saved, not all entity ids are Q-ids")
+        return False
+    nums = pack_q_ids(ids)
+    with store_dir(path) as tmp_path:
+        MmapStringSet.save_keys(tmp_path, list(label_to_q))
+        lower_labels = [label.lower() for label in label_to_q]
+        StringTable.save(tmp_path, "lower", lower_labels)
+        labels_tokens = [list(dict.fromkeys(label.split())) for label in lower_labels]
+        StringTable.save(tmp_path, "tokens", [token for tokens in labels_tokens for token in tokens])
+        label_tokens_offsets = np.zeros(len(labels_tokens) + 1, dtype=np.int64)
+        np.cumsum([len(tokens) for tokens in labels_tokens], out=label_tokens_offsets[1:])
+        np.save(tmp_path / "label_tokens_offsets.npy", label_tokens_offsets)
+        ids_offsets = np.zeros(len(label_to_q) + 1, dtype=np.int64)
+        np.cumsum([len(q_ids) for q_ids in label_to_q.values()], out=ids_offsets[1:])
+        np.save(tmp_path / "ids_offsets.npy", ids_offsets)
+        np.save(tmp_path / "ids.npy", nums)
+        with open(tmp_path / "meta.json", "w") as out:
+            json.dump({"kind": "label_index", "num_labels": len(label_to_q)}, out)
+    return True
+
+
+def load_label_index(path: Union[str, Path], num_rows: int = None) -> Union[MmapLabelIndex, None]:
+    """Loads the reverse index of entity labels if it exists and its number of rows is equal to num_rows"""
+    path = Path(path)
+    if not (path / "meta.json").exists():
+        return None
+    label_index = MmapLabelIndex(path)
+    if num_rows is not None and len(label_index) != num_rows:
+        log.warning(f"labels index {path} has {len(label_index)} rows, Faiss index has {num_rows} rows")
+        return None
+    log.info(f"loading labels index {path}")
+    return label_index
+
+
+def value_kind(values: List[Any]) -> Tuple[str, str]:
+    """Returns the kind of values and the container of the list values"""
+    container = ""
+    for value in values:
+        if isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_)):
+            return "int", ""
+        if isinstance(value, str):
+            return "str", ""
+        if isinstance(value, (list, tuple, set, frozenset)):
+            container = "set" if isinstance(value, (set, frozenset)) else "list"
+            if not value:
+                continue
+            elem = next(iter(value))
+            if isinstance(elem, str):
+                return "str_list", container
+            if isinstance(elem, tuple) and len(elem) == 2 and isinstance(elem[0], str) \
+                    and isinstance(elem[1], (int, np.integer)):
+                return "str_int_list", container
+        raise TypeError(f"values of type {type(value)} are not supported by the mmap store")
+    return ("str_list", container) if container else ("str", "")
+
+
+def save_mmap(obj: Union[Dict[str, Any], set], path: Union[str, Path], set_dict: bool = False) -> None:
+    """Saves a dict or a set of strings to the mmap store directory. If set_dict is True, a dict of sets of strings
+    is saved as a dict of MmapStringSet."""
+    with store_dir(path) as tmp_path:
+        save_store(obj, tmp_path, set_dict)
+
+
+def save_store(obj: Union[Dict[str, Any], set], tmp_path: Path, set_dict: bool) -> None:
+    if isinstance(obj, (set, frozenset)):
+        meta = {"kind": "set"}
+        MmapStringSet.save_keys(tmp_path, list(obj))
+    elif set_dict:
+        meta = {"kind": "set_dict", "names": list(obj)}
+        for name, strings in obj.items():
+            save_mmap(set(strings), tmp_path / name)
+    else:
+        kind, container = value_kind(list(obj.values()))
+        meta = {"kind": kind, "container": container}
+        keys = list(obj)
+        MmapStringSet.save_keys(tmp_path, keys)
+        if kind == "int":
+            np.save(tmp_path / "values.npy", np.array([obj[key] for key in keys], dtype=np.int64))
+        elif kind == "str":
+            StringTable.save(tmp_path, "values", [obj[key] for key in keys])
+        else:
+            value_lens = [len(obj[key]) for key in keys]
+            value_offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+            np.cumsum(value_lens, out=value_offsets[1:])
+            np.save(tmp_path / "value_offsets.npy", value_offsets)
+            if kind == "str_list":
+                StringTable.save(tmp_path, "values", [elem for key in keys for elem in obj[key]])
+            else:
+                pairs = [elem for key in keys for elem in obj[key]]
+                StringTable.save(tmp_path, "values", [string for string, _ in pairs])
+                np.save(tmp_path / "values.npy", np.array([num for _, num in pairs], dtype=np.int64))
+
+    with open(tmp_path / "meta.json", "w") as out:
+        json.dump(meta, out)
+
+
+def load_mmap(path: Union[str, Path]) -> Union[MmapDict, MmapStringSet, Dict[str, MmapStringSet]]:
+    path = Path(path)
+    with open(path / "meta.json") as fl:
+        meta = json.load(fl)
+    if meta["kind"] == "set":
+        return MmapStringSet(path)
+    if meta["kind"] == "set_dict":
+        return {name: load_mmap(path / name) for name in meta["names"]}
+    return MmapDict(path)
+
+
+def mmap_path(pickle_path: Union[str, Path]) -> Path:
+    return Path(pickle_path).with_suffix(MMAP_SUFFIX)
+
+
+def load_store(pickle_path: Union[str, Path]) -> Any:
+    """Loads the mmap store built from the pickle file if it exists, otherwise loads the pickle file"""
+    store_path = mmap_path(pickle_path)
+    if (store_path / "meta.json").exists():
+        log.info(f"loading mmap store {store_path}")
+        return load_mmap(store_path)
+    return load_pickle(pickle_path)
+
+
+def convert_pickle(pickle_path: Union[str, Path], set_dict: bool = False, overwrite: bool = False) -> None:
+    """Builds the mmap store from the pickle file"""
+    store_path = mmap_path(pickle_path)
+    if Path(pickle_path).exists() and (overwrite or not (store_path / "meta.json").exists()):
+        log.info(f"converting {pickle_path} to mmap store")
+        save_mmap(load_pickle(pickle_path), store_path, set_dict)
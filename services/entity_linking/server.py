@@ -1,12 +1,13 @@
+import asyncio
 import datetime
 import json
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
 from multiprocessing import Process
 from pathlib import Path
 from typing import Dict, List, Optional
 
 import filelock
-import pandas as pd
 import uvicorn
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from starlette.responses import JSONResponse
@@ -16,13 +17,18 @@ from starlette.requests import Request
 from starlette.middleware.cors import CORSMiddleware
 import subprocess
 from aliases import Aliases
-from constants import METRICS_FILENAME, LOCKFILE, LOGS_PATH
+from batcher import LinkingBatcher, LinkingOverloaded
+from common.metrics_store import MetricsStore
+from common.responses import encode_response
+from constants import METRICS_DB_PATH, METRICS_FILENAME, LOCKFILE, LOGS_PATH, EL_MAX_BATCH_DOCS, EL_BATCH_WAIT, \
+    EL_QUEUE_SIZE, EL_REQUEST_TIMEOUT
 from deeppavlov import build_model, deep_download
 from deeppavlov.core.data.utils import jsonify_data
 from main import initial_setup, download_wikidata, parse_wikidata, parse_entities, update_faiss
 
 logger = getLogger(__file__)
 app = FastAPI()
+metrics_store = MetricsStore(METRICS_DB_PATH, legacy_csv_path=METRICS_FILENAME)
 
 
 app.add_middleware(
@@ -36,6 +42,9 @@ app.add_middleware(
 deep_download('entity_linking.json')
 initial_setup()
 el_model = build_model('entity_linking.json', download=False)
+# the model runs in one thread outside of the event loop, so /status, /aliases and health checks are not blocked
+el_executor = ThreadPoolExecutor(max_workers=1)
+el_batcher = LinkingBatcher(el_model, el_executor, EL_MAX_BATCH_DOCS, EL_BATCH_WAIT, EL_QUEUE_SIZE)
 
 with open("/data/el_test_samples.json", 'r') as fl:
     init_test_data = json.load(fl)
@@ -55,14 +64,24 @@ class Alias(BaseModel):
     entity_ids: List[str]
 
 
+@app.on_event("startup")
+async def start_batcher():
+    el_batcher.start()
+
+
 @app.post("/model")
-async def model(payload: Batch):
-    res = el_model(payload.entity_substr,
-                   payload.entity_offsets,
-                   payload.tags,
-                   payload.sentences_offsets,
-                   payload.sentences,
-                   payload.probas)
+async def model(payload: Batch, request: Request):
+    try:
+        res = await el_batcher.link((payload.entity_substr,
+                                     payload.entity_offsets,
+                                     payload.tags,
+                                     payload.sentences_offsets,
+                                     payload.sentences,
+                                     payload.probas), EL_REQUEST_TIMEOUT)
+    except LinkingOverloaded as e:
+        raise HTTPException(status_code=503, detail=f'Entity linking is overloaded: {e}')
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail=f'Entity linking did not finish in {EL_REQUEST_TIMEOUT} seconds')
     entity_substr, conf, entity_offsets, entity_ids, entity_tags, entity_labels, entity_wiki_types, entity_wiki_tags, status = res
     response = {
         "entity_substr": entity_substr,
@@ -75,22 +94,22 @@ async def model(payload: Batch):
         "entity_wiki_tags": entity_wiki_tags,
         "status": status
     }
-    return jsonify_data(response)
+    return encode_response(request, response)
 
 
 @app.get('/last_train_metric')
 async def get_metric():
-    if Path(METRICS_FILENAME).exists():
-        df = pd.read_csv(METRICS_FILENAME)
-        last_metrics = df.iloc[-1].to_dict()
-        logger.warning(f"last_metrics {last_metrics}")
+    last_row = metrics_store.latest("entity_linking")
+    if last_row is not None:
+        last_metrics = last_row["metrics"]
+        logger.warning(f"last_metrics {last_row}")
 
-        return jsonify_data({"success": True, "data": {"time": str(last_metrics["time"]),
+        return jsonify_data({"success": True, "data": {"time": last_row["time"],
                                           "old_precision": float(last_metrics["old_precision"]),
                                           "new_precision": float(last_metrics["new_precision"]),
                                           "old_recall": float(last_metrics["old_recall"]),
                                           "new_recall": float(last_metrics["new_recall"]),
-                                          "update_model": bool(last_metrics["update_model"])}})
+                                          "update_model": last_row["update_model"]}})
     raise HTTPException(status_code=424, detail='Metrics not found. Call /evaluate to evaluate metrics.')
 
 
@@ -114,8 +133,10 @@ async def model(fl: Optional[UploadFile] = File(None)):
         sentences_offsets = sample["sentences_offsets"]
         gold_entities = sample["gold_entities"]
         entity_substr_batch, conf_batch, entity_offsets_batch, entity_ids_batch, entity_tags_batch, \
-            entity_labels_batch, status_batch = el_model([entity_substr], [entity_offsets], [tags],
-                                                         [sentences_offsets], [sentences], [probas])
+            entity_labels_batch, entity_wiki_types_batch, entity_wiki_tags_batch, status_batch = \
+            await asyncio.get_event_loop().run_in_executor(
+                el_executor, el_model, [entity_substr], [entity_offsets], [tags], [sentences_offsets], [sentences],
+                [probas])
 
         entity_ids_list = entity_ids_batch[0]
         for entity_ids, gold_entity in zip(entity_ids_list, gold_entities):
@@ -128,25 +149,21 @@ async def model(fl: Optional[UploadFile] = File(None)):
     cur_precision = num_correct / num_found
     cur_recall = num_correct / num_relevant
 
-    if Path(METRICS_FILENAME).exists():
-        df = pd.read_csv(METRICS_FILENAME)
-        max_precision = max(df["old_precision"].max(), df["new_precision"].max())
-        max_recall = max(df["old_recall"].max(), df["new_recall"].max())
+    last_row = metrics_store.latest("entity_linking")
+    if last_row is not None:
+        last_metrics = last_row["metrics"]
+        max_precision = max(last_metrics["old_precision"], last_metrics["new_precision"])
+        max_recall = max(last_metrics["old_recall"], last_metrics["new_recall"])
         update_model = cur_precision > max_precision or cur_recall > max_recall
-        df = df.append({"time": datetime.datetime.now(),
-                        "old_precision": max_precision,
-                        "new_precision": cur_precision,
-                        "old_recall": max_recall,
-                        "new_recall": cur_recall,
-                        "update_model": update_model}, ignore_index=True)
+        metrics_store.append("entity_linking", {"old_precision": max_precision,
+                                                "new_precision": cur_precision,
+                                                "old_recall": max_recall,
+                                                "new_recall": cur_recall}, update_model=update_model)
     else:
-        df = pd.DataFrame.from_dict({"time": [datetime.datetime.now()],
-                                     "old_precision": [cur_precision],
-                                     "new_precision": [cur_precision],
-                                     "old_recall": [cur_recall],
-                                     "new_recall": [cur_recall],
-                                     "update_model": [False]})
-    df.to_csv(METRICS_FILENAME, index=False, float_format='%.3f')
+        metrics_store.append("entity_linking", {"old_precision": cur_precision,
+                                                "new_precision": cur_precision,
+                                                "old_recall": cur_recall,
+                                                "new_recall": cur_recall})
     return {"precision": cur_precision, "recall": cur_recall}
 
 
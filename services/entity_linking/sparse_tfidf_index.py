@@ -0,0 +1,98 @@
+import json
+from logging import getLogger
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from mmap_store import store_dir
+
+log = getLogger(__name__)
+
+# Faiss fills the results with this distance and id -1 if the index has less than k neighbours
+FAISS_PAD_DISTANCE = np.finfo(np.float32).max
+
+
+class SparseTfidfIndex:
+    """Exact top-k search of tfidf vectors of words over the inverted index of char n-grams (the transposed CSR
+    matrix of tfidf vectors of the vocabulary), the vectors are never densified. Search returns distances and ids in
+    the same form as Faiss search: squared L2 distances for "l2" metric (used by Faiss IVF index), inner products for
+    "ip" metric (used by Faiss flat index).
+
+    Args:
+        inverted: CSR matrix of shape (number of n-grams, number of words)
+        norms_sq: squared L2 norms of the tfidf vectors of the words
+        metric: "l2" or "ip"
+    """
+
+    def __init__(self, inverted: csr_matrix, norms_sq: np.ndarray, metric: str = "l2") -> None:
+        self.inverted = inverted
+        self.norms_sq = norms_sq
+        self.metric = metric
+
+    @property
+    def ntotal(self) -> int:
+        return self.inverted.shape[1]
+
+    @classmethod
+    def build(cls, matrix: csr_matrix, metric: str = "l2") -> "SparseTfidfIndex":
+        """Builds the index from the CSR matrix of tfidf vectors of the words with shape (number of words,
+        number of n-grams)"""
+        matrix = csr_matrix(matrix, dtype=np.float32)
+        norms_sq = np.asarray(matrix.multiply(matrix).sum(axis=1), dtype=np.float32).ravel()
+        return cls(matrix.T.tocsr(), norms_sq, metric)
+
+    def search(self, queries: csr_matrix, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns distances and ids of k nearest words for every query. Words without common n-grams with the
+        query are not returned, the rest of the results is filled with id -1 as in Faiss."""
+        queries = csr_matrix(queries, dtype=np.float32)
+        dot = (queries @ self.inverted).tocsr()
+        pad_distance = FAISS_PAD_DISTANCE if self.metric == "l2" else -FAISS_PAD_DISTANCE
+        distances = np.full((queries.shape[0], k), pad_distance, dtype=np.float32)
+        ids = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        if self.metric == "l2":
+            queries_norms_sq = np.asarray(queries.multiply(queries).sum(axis=1), dtype=np.float32).ravel()
+        for i in range(queries.shape[0]):
+            start, end = dot.indptr[i], dot.indptr[i + 1]
+            cols, values = dot.indices[start:end], dot.data[start:end]
+            if self.metric == "l2":
+                values = queries_norms_sq[i] + self.norms_sq[cols] - 2.0 * values
+                sort_keys = values
+            else:
+                sort_keys = -values
+            if len(values) > k:
+                top = np.argpartition(sort_keys, k - 1)[:k]
+            else:
+                top = np.arange(len(values))
+            top = top[np.argsort(sort_keys[top], kind="stable")]
+            distances[i, :len(top)] = values[top]
+            ids[i, :len(top)] = cols[top]
+        return distances, ids
+
+    def save(self, path: Union[str, Path]) -> None:
+        with store_dir(path) as tmp_path:
+            np.save(tmp_path / "indptr.npy", self.inverted.indptr)
+            np.save(tmp_path / "indices.npy", self.inverted.indices)
+            np.save(tmp_path / "data.npy", self.inverted.data)
+            np.save(tmp_path / "norms_sq.npy", self.norms_sq)
+            with open(tmp_path / "meta.json", "w") as out:
+                json.dump({"kind": "sparse_tfidf_index", "metric": self.metric,
+                           "shape": list(self.inverted.shape)}, out)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> Optional["SparseTfidfIndex"]:
+        path = Path(path)
+        if not (path / "meta.json").exists():
+            return None
+        with open(path / "meta.json") as fl:
+            meta = json.load(fl)
+        inverted = csr_matrix((np.load(path / "data.npy", mmap_mode="r"),
+                               np.load(path / "indices.npy", mmap_mode="r"),
+                               np.load(path / "indptr.npy", mmap_mode="r")), shape=tuple(meta["shape"]), copy=False)
+        log.info(f"loading sparse tfidf index {path}")
+        return cls(inverted, np.load(path / "norms_sq.npy", mmap_mode="r"), meta["metric"])
+
+
+def sparse_index_path(faiss_index_filename: Union[str, Path]) -> Path:
+    return Path(faiss_index_filename).with_suffix(".sparse")
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# modules of the service are imported from the service directory, as in the container
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
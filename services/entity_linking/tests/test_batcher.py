@@ -0,0 +1,57 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from batcher import LinkingBatcher
+
+
+class StubLinker:
+    """Returns the upper-cased documents and fails on the batches with the document "bad" """
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, docs, tags):
+        self.batches.append(list(docs))
+        if "bad" in docs:
+            raise ValueError("bad document")
+        return [doc.upper() for doc in docs], list(tags)
+
+
+async def link_concurrently(model, requests):
+    executor = ThreadPoolExecutor(1)
+    batcher = LinkingBatcher(model, executor, max_batch_docs=100, batch_wait=0.1)
+    batcher.start()
+    try:
+        return await asyncio.gather(*[batcher.link(inputs, timeout=5.0) for inputs in requests],
+                                    return_exceptions=True)
+    finally:
+        batcher.task.cancel()
+        executor.shutdown()
+
+
+def test_batch_is_coalesced():
+    model = StubLinker()
+    requests = [(["a", "b"], ["PER", "LOC"]), (["c"], ["ORG"])]
+    results = asyncio.run(link_concurrently(model, requests))
+    assert results == [(["A", "B"], ["PER", "LOC"]), (["C"], ["ORG"])]
+    assert model.batches == [["a", "b", "c"]]
+
+
+def test_only_failing_request_gets_error():
+    model = StubLinker()
+    requests = [(["a"], ["PER"]), (["bad", "b"], ["LOC", "ORG"]), (["c"], ["ORG"])]
+    results = asyncio.run(link_concurrently(model, requests))
+    assert results[0] == (["A"], ["PER"])
+    assert isinstance(results[1], ValueError)
+    assert results[2] == (["C"], ["ORG"])
+    assert model.batches == [["a", "bad", "b", "c"], ["a"], ["bad", "b"], ["c"]]
+
+
+def test_single_request_gets_error():
+    model = StubLinker()
+    results = asyncio.run(link_concurrently(model, [(["bad"], ["PER"])]))
+    with pytest.raises(ValueError):
+        raise results[0]
+    assert model.batches == [["bad"]]
@@ -0,0 +1,127 @@
+import random
+
+import pytest
+from rapidfuzz import fuzz
+
+from fuzzy_matcher import FuzzyMatcher
+
+
+def reference_match(entity_substr, entity_label):
+    """The nested fuzz.ratio loop of EntityLinkerSep.link_entities which FuzzyMatcher replaced"""
+    cur_entity_tokens = set([token.lower() for token in entity_substr])
+    cur_entity_label_tokens = set(entity_label.lower().split())
+    inters_tokens = cur_entity_tokens.intersection(cur_entity_label_tokens)
+    num_matches = 0
+    for cur_entity_tok in cur_entity_tokens:
+        for cur_entity_label_tok in cur_entity_label_tokens:
+            if cur_entity_tok[:2] == cur_entity_label_tok[:2] \
+                    and (fuzz.ratio(cur_entity_tok, cur_entity_label_tok) > 70.0
+                         or (len(cur_entity_tok) == 3 and len(cur_entity_label_tok) == 3)):
+                num_matches += 1
+                break
+    if (len(cur_entity_tokens) == 1 and num_matches == 1) \
+            or (len(cur_entity_tokens) == 2 and num_matches == 2) \
+            or (len(cur_entity_tokens) > 2 and abs(num_matches - len(cur_entity_tokens)) <= 1):
+        if inters_tokens:
+            return len(inters_tokens) / max(len(cur_entity_tokens), len(cur_entity_label_tokens))
+        return fuzz.ratio(' '.join(entity_substr).lower(), entity_label.lower()) * 0.01
+    return None
+
+
+def indel_ratio(s1, s2):
+    """fuzz.ratio as it is defined by rapidfuzz 0.7 and 2.x: normalized InDel similarity without preprocessing"""
+    lcs = [[0] * (len(s2) + 1) for _ in range(len(s1) + 1)]
+    for i, ch1 in enumerate(s1):
+        for j, ch2 in enumerate(s2):
+            lcs[i + 1][j + 1] = lcs[i][j] + 1 if ch1 == ch2 else max(lcs[i][j + 1], lcs[i + 1][j])
+    return 100.0 * 2 * lcs[-1][-1] / (len(s1) + len(s2))
+
+
+def assert_same_as_reference(entity_substr, labels):
+    scores = FuzzyMatcher().match(entity_substr, labels)
+    expected = [reference_match(entity_substr, label) for label in labels]
+    assert [score is None for score in scores] == [score is None for score in expected]
+    for score, expected_score in zip(scores, expected):
+        if expected_score is not None:
+            assert score == pytest.approx(expected_score)
+
+
+@pytest.mark.parametrize("entity_substr,labels", [
+    # one token
+    (["Москва"], ["москва", "Москва река", "Моска", "Мостовая", "Сосква"]),
+    # two tokens
+    (["Иван", "Петров"], ["Иван Петров", "Иван Петровский", "Иван Сидоров", "Петров Иван Иванович", "Иванов"]),
+    # more than two tokens, one token may have no match
+    (["Московский", "государственный", "университет"],
+     ["Московский государственный университет", "Московский университет", "государственный университет",
+      "Московский педагогический государственный университет", "Университет"]),
+    # tokens of three characters match any token of three characters with the same prefix
+    (["ООО", "Рог"], ["ООХ Роза", "ООО Рок", "ОО Рогов", "ООХ Рогх"]),
+    # tokens of one character
+    (["А", "Б"], ["а б", "А Бе", "Аб Б", "а"]),
+    # no common tokens, the label is scored with fuzz.ratio of the whole strings
+    (["Газпромнефть"], ["Газпромнефтъ", "газпром-нефть", "Газпромнефти"]),
+    (["Петербургский", "Университет"], ["петербурский универститет", "Петербургскийй Университетт"]),
+])
+def test_matches_reference(entity_substr, labels):
+    assert_same_as_reference(entity_substr, labels)
+
+
+def test_ratio_exactly_at_threshold_is_rejected():
+    token, label_token = "abcdefghij", "abcdefgxyz"
+    assert fuzz.ratio(token, label_token) == 70.0
+    assert FuzzyMatcher().match([token], [label_token]) == [None]
+    assert reference_match([token], label_token) is None
+    assert FuzzyMatcher().match([token], ["abcdefghiz"])[0] is not None
+    assert_same_as_reference([token, "klmnop"], [f"{label_token} klmnop", "abcdefghiz klmnop"])
+
+
+def test_pretokenized_labels():
+    entity_substr = ["Иван", "Петров"]
+    labels = ["Иван Петров", "Ивана Петрова", "Иван Сидоров", "Иванн Петровв"]
+    lower_labels = [label.lower() for label in labels]
+    labels_tokens = [label.split() for label in lower_labels]
+    matcher = FuzzyMatcher()
+    expected = matcher.match(entity_substr, labels)
+    assert matcher.match(entity_substr, labels, lower_labels) == expected
+    assert matcher.match(entity_substr, labels, labels_tokens=labels_tokens) == expected
+
+
+def test_fuzz_ratio_semantics():
+    # the matcher and the previous loop depend on fuzz.ratio without a default processor: case and punctuation
+    # are not normalized, the score is the normalized InDel similarity
+    assert fuzz.ratio("Москва", "москва") == pytest.approx(indel_ratio("Москва", "москва"))
+    assert fuzz.ratio("abc", "ABC") == 0.0
+    assert fuzz.ratio("газпром-нефть", "газпромнефть") == pytest.approx(indel_ratio("газпром-нефть", "газпромнефть"))
+    rng = random.Random(0)
+    for _ in range(500):
+        s1 = "".join(rng.choice("абвгдАБ -") for _ in range(rng.randint(1, 12)))
+        s2 = "".join(rng.choice("абвгдАБ -") for _ in range(rng.randint(1, 12)))
+        assert fuzz.ratio(s1, s2) == pytest.approx(indel_ratio(s1, s2))
+
+
+def test_random_mentions_match_reference():
+    rng = random.Random(0)
+    alphabet = "абвгдеклмнАБВ"
+
+    def token():
+        return "".join(rng.choice(alphabet) for _ in range(rng.choice([1, 2, 3, 3, 4, 5, 6, 8, 10])))
+
+    def mutate(word):
+        chars = list(word)
+        for _ in range(rng.randint(0, 2)):
+            if chars and rng.random() < 0.5:
+                chars[rng.randrange(len(chars))] = rng.choice(alphabet)
+            else:
+                chars.insert(rng.randint(0, len(chars)), rng.choice(alphabet))
+        return "".join(chars) or word
+
+    for _ in range(3000):
+        entity_substr = [token() for _ in range(rng.randint(1, 4))]
+        labels = []
+        for _ in range(rng.randint(1, 5)):
+            label_tokens = [mutate(word) if rng.random() < 0.7 else token() for word in entity_substr
+                            if rng.random() < 0.9]
+            label_tokens += [token() for _ in range(rng.randint(0, 2))]
+            labels.append(" ".join(label_tokens) or token())
+        assert_same_as_reference(entity_substr, labels)
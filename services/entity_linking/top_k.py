@@ -0,0 +1,41 @@
+from typing import List
+
+import numpy as np
+
+
+def top_k_lexicographic(keys: List[np.ndarray], k: int) -> np.ndarray:
+    """Returns indices of k items with the largest keys in lexicographic order of the keys (the first key is the
+    primary one), the order is the same as of the stable sorted(..., reverse=True): items with equal keys keep
+    their original order.
+
+    Items are selected with np.partition over the primary key, the next key is used only for the items which are
+    tied with the k-th item, so the cost is linear in the number of items and only k items are sorted.
+
+    Args:
+        keys: arrays of the same length with the keys of the items
+        k: number of items to return
+
+    Returns:
+        indices of the top k items sorted by the keys in descending order
+    """
+    keys = [np.asarray(key, dtype=np.float64) for key in keys]
+    num_items = len(keys[0]) if keys else 0
+    need = min(k, num_items)
+    if need <= 0:
+        return np.zeros(0, dtype=np.int64)
+    selected = []
+    candidates = np.arange(num_items)
+    for key in keys:
+        if len(candidates) <= need:
+            break
+        values = key[candidates]
+        kth = np.partition(values, len(values) - need)[len(values) - need]
+        above = candidates[values > kth]
+        selected.append(above)
+        need -= len(above)
+        candidates = candidates[values == kth]
+    # the rest of the ties are broken by the original order of the items
+    selected.append(candidates[:need])
+    top = np.concatenate(selected)
+    order = np.lexsort([top] + [-key[top] for key in reversed(keys)])
+    return top[order]
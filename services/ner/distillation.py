@@ -0,0 +1,188 @@
+import argparse
+import json
+import random
+import re
+import time
+from logging import getLogger
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import torch
+from deeppavlov import build_model
+from deeppavlov.core.commands.utils import parse_config, expand_path
+from deeppavlov.metrics.fmeasure import ner_f1
+from filelock import FileLock
+from nltk import sent_tokenize
+
+from main import DATA_PATH, LOCKFILE, metrics_store
+
+logger = getLogger(__file__)
+
+# the same tokenization as in torch_transformers_ner_preprocessor
+TOKEN_REGEX = re.compile(r"[\w']+|[^\w ]")
+# the first teacher has priority: its distribution is taken for the tokens where it predicts an entity,
+# the same way as entities of rured model override entities of collection3 model in server.py
+TEACHER_CONFIGS = ["ner_rured.json", "ner_collection3_lower.json"]
+STUDENT_CONFIG = "ner_distilled.json"
+REPORT_FILENAME = DATA_PATH / "distillation_report.json"
+
+
+def read_tags(tags_file: str) -> List[str]:
+    with open(str(expand_path(tags_file)), encoding="utf8") as fl:
+        return [line.rsplit('\t', 1)[0] for line in fl if line.strip()]
+
+
+def tag_vocab_path(config: dict) -> str:
+    return next(component for component in config["chainer"]["pipe"]
+                if component.get("id") == "tag_vocab")["load_path"]
+
+
+class TeacherEnsemble:
+    """Runs the teacher models and merges their tag distributions into one distribution over the union of their
+    tag sets.
+
+    Args:
+        config_paths: configs of the teacher models ordered by priority
+        o_tag: tag of the tokens which are not entities
+    """
+
+    def __init__(self, config_paths: List[str], o_tag: str = "O"):
+        configs = [parse_config(config_path) for config_path in config_paths]
+        self.teachers = [build_model(config, download=False) for config in configs]
+        teacher_tags = [read_tags(tag_vocab_path(config)) for config in configs]
+        self.tags = [o_tag]
+        for tags in teacher_tags:
+            self.tags += [tag for tag in tags if tag not in self.tags]
+        self.o_ind = 0
+        self.projections = []
+        for tags in teacher_tags:
+            projection = np.zeros((len(tags), len(self.tags)), dtype=np.float32)
+            projection[np.arange(len(tags)), [self.tags.index(tag) for tag in tags]] = 1.0
+            self.projections.append(projection)
+
+    def __call__(self, tokens_batch: List[List[str]]) -> List[np.ndarray]:
+        """
+        Args:
+            tokens_batch: batch of tokenized texts
+        Returns:
+            teacher probabilities of the union tags with shape (number of tokens, number of tags) for every text
+        """
+        probas_batches = [teacher(tokens_batch)[3] for teacher in self.teachers]
+        targets_batch = []
+        for i, tokens in enumerate(tokens_batch):
+            teacher_probas = [np.asarray(probas_batch[i])[:len(tokens)] @ projection
+                              for probas_batch, projection in zip(probas_batches, self.projections)]
+            targets = teacher_probas[-1]
+            for probas in reversed(teacher_probas[:-1]):
+                is_entity = probas.argmax(axis=-1) != self.o_ind
+                targets[is_entity] = probas[is_entity]
+            targets_batch.append(targets)
+        return targets_batch
+
+
+def read_texts(texts_path: str, max_words: int = 100) -> List[List[str]]:
+    """Reads unlabeled texts (json list of strings or a text file with a text in every line) and splits them into
+    tokenized chunks of sentences not longer than max_words"""
+    with open(texts_path, encoding="utf8") as fl:
+        if texts_path.endswith(".json"):
+            texts = json.load(fl)
+        else:
+            texts = [line for line in fl if line.strip()]
+    chunks = []
+    for text in texts:
+        chunk = []
+        for sentence in sent_tokenize(text):
+            tokens = TOKEN_REGEX.findall(sentence)[:max_words]
+            if chunk and len(chunk) + len(tokens) > max_words:
+                chunks.append(chunk)
+                chunk = []
+            chunk += tokens
+        if chunk:
+            chunks.append(chunk)
+    return chunks
+
+
+def batches(samples: list, batch_size: int):
+    for i in range(0, len(samples), batch_size):
+        yield samples[i:i + batch_size]
+
+
+def evaluate_student(student, teachers: TeacherEnsemble, samples: List[List[str]],
+                     batch_size: int) -> Tuple[float, float, float]:
+    """Returns F1 of the student predictions against the merged teacher predictions and the latency of the student
+    and the teachers in milliseconds per text"""
+    teacher_tags, student_tags = [], []
+    teacher_time, student_time = 0.0, 0.0
+    for tokens_batch in batches(samples, batch_size):
+        start = time.perf_counter()
+        targets_batch = teachers(tokens_batch)
+        teacher_time += time.perf_counter() - start
+        start = time.perf_counter()
+        student_tags += student(tokens_batch)[2]
+        student_time += time.perf_counter() - start
+        teacher_tags += [[teachers.tags[ind] for ind in targets.argmax(axis=-1)] for targets in targets_batch]
+    f1 = ner_f1(teacher_tags, student_tags)
+    return f1, 1000 * teacher_time / len(samples), 1000 * student_time / len(samples)
+
+
+def distill(texts_path: str, epochs: int = 3, batch_size: int = 16, valid_share: float = 0.1,
+            temperature: float = 2.0, max_words: int = 100, seed: int = 42) -> dict:
+    student_config = parse_config(STUDENT_CONFIG)
+    teachers = TeacherEnsemble(TEACHER_CONFIGS)
+
+    samples = read_texts(texts_path, max_words)
+    random.Random(seed).shuffle(samples)
+    n_valid = max(1, int(len(samples) * valid_share))
+    valid_samples, train_samples = samples[:n_valid], samples[n_valid:]
+    logger.warning(f"distillation on {len(train_samples)} train and {len(valid_samples)} valid text chunks")
+
+    # teacher outputs do not change, so they are computed once for all epochs
+    train_targets = []
+    for tokens_batch in batches(train_samples, batch_size):
+        train_targets += [targets.astype(np.float16) for targets in teachers(tokens_batch)]
+
+    tags_path = Path(tag_vocab_path(student_config))
+    tags_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(tags_path, 'w', encoding="utf8") as out:
+        out.write("".join(f"{tag}\t1\n" for tag in teachers.tags))
+
+    student = build_model(student_config, mode="train", download=False)
+    preprocessor, tagger = student["preprocessor"], student["tagger"]
+    order = list(range(len(train_samples)))
+    for epoch in range(epochs):
+        random.Random(seed + epoch).shuffle(order)
+        losses = []
+        for batch_ids in batches(order, batch_size):
+            _, _, subword_tok_ids, startofword_markers, attention_mask, _ = \
+                preprocessor([train_samples[i] for i in batch_ids])
+            losses.append(tagger.distill_on_batch(subword_tok_ids, attention_mask, startofword_markers,
+                                                  [train_targets[i] for i in batch_ids], temperature)["loss"])
+        tagger.flush_gradients()
+        logger.warning(f"epoch {epoch}, distillation loss {np.mean(losses) if losses else 0.0:.4f}")
+    tagger.save()
+
+    f1, teacher_latency, student_latency = evaluate_student(student, teachers, valid_samples, batch_size)
+    report = {"student_teacher_f1": f1,
+              "teacher_latency_ms": teacher_latency,
+              "student_latency_ms": student_latency,
+              "speedup": teacher_latency / student_latency if student_latency else 0.0}
+    logger.warning(f"distillation report {report}")
+    with open(REPORT_FILENAME, 'w') as out:
+        json.dump(report, out, indent=2)
+    metrics_store.append("ner_distilled", report)
+    torch.cuda.empty_cache()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("texts", type=str, help="json list of unlabeled texts or a file with a text in every line")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--valid-share", type=float, default=0.1)
+    parser.add_argument("--temperature", type=float, default=2.0)
+    args = parser.parse_args()
+    with FileLock(str(LOCKFILE)):
+        distill(args.texts, args.epochs, args.batch_size, args.valid_share, args.temperature)
+    LOCKFILE.unlink()
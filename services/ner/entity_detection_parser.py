@@ -24,6 +24,11 @@ from deeppavlov.core.common.registry import register
 from deeppavlov.core.models.component import Component
 
 
+def tag_type(tag: str) -> str:
+    """Returns the type of the tag without the B-/I- prefix, the type may contain hyphens"""
+    return tag.split('-', 1)[1] if '-' in tag else tag
+
+
 @register('entity_detection_parser')
 class EntityDetectionParser(Component):
     """This class parses probabilities of tokens to be a token from the entity substring."""
@@ -50,9 +55,9 @@ class EntityDetectionParser(Component):
             tags = [line.split('\t')[0] for line in fl.readlines()]
             if self.entity_tags is None:
                 self.entity_tags = list(
-                    {tag.split('-')[1] for tag in tags if len(tag.split('-')) > 1}.difference({self.o_tag}))
+                    {tag_type(tag) for tag in tags if '-' in tag}.difference({self.o_tag}))
 
-            self.entity_prob_ind = {entity_tag: [i for i, tag in enumerate(tags) if entity_tag in tag]
+            self.entity_prob_ind = {entity_tag: [i for i, tag in enumerate(tags) if tag_type(tag) == entity_tag]
                                     for entity_tag in self.entity_tags}
             self.tags_ind = {tag: i for i, tag in enumerate(tags)}
             self.et_prob_ind = [i for tag, ind in self.entity_prob_ind.items() for i in ind]
@@ -92,7 +97,7 @@ class EntityDetectionParser(Component):
     def correct_tags(self, tokens, tags, tag_probas):
         for i in range(len(tags) - 2, -1, -1):
             if tags[i].startswith("B-") and tags[i + 1].startswith("B-") \
-                    and tags[i].split("-")[1] != tags[i + 1].split("-")[1]:
+                    and tag_type(tags[i]) != tag_type(tags[i + 1]):
                 probas_arr = [tag_probas[i][self.tags_ind[tags[i]]], tag_probas[i + 1][self.tags_ind[tags[i + 1]]]]
                 max_ind = np.argmax(probas_arr)
                 max_ind_tag = tags[i + max_ind]
@@ -104,8 +109,8 @@ class EntityDetectionParser(Component):
                 
         for i in range(len(tags) - 2, -1, -1):
             if tags[i].startswith("B-") and tags[i + 1].startswith("B-") \
-                    and tags[i].split("-")[1] == tags[i + 1].split("-")[1]:
-                new_tag = f"I-{tags[i + 1].split('-')[1]}"
+                    and tag_type(tags[i]) == tag_type(tags[i + 1]):
+                new_tag = f"I-{tag_type(tags[i + 1])}"
                 tag_probas[i + 1][self.tags_ind[new_tag]] = tag_probas[i + 1][self.tags_ind[tags[i + 1]]]
                 tags[i + 1] = new_tag
 
@@ -137,8 +142,8 @@ class EntityDetectionParser(Component):
 
         cnt = 0
         for n, (tok, tag, probas) in enumerate(zip(tokens, tags, tag_probas)):
-            if tag.split('-')[-1] in self.entity_tags:
-                f_tag = tag.split("-")[-1]
+            if tag_type(tag) in self.entity_tags:
+                f_tag = tag_type(tag)
                 if tag.startswith("B-") and any(entity_dict.values()):
                     for c_tag, entity in entity_dict.items():
                         entity = ' '.join(entity)
@@ -161,7 +166,7 @@ class EntityDetectionParser(Component):
 
             elif any(entity_dict.values()):
                 for tag, entity in entity_dict.items():
-                    c_tag = tag.split("-")[-1]
+                    c_tag = tag
                     entity = ' '.join(entity)
                     for old, new in replace_tokens:
                         entity = entity.replace(old, new)
@@ -179,7 +184,7 @@ class EntityDetectionParser(Component):
             cnt += 1
 
         for tag, entity in entity_dict.items():
-            c_tag = tag.split("-")[-1]
+            c_tag = tag
             entity = ' '.join(entity)
             for old, new in replace_tokens:
                 entity = entity.replace(old, new)
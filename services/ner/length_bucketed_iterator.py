@@ -0,0 +1,127 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from logging import getLogger
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from transformers import AutoTokenizer
+
+from deeppavlov.core.common.registry import register
+from deeppavlov.core.data.data_learning_iterator import DataLearningIterator
+
+from ner_dataset_cache import CachedSentence
+
+log = getLogger(__name__)
+
+
+@register('length_bucketed_iterator')
+class LengthBucketedIterator(DataLearningIterator):
+    """Dataset iterator which puts samples of similar length into the same batch, so that the batches padded
+    to the longest sample contain as few padding subtokens as possible.
+
+    Args:
+        data: list of (x, y) pairs for every data type in ``'train'``, ``'valid'`` and ``'test'``
+        max_tokens_per_batch: maximal number of tokens in the batch (number of samples multiplied by the length
+            of the longest sample), if None, batches are limited only by ``batch_size``. Lengths are measured
+            in subtokens (with [CLS] and [SEP]) if ``vocab_file`` is set, otherwise in words
+        vocab_file: tokenizer of the model (the ``vocab_file`` of the preprocessor)
+        do_lower_case: whether the tokenizer lowercases the words
+        bucket_pool_size: number of batches in the pool of shuffled samples which are sorted by length
+        seed: random seed for data shuffling
+        shuffle: whether to shuffle data during batching
+    """
+
+    def __init__(self, data: Dict[str, List[Tuple[Any, Any]]],
+                 max_tokens_per_batch: Optional[int] = None,
+                 vocab_file: Optional[str] = None,
+                 do_lower_case: bool = False,
+                 bucket_pool_size: int = 50,
+                 seed: int = None,
+                 shuffle: bool = True,
+                 *args, **kwargs) -> None:
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.bucket_pool_size = bucket_pool_size
+        self.vocab_file = vocab_file
+        self.do_lower_case = do_lower_case
+        # the tokenizer is loaded for the samples which are not read from the dataset cache
+        self.tokenizer = None
+        self.sample_lens = {}
+        super().__init__(data, seed=seed, shuffle=shuffle, *args, **kwargs)
+
+    def gen_batches(self, batch_size: int, data_type: str = 'train',
+                    shuffle: bool = None) -> Iterator[Tuple[tuple, tuple]]:
+        """Generate batches of samples of similar length
+
+        Args:
+            batch_size: maximal number of samples in batch
+            data_type: can be either 'train', 'test', or 'valid'
+            shuffle: whether to shuffle dataset before batching
+
+        Yields:
+             a tuple of a batch of inputs and a batch of expected outputs
+        """
+        if shuffle is None:
+            shuffle = self.shuffle
+
+        data = self.data[data_type]
+        data_len = len(data)
+
+        if data_len == 0:
+            return
+
+        if data_type not in self.sample_lens:
+            self.sample_lens[data_type] = [self.sample_len(sample) for sample in data]
+        sample_lens = self.sample_lens[data_type]
+
+        order = list(range(data_len))
+        if shuffle:
+            self.random.shuffle(order)
+
+        if batch_size < 0:
+            batch_size = data_len
+
+        pool_size = batch_size * self.bucket_pool_size
+        batches = []
+        for pool_start in range(0, data_len, pool_size):
+            pool = sorted(order[pool_start:pool_start + pool_size], key=lambda i: sample_lens[i])
+            batch, batch_max_len = [], 0
+            for i in pool:
+                sample_len = sample_lens[i]
+                new_max_len = max(batch_max_len, sample_len)
+                if batch and (len(batch) == batch_size or (self.max_tokens_per_batch is not None and
+                                                           new_max_len * (len(batch) + 1) > self.max_tokens_per_batch)):
+                    batches.append(batch)
+                    batch, new_max_len = [], sample_len
+                batch.append(i)
+                batch_max_len = new_max_len
+            if batch:
+                batches.append(batch)
+
+        if shuffle:
+            self.random.shuffle(batches)
+        for batch in batches:
+            yield tuple(zip(*[data[i] for i in batch]))
+
+    def sample_len(self, sample: Tuple[Any, Any]) -> int:
+        """Returns the number of subtokens of the sample with [CLS] and [SEP] if ``vocab_file`` is set (the dataset
+        cache stores the number of subtokens of its sentences), otherwise the number of words"""
+        x = sample[0]
+        if isinstance(x, CachedSentence):
+            return x.n_subwords if self.vocab_file is not None else len(x)
+        words = x.split() if isinstance(x, str) else x
+        if self.vocab_file is None:
+            return len(words)
+        if self.tokenizer is None:
+            self.tokenizer = AutoTokenizer.from_pretrained(self.vocab_file, do_lower_case=self.do_lower_case)
+        return sum(len(self.tokenizer.tokenize(word)) or 1 for word in words) + 2
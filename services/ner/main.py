@@ -1,50 +1,84 @@
 import argparse
-import datetime
 import shutil
 from copy import deepcopy
 from logging import getLogger
 from pathlib import Path
 
-import pandas as pd
 import torch
 from deeppavlov import train_model, evaluate_model
 from deeppavlov.core.commands.utils import parse_config
 from filelock import FileLock
 
+from common.metrics_store import MetricsStore
+
 DATA_PATH = Path('/data')
 LOCKFILE = DATA_PATH / 'lockfile'
 LOG_PATH = DATA_PATH / 'logs'
 metrics_filename = DATA_PATH / "metrics_score_history.csv"
+metrics_store = MetricsStore(DATA_PATH / "metrics_history.sqlite", legacy_csv_path=metrics_filename)
+DATASET_CACHE_PATH = DATA_PATH / 'dataset_cache'
 ner_config = parse_config("ner_rured.json")
 logger = getLogger(__file__)
 
 
+def use_dataset_cache(config: dict, data_path: str = '') -> dict:
+    """Replaces the dataset reader and the preprocessor of the config so that the sentences are tokenized once
+    and read from the memory-mapped dataset cache during training and evaluation"""
+    if config["dataset_reader"]["class_name"] != "sq_reader":
+        return config
+    config = deepcopy(config)
+    data_path = data_path or config["dataset_reader"]["data_path"]
+    pipe = config["chainer"]["pipe"]
+    preprocessor = pipe[0]
+    config["dataset_reader"] = {
+        "class_name": "ner_dataset_cache:NerCachedReader",
+        "data_path": data_path,
+        "cache_dir": str(DATASET_CACHE_PATH),
+        "vocab_file": preprocessor["vocab_file"],
+        "do_lower_case": preprocessor.get("do_lower_case", False),
+        "max_seq_length": preprocessor.get("max_seq_length", 512),
+        "max_subword_length": preprocessor.get("max_subword_length")
+    }
+    pipe[0] = {
+        "class_name": "ner_dataset_cache:NerCachedPreprocessor",
+        "cache_dir": str(DATASET_CACHE_PATH),
+        "in": preprocessor["in"],
+        "out": preprocessor["out"]
+    }
+    pipe.insert(1, {
+        "class_name": "ner_dataset_cache:NerCachedTags",
+        "cache_dir": str(DATASET_CACHE_PATH),
+        "in": ["y"],
+        "out": ["y_tags"]
+    })
+    for component in pipe[2:]:
+        for key in ["in", "fit_on"]:
+            if key in component:
+                component[key] = ["y_tags" if name == "y" else name for name in component[key]]
+    for metric in config["train"].get("metrics", []):
+        if isinstance(metric, dict) and "inputs" in metric:
+            metric["inputs"] = ["y_tags" if name == "y" else name for name in metric["inputs"]]
+    return config
+
+
 def evaluate(ner_config, after_training):
-    res = evaluate_model(ner_config)
+    res = evaluate_model(use_dataset_cache(ner_config))
     logger.warning(f"metrics {res}")
 
     metrics = dict(res["test"])
     cur_f1 = metrics["ner_f1"]
     best_score = False
 
-    if Path(metrics_filename).exists():
-        df = pd.read_csv(metrics_filename)
-        max_metric = max(df["old_metric"].max(), df["new_metric"].max())
-        df = df.append({"time": datetime.datetime.now(),
-                        "old_metric": max_metric,
-                        "new_metric": cur_f1,
-                        "update_model": cur_f1 > max_metric}, ignore_index=True)
-        if cur_f1 > max_metric:
-            best_score = True
+    max_metric = metrics_store.best("ner", "old_metric", "new_metric")
+    if max_metric is not None:
+        best_score = cur_f1 > max_metric
+        row = {"old_metric": max_metric, "new_metric": cur_f1}
     else:
-        df = pd.DataFrame.from_dict({"time": [datetime.datetime.now()],
-                                     "old_metric": [cur_f1],
-                                     "new_metric": [cur_f1],
-                                     "update_model": [False]})
         best_score = True
+        row = {"old_metric": cur_f1, "new_metric": cur_f1}
 
     if after_training:
-        df.to_csv(metrics_filename, index=False)
+        metrics_store.append("ner", row, update_model=max_metric is not None and best_score)
     torch.cuda.empty_cache()
 
     return cur_f1, best_score
@@ -80,7 +114,7 @@ def train(data_path: str = ''):
                 str(new_model_path))
             logger.warning(f"load path {config['chainer']['pipe'][i]['load_path']}"
                            f"save path {config['chainer']['pipe'][i]['save_path']}")
-    train_model(config)
+    train_model(use_dataset_cache(config))
     logger.warning('Training finished. Starting evaluation...')
     cur_f1, best_score = evaluate(config, True)
 
@@ -94,10 +128,26 @@ def train(data_path: str = ''):
     logger.warning('Training finished.')
 
 
+def train_multihead():
+    """Trains the tagger with one encoder and the heads for rured and collection3 tags on both datasets"""
+    config = parse_config("ner_multihead.json")
+    Path(config["metadata"]["variables"]["MODEL_PATH"]).mkdir(parents=True, exist_ok=True)
+    train_model(config)
+    logger.warning('Training finished. Starting evaluation...')
+    res = evaluate_model(config)
+    logger.warning(f"metrics {res}")
+    metrics_store.append("ner_multihead", dict(res["test"]))
+    torch.cuda.empty_cache()
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("data", type=str, default='')
+    parser.add_argument("data", type=str, nargs='?', default='')
+    parser.add_argument("--multihead", action="store_true", help="train the multi-head model on both datasets")
     args = parser.parse_args()
     with FileLock(str(LOCKFILE)):
-        train(args.data)
+        if args.multihead:
+            train_multihead()
+        else:
+            train(args.data)
     LOCKFILE.unlink()
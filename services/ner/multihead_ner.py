@@ -0,0 +1,104 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import pickle
+from logging import getLogger
+from pathlib import Path
+from typing import List, Dict, Tuple, Optional
+
+from deeppavlov.core.commands.utils import expand_path
+from deeppavlov.core.common.metrics_registry import register_metric
+from deeppavlov.core.common.registry import register
+from deeppavlov.core.data.dataset_reader import DatasetReader
+from deeppavlov.core.models.component import Component
+from deeppavlov.metrics.fmeasure import ner_f1
+
+log = getLogger(__name__)
+
+
+@register('multihead_ner_reader')
+class MultiHeadNerReader(DatasetReader):
+    """Reads NER datasets of several tag sets (one dataset per head of the multi-head tagger) and joins them.
+    The tags of every sample are a tuple with one element per head, which is None for the heads trained
+    on the other datasets."""
+
+    def read(self, data_path: str, datasets: List[Dict], **kwargs) -> Dict[str, List[Tuple[List[str], tuple]]]:
+        """
+        Args:
+            data_path: directory with the datasets
+            datasets: list of dicts with "data_path" (pickle or json file with "train", "valid" and "test" lists
+                of (tokens, tags) pairs, relative to ``data_path``) and optional "lowercase" for every head
+
+        Returns:
+            dict with "train", "valid" and "test" lists of (tokens, tags of every head) pairs
+        """
+        data = {"train": [], "valid": [], "test": []}
+        for head_num, dataset in enumerate(datasets):
+            dataset_path = Path(expand_path(data_path)) / dataset["data_path"]
+            if dataset_path.suffix == ".json":
+                with open(dataset_path, encoding="utf8") as fl:
+                    head_data = json.load(fl)
+            else:
+                with open(dataset_path, "rb") as fl:
+                    head_data = pickle.load(fl)
+            for data_type in data:
+                for tokens, tags in head_data.get(data_type, []):
+                    if dataset.get("lowercase", False):
+                        tokens = [token.lower() for token in tokens]
+                    heads_tags = [None] * len(datasets)
+                    heads_tags[head_num] = tags
+                    data[data_type].append((tokens, tuple(heads_tags)))
+            log.info(f"read {dataset_path} for head {head_num}")
+        return data
+
+
+@register('multihead_labels')
+class MultiHeadLabels(Component):
+    """Replaces missing tags of the heads with ``o_tag`` and returns the masks of the heads which have tags
+    for the sample
+
+    Args:
+        o_tag: tag of the tokens which are not entities
+    """
+
+    def __init__(self, o_tag: str = "O", **kwargs) -> None:
+        self.o_tag = o_tag
+
+    def __call__(self, *heads_tags_batch: List[Optional[List[str]]]) -> Tuple[List[List[str]], ...]:
+        heads_mask_batch = [[tags is not None for tags in sample_tags] for sample_tags in zip(*heads_tags_batch)]
+        filled_batches = []
+        for head_tags_batch in heads_tags_batch:
+            filled_batch = []
+            for i, tags in enumerate(head_tags_batch):
+                if tags is None:
+                    n_tokens = next(len(head_tags[i]) for head_tags in heads_tags_batch if head_tags[i] is not None)
+                    tags = [self.o_tag] * n_tokens
+                filled_batch.append(list(tags))
+            filled_batches.append(filled_batch)
+        return (*filled_batches, heads_mask_batch)
+
+
+@register_metric('multihead_ner_f1')
+def multihead_ner_f1(*args) -> float:
+    """Mean of NER F1 of the heads, computed only on the samples which have tags of the head. Arguments are
+    true tags of every head, the heads masks and predicted tags of every head."""
+    n_heads = (len(args) - 1) // 2
+    heads_y_true, heads_mask, heads_y_pred = args[:n_heads], args[n_heads], args[n_heads + 1:]
+    f1_scores = []
+    for head_num, (y_true, y_pred) in enumerate(zip(heads_y_true, heads_y_pred)):
+        head_samples = [i for i, mask in enumerate(heads_mask) if mask[head_num]]
+        if head_samples:
+            f1_scores.append(ner_f1([y_true[i] for i in head_samples], [y_pred[i] for i in head_samples]))
+    return sum(f1_scores) / len(f1_scores) if f1_scores else 0.0
@@ -15,8 +15,9 @@
 import re
 from logging import getLogger
 from string import punctuation
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 
+import numpy as np
 from nltk import sent_tokenize
 from transformers import AutoTokenizer
 
@@ -185,15 +186,20 @@ class NerChunkModel(Component):
 
     def __init__(self, ner: Chainer,
                  ner_parser: EntityDetectionParser,
+                 extra_ner_parsers: Optional[List[EntityDetectionParser]] = None,
                  **kwargs) -> None:
         """
         Args:
             ner: config for entity detection
             ner_parser: component deeppavlov.models.entity_extraction.entity_detection_parser
+            extra_ner_parsers: parsers of the additional heads of the multi-head ner model, the model should return
+                tags and probas of every head after tokens and tokens offsets; entities of the additional heads
+                are added if they do not overlap with entities of the first head
             **kwargs:
         """
         self.ner = ner
         self.ner_parser = ner_parser
+        self.ner_parsers = [ner_parser] + list(extra_ner_parsers or [])
 
     def __call__(self, text_batch_list: List[List[str]],
                  nums_batch_list: List[List[int]],
@@ -219,17 +225,23 @@ class NerChunkModel(Component):
                 zip(text_batch_list, sentences_offsets_batch_list, sentences_batch_list):
             text_batch = [text.replace("\xad", " ") for text in text_batch]
 
-            ner_tokens_batch, ner_tokens_offsets_batch, ner_probas_batch, probas_batch = self.ner(text_batch)
-            entity_substr_batch, entity_positions_batch, entity_probas_batch = \
-                self.ner_parser(ner_tokens_batch, ner_probas_batch, probas_batch)
+            ner_tokens_batch, ner_tokens_offsets_batch, *heads_outputs = self.ner(text_batch)
+            heads_entities_batch = []
+            for ner_parser, ner_probas_batch, probas_batch in \
+                    zip(self.ner_parsers, heads_outputs[::2], heads_outputs[1::2]):
+                entity_substr_batch, entity_positions_batch, entity_probas_batch = \
+                    ner_parser(ner_tokens_batch, ner_probas_batch, probas_batch)
 
-            entity_pos_tags_probas_batch = [[(entity_substr, entity_substr_positions, tag, entity_proba)
-                                             for tag, entity_substr_list in entity_substr_dict.items()
-                                             for entity_substr, entity_substr_positions, entity_proba in
-                                             zip(entity_substr_list, entity_positions_dict[tag],
-                                                 entity_probas_dict[tag])]
-                                            for entity_substr_dict, entity_positions_dict, entity_probas_dict in
-                                            zip(entity_substr_batch, entity_positions_batch, entity_probas_batch)]
+                heads_entities_batch.append(
+                    [[(entity_substr, entity_substr_positions, tag, entity_proba)
+                      for tag, entity_substr_list in entity_substr_dict.items()
+                      for entity_substr, entity_substr_positions, entity_proba in
+                      zip(entity_substr_list, entity_positions_dict[tag], entity_probas_dict[tag])]
+                     for entity_substr_dict, entity_positions_dict, entity_probas_dict in
+                     zip(entity_substr_batch, entity_positions_batch, entity_probas_batch)])
+            entity_pos_tags_probas_batch = [self.merge_heads(heads_entities, ner_tokens_offsets_list)
+                                            for heads_entities, ner_tokens_offsets_list in
+                                            zip(zip(*heads_entities_batch), ner_tokens_offsets_batch)]
 
             entity_substr_batch, entity_offsets_batch, entity_positions_batch, tags_batch, \
             probas_batch = [], [], [], [], []
@@ -316,3 +328,187 @@ class NerChunkModel(Component):
 
         return doc_entity_substr_batch, doc_entity_offsets_batch, doc_entity_positions_batch, doc_tags_batch, \
                doc_sentences_offsets_batch, doc_sentences_batch, doc_probas_batch
+
+    @staticmethod
+    def merge_heads(heads_entities: Tuple[List[tuple]], tokens_offsets: List[List[int]]) -> List[tuple]:
+        """Adds entities of the additional heads which do not overlap with the entities of the first head"""
+        merged_entities = list(heads_entities[0])
+        main_offsets = [(tokens_offsets[positions[0]][0], tokens_offsets[positions[-1]][1])
+                        for _, positions, _, _ in merged_entities]
+        for head_entities in heads_entities[1:]:
+            for entity in head_entities:
+                positions = entity[1]
+                start_offset, end_offset = tokens_offsets[positions[0]][0], tokens_offsets[positions[-1]][1]
+                if not any(offsets[0] <= start_offset <= offsets[1] or offsets[0] <= end_offset <= offsets[1]
+                           for offsets in main_offsets):
+                    merged_entities.append(entity)
+        return merged_entities
+
+
+@register('ner_sliding_window_model')
+class NerSlidingWindowModel(Component):
+    """
+        Class for tagging of the whole documents with overlapping windows: probabilities of tags of the words
+        which are in several windows are averaged, weights of the words decrease to the edges of the window,
+        so every word gets the probabilities mostly from the window where it has the most context
+    """
+
+    def __init__(self, ner: Chainer,
+                 ner_parser: EntityDetectionParser,
+                 vocab_file: str,
+                 window_size: int = 384,
+                 stride: int = 256,
+                 batch_size: int = 16,
+                 max_subword_length: int = 15,
+                 **kwargs) -> None:
+        """
+        Args:
+            ner: config for entity detection
+            ner_parser: component deeppavlov.models.entity_extraction.entity_detection_parser
+            vocab_file: transformer tokenizer name or path
+            window_size: maximal number of subtokens in the window, including [CLS] and [SEP]
+            stride: number of subtokens between the starts of the neighbouring windows, the overlap of the windows
+                is window_size - stride
+            batch_size: how many windows (of all the documents in the batch) are tagged at once
+            max_subword_length: words with more subtokens are replaced with [UNK] by the ner preprocessor
+            **kwargs:
+        """
+        self.ner = ner
+        self.ner_parser = ner_parser
+        self.window_size = window_size
+        self.stride = stride
+        self.batch_size = batch_size
+        self.max_subword_length = max_subword_length
+        self.re_tokenizer = re.compile(r"[\w']+|[^\w ]")
+        self.tokenizer = AutoTokenizer.from_pretrained(vocab_file)
+        self.tags = [tag for tag, _ in sorted(ner_parser.tags_ind.items(), key=lambda x: x[1])]
+        self.subword_lens = {}
+
+    def __call__(self, text_batch_list: List[List[str]],
+                 nums_batch_list: List[List[int]],
+                 sentences_offsets_batch_list: List[List[List[Tuple[int, int]]]],
+                 sentences_batch_list: List[List[List[str]]]
+                 ):
+        """
+        Args:
+            text_batch_list: list of document chunks
+            nums_batch_list: nums of documents
+            sentences_offsets_batch_list: indices of start and end symbols of sentences in text
+            sentences_batch_list: list of sentences from texts
+        Returns:
+            doc_entity_substr_batch: entity substrings
+            doc_entity_offsets_batch: indices of start and end symbols of entities in text
+            doc_entity_positions_batch: indices of entity tokens in the document
+            doc_tags_batch: entity tags (PER, LOC, ORG)
+            doc_sentences_offsets_batch: indices of start and end symbols of sentences in text
+            doc_sentences_batch: list of sentences from texts
+            doc_probas_batch: entity probabilities
+        """
+        doc_texts, doc_sentences_offsets_batch, doc_sentences_batch = \
+            self.join_chunks(text_batch_list, nums_batch_list, sentences_offsets_batch_list, sentences_batch_list)
+
+        doc_tokens_batch, doc_tokens_offsets_batch, windows = [], [], []
+        for doc_num, doc_text in enumerate(doc_texts):
+            tokens, tokens_offsets = [], []
+            for match in re.finditer(self.re_tokenizer, doc_text):
+                tokens.append(match.group())
+                tokens_offsets.append(match.span())
+            doc_tokens_batch.append(tokens)
+            doc_tokens_offsets_batch.append(tokens_offsets)
+            windows += [(doc_num, start, end) for start, end in self.make_windows(tokens)]
+
+        doc_probas_sums = [None] * len(doc_texts)
+        doc_weights_sums = [np.zeros(len(tokens)) for tokens in doc_tokens_batch]
+        # windows of similar length are tagged together to reduce padding
+        windows = sorted(windows, key=lambda window: window[2] - window[1])
+        for i in range(0, len(windows), self.batch_size):
+            windows_batch = windows[i:i + self.batch_size]
+            ner_outputs = self.ner([doc_tokens_batch[doc_num][start:end] for doc_num, start, end in windows_batch])
+            for (doc_num, start, end), probas in zip(windows_batch, ner_outputs[-1]):
+                window_len = end - start
+                probas = np.asarray(probas)[:window_len]
+                weights = np.minimum(np.arange(1, window_len + 1), np.arange(window_len, 0, -1)).astype(float)
+                if doc_probas_sums[doc_num] is None:
+                    doc_probas_sums[doc_num] = np.zeros((len(doc_tokens_batch[doc_num]), probas.shape[-1]))
+                doc_probas_sums[doc_num][start:end] += weights[:, None] * probas
+                doc_weights_sums[doc_num][start:end] += weights
+
+        doc_entity_substr_batch, doc_entity_offsets_batch, doc_entity_positions_batch = [], [], []
+        doc_tags_batch, doc_probas_batch = [], []
+        for tokens, tokens_offsets, probas_sums, weights_sums in \
+                zip(doc_tokens_batch, doc_tokens_offsets_batch, doc_probas_sums, doc_weights_sums):
+            entity_substr_list, entity_offsets_list, entity_positions_list, tags_list, probas_list = \
+                [], [], [], [], []
+            if tokens:
+                probas = probas_sums / weights_sums[:, None]
+                tags = [self.tags[ind] for ind in np.argmax(probas, axis=-1)]
+                entity_substr_batch, entity_positions_batch, entity_probas_batch = \
+                    self.ner_parser([tokens], [tags], [probas])
+                for tag, entity_substr_tag_list in entity_substr_batch[0].items():
+                    for entity_substr, entity_positions, entity_proba in \
+                            zip(entity_substr_tag_list, entity_positions_batch[0][tag], entity_probas_batch[0][tag]):
+                        entity_substr_list.append(entity_substr)
+                        entity_offsets_list.append((tokens_offsets[entity_positions[0]][0],
+                                                    tokens_offsets[entity_positions[-1]][1]))
+                        entity_positions_list.append(entity_positions)
+                        tags_list.append(tag)
+                        probas_list.append(entity_proba)
+            doc_entity_substr_batch.append(entity_substr_list)
+            doc_entity_offsets_batch.append(entity_offsets_list)
+            doc_entity_positions_batch.append(entity_positions_list)
+            doc_tags_batch.append(tags_list)
+            doc_probas_batch.append(probas_list)
+
+        return doc_entity_substr_batch, doc_entity_offsets_batch, doc_entity_positions_batch, doc_tags_batch, \
+               doc_sentences_offsets_batch, doc_sentences_batch, doc_probas_batch
+
+    def join_chunks(self, text_batch_list: List[List[str]],
+                    nums_batch_list: List[List[int]],
+                    sentences_offsets_batch_list: List[List[List[Tuple[int, int]]]],
+                    sentences_batch_list: List[List[List[str]]]):
+        """Joins the chunks of every document the same way as NerChunkModel does"""
+        doc_texts, doc_sentences_offsets_batch, doc_sentences_batch = [], [], []
+        cur_doc_num = None
+        for text_batch, nums_batch, sentences_offsets_batch, sentences_batch in \
+                zip(text_batch_list, nums_batch_list, sentences_offsets_batch_list, sentences_batch_list):
+            for text, doc_num, sentences_offsets_list, sentences_list in \
+                    zip(text_batch, nums_batch, sentences_offsets_batch, sentences_batch):
+                text = text.replace("\xad", " ")
+                if doc_num != cur_doc_num:
+                    doc_texts.append("")
+                    doc_sentences_offsets_batch.append([])
+                    doc_sentences_batch.append([])
+                    cur_doc_num = doc_num
+                text_len_sum = len(doc_texts[-1]) + 1 if doc_texts[-1] else 0
+                doc_sentences_offsets_batch[-1] += [(start_offset + text_len_sum, end_offset + text_len_sum)
+                                                    for start_offset, end_offset in sentences_offsets_list]
+                doc_sentences_batch[-1] += sentences_list
+                doc_texts[-1] = f"{doc_texts[-1]} {text}" if doc_texts[-1] else text
+        return doc_texts, doc_sentences_offsets_batch, doc_sentences_batch
+
+    def make_windows(self, tokens: List[str]) -> List[Tuple[int, int]]:
+        """Splits the document into overlapping windows of words which do not exceed window_size subtokens"""
+        subword_lens = [self.subword_len(token) for token in tokens]
+        subword_starts = np.cumsum([0] + subword_lens)
+        max_len = self.window_size - 2
+        windows = []
+        start = 0
+        while start < len(tokens):
+            end = int(np.searchsorted(subword_starts, subword_starts[start] + max_len, side="right")) - 1
+            end = max(end, start + 1)
+            windows.append((start, end))
+            if end >= len(tokens):
+                break
+            next_start = int(np.searchsorted(subword_starts, subword_starts[start] + self.stride, side="left"))
+            start = min(max(next_start, start + 1), end)
+        return windows
+
+    def subword_len(self, token: str) -> int:
+        if token not in self.subword_lens:
+            if len(self.subword_lens) > 1000000:
+                self.subword_lens = {}
+            subword_len = len(self.tokenizer.tokenize(token))
+            if subword_len == 0 or subword_len > self.max_subword_length:
+                subword_len = 1
+            self.subword_lens[token] = subword_len
+        return self.subword_lens[token]
@@ -0,0 +1,294 @@
+# Copyright 2017 Neural Networks and Deep Learning lab, MIPT
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from functools import lru_cache
+from logging import getLogger
+from pathlib import Path
+from typing import List, Dict, Tuple, Optional, Any
+
+import numpy as np
+import transformers
+from transformers import AutoTokenizer
+
+from deeppavlov.core.commands.utils import expand_path
+from deeppavlov.core.common.registry import register
+from deeppavlov.core.data.dataset_reader import DatasetReader
+from deeppavlov.core.models.component import Component
+
+log = getLogger(__name__)
+
+CACHE_FORMAT_VERSION = 1
+
+
+class CachedSentence:
+    """Reference to the sentence in the dataset cache. Its length is the number of tokens in the sentence and
+    ``n_subwords`` is the number of its subwords (with ``[CLS]`` and ``[SEP]``), so that the dataset iterators can
+    batch the sentences by length without reading the cache."""
+
+    __slots__ = ("cache_key", "row", "n_tokens", "n_subwords")
+
+    def __init__(self, cache_key: str, row: int, n_tokens: int, n_subwords: int):
+        self.cache_key = cache_key
+        self.row = row
+        self.n_tokens = n_tokens
+        self.n_subwords = n_subwords
+
+    def __len__(self) -> int:
+        return self.n_tokens
+
+    def __repr__(self) -> str:
+        return f"CachedSentence({self.cache_key}, {self.row})"
+
+
+class NerDatasetCache:
+    """Pre-tokenized NER dataset stored in memory-mapped arrays.
+
+    Subword ids and start-of-word markers of all sentences (including ``[CLS]`` and ``[SEP]``) are concatenated
+    into flat arrays, as well as label ids of tokens. ``offsets`` array holds for every sentence the start and
+    the end of its subwords and of its labels in the flat arrays.
+
+    Args:
+        path: directory with the cache files
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        with open(self.path / "meta.json") as fl:
+            self.meta = json.load(fl)
+        self.tags = self.meta["tags"]
+        self.splits = self.meta["splits"]
+        self.subword_ids = self._open_memmap("subword_ids.bin", np.int32, self.meta["n_subwords"])
+        self.startofword_markers = self._open_memmap("startofword_markers.bin", np.int8, self.meta["n_subwords"])
+        self.labels = self._open_memmap("labels.bin", np.int16, self.meta["n_labels"])
+        self.offsets = np.load(self.path / "offsets.npy", mmap_mode="r")
+
+    def _open_memmap(self, filename: str, dtype: type, length: int) -> np.ndarray:
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.path / filename, dtype=dtype, mode="r", shape=(length,))
+
+    def sentences(self, data_type: str) -> List[CachedSentence]:
+        start, end = self.splits[data_type]
+        n_subwords = self.offsets[start:end, 1] - self.offsets[start:end, 0]
+        n_tokens = self.offsets[start:end, 3] - self.offsets[start:end, 2]
+        return [CachedSentence(self.path.name, row, int(length), int(subwords_length))
+                for row, length, subwords_length in zip(range(start, end), n_tokens, n_subwords)]
+
+    def subwords(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        subword_start, subword_end = self.offsets[row, :2]
+        return self.subword_ids[subword_start:subword_end], self.startofword_markers[subword_start:subword_end]
+
+    def tags_of(self, row: int) -> List[str]:
+        label_start, label_end = self.offsets[row, 2:]
+        return [self.tags[label] for label in self.labels[label_start:label_end]]
+
+    @classmethod
+    def compile(cls, dataset: Dict[str, List[Tuple[List[str], List[str]]]], path: Path, tokenizer: AutoTokenizer,
+                max_seq_length: Optional[int] = 512, max_subword_length: Optional[int] = None) -> 'NerDatasetCache':
+        """Tokenizes the dataset the same way as ``torch_transformers_ner_preprocessor`` does and writes it
+        to the cache directory"""
+        path = Path(path)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        if tmp_path.exists():
+            shutil.rmtree(tmp_path)
+        tmp_path.mkdir(parents=True)
+
+        cls_id, sep_id, unk_id = tokenizer.convert_tokens_to_ids(["[CLS]", "[SEP]", "[UNK]"])
+        tags_ind = {}
+        offsets, splits = [], {}
+        n_subwords, n_labels = 0, 0
+        with open(tmp_path / "subword_ids.bin", "wb") as subword_ids_fl, \
+                open(tmp_path / "startofword_markers.bin", "wb") as markers_fl, \
+                open(tmp_path / "labels.bin", "wb") as labels_fl:
+            for data_type in ["train", "valid", "test"]:
+                split_start = len(offsets)
+                for tokens, tags in dataset.get(data_type, []):
+                    subword_ids, markers = [cls_id], [0]
+                    for token in tokens:
+                        subwords = tokenizer.tokenize(token)
+                        if not subwords or (max_subword_length is not None and len(subwords) > max_subword_length):
+                            subword_ids.append(unk_id)
+                            markers.append(1)
+                        else:
+                            subword_ids += tokenizer.convert_tokens_to_ids(subwords)
+                            markers += [1] + [0] * (len(subwords) - 1)
+                    subword_ids.append(sep_id)
+                    markers.append(0)
+                    if max_seq_length is not None and len(subword_ids) > max_seq_length:
+                        raise RuntimeError(f"input sequence after bert tokenization"
+                                           f" shouldn't exceed {max_seq_length} tokens.")
+                    labels = [tags_ind.setdefault(tag, len(tags_ind)) for tag in tags]
+
+                    subword_ids_fl.write(np.array(subword_ids, dtype=np.int32).tobytes())
+                    markers_fl.write(np.array(markers, dtype=np.int8).tobytes())
+                    labels_fl.write(np.array(labels, dtype=np.int16).tobytes())
+                    offsets.append((n_subwords, n_subwords + len(subword_ids), n_labels, n_labels + len(labels)))
+                    n_subwords += len(subword_ids)
+                    n_labels += len(labels)
+                splits[data_type] = [split_start, len(offsets)]
+
+        np.save(tmp_path / "offsets.npy", np.array(offsets, dtype=np.int64).reshape(-1, 4))
+        with open(tmp_path / "meta.json", "w") as fl:
+            json.dump({"version": CACHE_FORMAT_VERSION,
+                       "tags": list(tags_ind),
+                       "splits": splits,
+                       "n_subwords": n_subwords,
+                       "n_labels": n_labels}, fl)
+        if path.exists():
+            shutil.rmtree(path)
+        tmp_path.rename(path)
+        log.info(f"Compiled dataset cache {path}: {len(offsets)} sentences, {n_subwords} subwords")
+        return cls(path)
+
+
+def dataset_cache_key(data_path: Path, vocab_file: str, do_lower_case: bool, max_seq_length: Optional[int],
+                      max_subword_length: Optional[int]) -> str:
+    """Cache key is built from the hash of the dataset file and the version of the tokenizer"""
+    dataset_hash = hashlib.sha1()
+    with open(data_path, "rb") as fl:
+        for chunk in iter(lambda: fl.read(1 << 20), b""):
+            dataset_hash.update(chunk)
+    tokenizer_version = f"{vocab_file}|{transformers.__version__}|{do_lower_case}|{max_seq_length}|" \
+                        f"{max_subword_length}|{CACHE_FORMAT_VERSION}"
+    tokenizer_hash = hashlib.sha1(tokenizer_version.encode("utf8")).hexdigest()
+    return f"{dataset_hash.hexdigest()[:20]}_{tokenizer_hash[:12]}"
+
+
+def evict_dataset_caches(cache_dir: Path, max_cached_datasets: int, keep_key: str) -> None:
+    """Removes the least recently used compiled datasets so that at most max_cached_datasets of them remain,
+    the dataset keep_key is never removed"""
+    cache_paths = [path for path in cache_dir.iterdir()
+                   if path.is_dir() and path.name != keep_key and (path / "meta.json").exists()]
+    cache_paths.sort(key=lambda path: path.stat().st_mtime, reverse=True)
+    evicted = cache_paths[max(max_cached_datasets - 1, 0):]
+    for path in evicted:
+        log.info(f"Removing dataset cache {path}")
+        shutil.rmtree(path, ignore_errors=True)
+    if evicted:
+        open_dataset_cache.cache_clear()
+
+
+@lru_cache(maxsize=8)
+def open_dataset_cache(cache_dir: str, cache_key: str) -> NerDatasetCache:
+    return NerDatasetCache(Path(expand_path(cache_dir)) / cache_key)
+
+
+@register('ner_cached_reader')
+class NerCachedReader(DatasetReader):
+    """Reads NER dataset from pickle or json file, compiles it into the pre-tokenized dataset cache (if the cache
+    for this dataset and tokenizer does not exist yet) and returns references to the cached sentences."""
+
+    def read(self, data_path: str,
+             vocab_file: str,
+             cache_dir: str = "/data/dataset_cache",
+             do_lower_case: bool = False,
+             max_seq_length: Optional[int] = 512,
+             max_subword_length: Optional[int] = None,
+             max_cached_datasets: int = 8,
+             **kwargs) -> Dict[str, List[Tuple[CachedSentence, CachedSentence]]]:
+        """
+        Args:
+            data_path: path to the dataset file with "train", "valid" and "test" lists of (tokens, tags) pairs
+            vocab_file: transformer tokenizer name or path
+            cache_dir: directory with compiled datasets
+            do_lower_case: set True if lowercasing is needed
+            max_seq_length: max sequence length in subtokens, including [SEP] and [CLS] tokens
+            max_subword_length: replace token to <unk> if it's length is larger than this
+            max_cached_datasets: maximal number of compiled datasets in cache_dir, the least recently used ones are
+                removed when a new dataset is compiled (every uploaded dataset has its own cache)
+        Returns:
+            dict with "train", "valid" and "test" lists of (sentence, sentence) pairs, where the first element
+                is used to get subtokens and the second one to get tags
+        """
+        data_path = Path(expand_path(data_path))
+        cache_dir = Path(expand_path(cache_dir))
+        cache_key = dataset_cache_key(data_path, vocab_file, do_lower_case, max_seq_length, max_subword_length)
+        cache_path = cache_dir / cache_key
+        if (cache_path / "meta.json").exists():
+            log.info(f"Using dataset cache {cache_path}")
+            # the modification time of the directory orders the caches by their last use
+            os.utime(cache_path)
+        else:
+            tokenizer = AutoTokenizer.from_pretrained(vocab_file, do_lower_case=do_lower_case)
+            NerDatasetCache.compile(self.load_dataset(data_path), cache_path, tokenizer,
+                                    max_seq_length, max_subword_length)
+            evict_dataset_caches(cache_dir, max_cached_datasets, cache_key)
+        dataset_cache = open_dataset_cache(str(cache_dir), cache_key)
+        return {data_type: [(sentence, sentence) for sentence in dataset_cache.sentences(data_type)]
+                for data_type in ["train", "valid", "test"]}
+
+    @staticmethod
+    def load_dataset(data_path: Path) -> Dict[str, Any]:
+        if data_path.suffix == ".json":
+            with open(data_path, encoding="utf8") as fl:
+                return json.load(fl)
+        with open(data_path, "rb") as fl:
+            return pickle.load(fl)
+
+
+@register('ner_cached_preprocessor')
+class NerCachedPreprocessor(Component):
+    """Drop-in replacement of ``torch_transformers_ner_preprocessor`` for training and evaluation which reads
+    subtokens of the sentences from the dataset cache instead of tokenizing them.
+
+    Args:
+        cache_dir: directory with compiled datasets
+    """
+
+    def __init__(self, cache_dir: str = "/data/dataset_cache", **kwargs) -> None:
+        self.cache_dir = str(expand_path(cache_dir))
+
+    def __call__(self, sentences: List[CachedSentence]) -> Tuple[List[List[str]], List[List[str]], np.ndarray,
+                                                                 np.ndarray, np.ndarray, List[List[Any]]]:
+        """
+        Args:
+            sentences: batch of references to the cached sentences
+        Returns:
+            the same outputs as ``torch_transformers_ner_preprocessor``: tokens, subword tokens, subword token ids,
+                start-of-word markers, attention mask and tokens offsets (token strings are not stored in the cache,
+                so tokens, subword tokens and offsets are empty)
+        """
+        subwords_batch = [open_dataset_cache(self.cache_dir, sentence.cache_key).subwords(sentence.row)
+                          for sentence in sentences]
+        max_len = max([len(subword_ids) for subword_ids, _ in subwords_batch] + [1])
+        subword_tok_ids = np.zeros((len(sentences), max_len), dtype=np.int64)
+        startofword_markers = np.zeros((len(sentences), max_len), dtype=np.int64)
+        attention_mask = np.zeros((len(sentences), max_len), dtype=np.int64)
+        for i, (subword_ids, markers) in enumerate(subwords_batch):
+            subword_tok_ids[i, :len(subword_ids)] = subword_ids
+            startofword_markers[i, :len(markers)] = markers
+            attention_mask[i, :len(subword_ids)] = 1
+        empty = [[] for _ in sentences]
+        return empty, empty, subword_tok_ids, startofword_markers, attention_mask, empty
+
+
+@register('ner_cached_tags')
+class NerCachedTags(Component):
+    """Reads tags of the sentences from the dataset cache
+
+    Args:
+        cache_dir: directory with compiled datasets
+    """
+
+    def __init__(self, cache_dir: str = "/data/dataset_cache", **kwargs) -> None:
+        self.cache_dir = str(expand_path(cache_dir))
+
+    def __call__(self, sentences: List[CachedSentence]) -> List[List[str]]:
+        return [open_dataset_cache(self.cache_dir, sentence.cache_key).tags_of(sentence.row)
+                for sentence in sentences]
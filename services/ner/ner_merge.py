@@ -0,0 +1,59 @@
+import copy
+from typing import Dict, List, Optional, Tuple
+
+
+def merge_ner_outputs(outputs: Tuple[List, ...], lower_outputs: Optional[Tuple[List, ...]] = None) -> Dict[str, list]:
+    """Returns the response of the NER service. Entities of the lowercased model which do not overlap with
+    the entities of the main model are appended to the entities of the main model.
+
+    Args:
+        outputs: outputs of the main entity detection model (substrings, offsets, positions, tags, sentences offsets,
+            sentences, probas)
+        lower_outputs: outputs of the lowercased entity detection model, None if only one model is used
+    """
+    substr_b, offsets_b, pos_b, tags_b, sent_offsets_b, sent_b, probas_b = outputs
+    if lower_outputs is None:
+        return {"entity_substr": substr_b,
+                "entity_offsets": offsets_b,
+                "entity_positions": pos_b,
+                "tags": tags_b,
+                "sentences_offsets": sent_offsets_b,
+                "sentences": sent_b,
+                "probas": probas_b}
+    substr_lw_b, offsets_lw_b, pos_lw_b, tags_lw_b, sent_offsets_lw_b, sent_lw_b, probas_lw_b = lower_outputs
+
+    substr_bt, offsets_bt, pos_bt, tags_bt, probas_bt = [], [], [], [], []
+    for substr_l, offsets_l, pos_l, tags_l, probas_l, substr_lw_l, offsets_lw_l, pos_lw_l, tags_lw_l, probas_lw_l in \
+            zip(substr_b, offsets_b, pos_b, tags_b, probas_b, substr_lw_b, offsets_lw_b, pos_lw_b, tags_lw_b,
+                probas_lw_b):
+        substr_t = copy.deepcopy(substr_l)
+        offsets_t = copy.deepcopy(offsets_l)
+        pos_t = copy.deepcopy(pos_l)
+        tags_t = copy.deepcopy(tags_l)
+        probas_t = copy.deepcopy(probas_l)
+        for substr_lw, offsets_lw, pos_lw, tag_lw, probas_lw in \
+                zip(substr_lw_l, offsets_lw_l, pos_lw_l, tags_lw_l, probas_lw_l):
+            found = False
+            for offsets in offsets_l:
+                if offsets[0] <= offsets_lw[0] <= offsets[1] or offsets[0] <= offsets_lw[1] <= offsets[1]:
+                    found = True
+                    break
+            if not found:
+                substr_t.append(substr_lw)
+                offsets_t.append(offsets_lw)
+                pos_t.append(pos_lw)
+                tags_t.append(tag_lw)
+                probas_t.append(probas_lw)
+        substr_bt.append(substr_t)
+        offsets_bt.append(offsets_t)
+        pos_bt.append(pos_t)
+        tags_bt.append(tags_t)
+        probas_bt.append(probas_t)
+
+    return {"entity_substr": substr_bt,
+            "entity_offsets": offsets_bt,
+            "entity_positions": pos_bt,
+            "tags": tags_bt,
+            "sentences_offsets": sent_offsets_b,
+            "sentences": sent_b,
+            "probas": probas_bt}
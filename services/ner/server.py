@@ -1,12 +1,11 @@
-import copy
 import datetime
 import json
 import subprocess
 from logging import getLogger
+from os import getenv
 from pathlib import Path
 from typing import Optional, List
 
-import pandas as pd
 import uvicorn
 from deeppavlov import build_model, deep_download
 from deeppavlov.core.commands.utils import parse_config
@@ -15,9 +14,13 @@ from filelock import FileLock, Timeout
 from pydantic import BaseModel
 from starlette.exceptions import HTTPException
 from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+
+from common.responses import encode_response
 
 from initial_setup import initial_setup
-from main import evaluate, ner_config, metrics_filename, LOCKFILE, LOG_PATH
+from main import evaluate, ner_config, metrics_store, LOCKFILE, LOG_PATH
+from ner_merge import merge_ner_outputs
 
 logger = getLogger(__file__)
 app = FastAPI()
@@ -30,15 +33,28 @@ app.add_middleware(
     allow_headers=['*']
 )
 
-entity_detection_config = parse_config("entity_detection_rured.json")
-entity_detection_lower_config = parse_config("entity_detection_collection3_lower.json")
+# the distilled and the multi-head models cover tags of both rured and collection3 models, so one model pass is made
+# per request instead of two
+SINGLE_NER_CONFIGS = {"distilled": "entity_detection_distilled.json",
+                      "multihead": "entity_detection_multihead.json"}
+NER_MODEL = getenv("NER_MODEL", "ensemble")
+USE_SINGLE_NER = NER_MODEL in SINGLE_NER_CONFIGS
+# entity_detection_rured_sliding.json tags whole documents with overlapping windows instead of separate chunks
+RURED_CONFIG = getenv("RURED_CONFIG", "entity_detection_rured.json")
+
+if USE_SINGLE_NER:
+    LOG_PATH.mkdir(parents=True, exist_ok=True)
+    entity_detection = build_model(parse_config(SINGLE_NER_CONFIGS[NER_MODEL]), download=False)
+else:
+    entity_detection_config = parse_config(RURED_CONFIG)
+    entity_detection_lower_config = parse_config("entity_detection_collection3_lower.json")
 
-deep_download("entity_detection_rured.json")
-deep_download("entity_detection_collection3_lower.json")
-initial_setup()
+    deep_download(RURED_CONFIG)
+    deep_download("entity_detection_collection3_lower.json")
+    initial_setup()
 
-entity_detection = build_model(entity_detection_config, download=False)
-entity_detection_lower = build_model(entity_detection_lower_config, download=False)
+    entity_detection = build_model(entity_detection_config, download=False)
+    entity_detection_lower = build_model(entity_detection_lower_config, download=False)
 
 
 class Payload(BaseModel):
@@ -46,61 +62,24 @@ class Payload(BaseModel):
 
 
 @app.post("/model")
-async def model(payload: Payload):
-    substr_b, offsets_b, pos_b, tags_b, sent_offsets_b, sent_b, probas_b = entity_detection(payload.x)
-    substr_lw_b, offsets_lw_b, pos_lw_b, tags_lw_b, sent_offsets_lw_b, sent_lw_b, probas_lw_b = \
-        entity_detection_lower(payload.x)
-
-    substr_bt, offsets_bt, pos_bt, tags_bt, probas_bt = [], [], [], [], []
-    for substr_l, offsets_l, pos_l, tags_l, probas_l, substr_lw_l, offsets_lw_l, pos_lw_l, tags_lw_l, probas_lw_l in \
-            zip(substr_b, offsets_b, pos_b, tags_b, probas_b, substr_lw_b, offsets_lw_b, pos_lw_b, tags_lw_b,
-                probas_lw_b):
-        substr_t = copy.deepcopy(substr_l)
-        offsets_t = copy.deepcopy(offsets_l)
-        pos_t = copy.deepcopy(pos_l)
-        tags_t = copy.deepcopy(tags_l)
-        probas_t = copy.deepcopy(probas_l)
-        for substr_lw, offsets_lw, pos_lw, tag_lw, probas_lw in \
-                zip(substr_lw_l, offsets_lw_l, pos_lw_l, tags_lw_l, probas_lw_l):
-            found = False
-            for offsets in offsets_l:
-                if offsets[0] <= offsets_lw[0] <= offsets[1] or offsets[0] <= offsets_lw[1] <= offsets[1]:
-                    found = True
-                    break
-            if not found:
-                substr_t.append(substr_lw)
-                offsets_t.append(offsets_lw)
-                pos_t.append(pos_lw)
-                tags_t.append(tag_lw)
-                probas_t.append(probas_lw)
-        substr_bt.append(substr_t)
-        offsets_bt.append(offsets_t)
-        pos_bt.append(pos_t)
-        tags_bt.append(tags_t)
-        probas_bt.append(probas_t)
-
-    res = {"entity_substr": substr_bt,
-           "entity_offsets": offsets_bt,
-           "entity_positions": pos_bt,
-           "tags": tags_bt,
-           "sentences_offsets": sent_offsets_b,
-           "sentences": sent_b,
-           "probas": probas_bt}
-    return res
+async def model(payload: Payload, request: Request):
+    if USE_SINGLE_NER:
+        return encode_response(request, merge_ner_outputs(entity_detection(payload.x)))
+    return encode_response(request, merge_ner_outputs(entity_detection(payload.x), entity_detection_lower(payload.x)))
 
 
 @app.get('/last_train_metric')
 async def get_metric():
     last_metrics = {"success": False, "detail": "There is no metrics file. Call /evaluate to create"}
-    if Path(metrics_filename).exists():
-        df = pd.read_csv(metrics_filename)
-        last_metrics = df.iloc[-1].to_dict()
-        logger.warning(f"last_metrics {last_metrics}")
+    last_row = metrics_store.latest("ner")
+    if last_row is not None:
+        last_metrics = last_row["metrics"]
+        logger.warning(f"last_metrics {last_row}")
 
-        last_metrics = {"success": True, "data": {"time": str(last_metrics["time"]),
+        last_metrics = {"success": True, "data": {"time": last_row["time"],
                                                   "old_metric": float(last_metrics["old_metric"]),
                                                   "new_metric": float(last_metrics["new_metric"]),
-                                                  "update_model": bool(last_metrics["update_model"])}}
+                                                  "update_model": last_row["update_model"]}}
     return last_metrics
 
 
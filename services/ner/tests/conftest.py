@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# modules of the service are imported from the service directory, as in the container
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class StubTokenizer:
+    """Splits words into subwords of two characters"""
+
+    def __init__(self) -> None:
+        self.vocab = {"[CLS]": 0, "[SEP]": 1, "[UNK]": 2}
+
+    @classmethod
+    def from_pretrained(cls, *args, **kwargs) -> "StubTokenizer":
+        return cls()
+
+    def tokenize(self, word):
+        return [word[i:i + 2] for i in range(0, len(word), 2)]
+
+    def convert_tokens_to_ids(self, tokens):
+        return [self.vocab.setdefault(token, len(self.vocab)) for token in tokens]
+
+
+@pytest.fixture
+def stub_tokenizer(monkeypatch):
+    """Replaces the transformers tokenizer of the dataset cache and of the iterator"""
+    pytest.importorskip("deeppavlov")
+    pytest.importorskip("transformers")
+    monkeypatch.setattr("ner_dataset_cache.AutoTokenizer", StubTokenizer)
+    monkeypatch.setattr("length_bucketed_iterator.AutoTokenizer", StubTokenizer)
+    return StubTokenizer
@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("deeppavlov")
+nltk = pytest.importorskip("nltk")
+
+from entity_detection_parser import EntityDetectionParser, tag_type
+
+
+@pytest.fixture
+def parser(tmp_path):
+    try:
+        nltk.corpus.stopwords.words("russian")
+    except LookupError:
+        pytest.skip("nltk stopwords are not downloaded")
+    tags = ["O", "B-PER", "I-PER", "B-GEO-POL", "I-GEO-POL", "B-POL", "I-POL"]
+    tags_file = tmp_path / "tag.dict"
+    tags_file.write_text("".join(f"{tag}\t1\n" for tag in tags))
+    return EntityDetectionParser(o_tag="O", tags_file=str(tags_file))
+
+
+def test_tag_type():
+    assert tag_type("B-PER") == "PER"
+    assert tag_type("I-GEO-POL") == "GEO-POL"
+    assert tag_type("O") == "O"
+
+
+def test_hyphenated_tag_types_have_their_probas(parser):
+    assert sorted(parser.entity_tags) == ["GEO-POL", "PER", "POL"]
+    assert parser.entity_prob_ind["GEO-POL"] == [3, 4]
+    assert parser.entity_prob_ind["POL"] == [5, 6]
+    assert parser.entity_prob_ind["PER"] == [1, 2]
+
+
+def test_entities_of_hyphenated_tag_types(parser):
+    tokens = ["Новая", "Зеландия", "и", "Иван"]
+    tags = ["B-GEO-POL", "I-GEO-POL", "O", "B-PER"]
+    probas = [[0.0] * 7 for _ in tokens]
+    for probas_row, tag in zip(probas, tags):
+        probas_row[parser.tags_ind[tag]] = 0.9
+    entities, positions, entities_probas = parser([tokens], [tags], [probas])
+    assert entities[0] == ["Новая Зеландия", "Иван"]
+    assert positions[0] == [[0, 1], [3]]
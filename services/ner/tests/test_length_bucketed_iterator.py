@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+pytest.importorskip("deeppavlov")
+pytest.importorskip("transformers")
+
+from length_bucketed_iterator import LengthBucketedIterator
+from ner_dataset_cache import CachedSentence, NerCachedReader
+
+
+@pytest.fixture
+def cached_dataset(tmp_path, stub_tokenizer):
+    sentences = [(["слово"] * n_words, ["O"] * n_words) for n_words in range(1, 41)]
+    data_path = tmp_path / "dataset.json"
+    with open(data_path, "w", encoding="utf8") as fl:
+        json.dump({"train": sentences, "valid": sentences[:5], "test": []}, fl)
+    return NerCachedReader().read(str(data_path), vocab_file="stub", cache_dir=str(tmp_path / "cache"))
+
+
+def test_batches_of_cached_sentences_are_bounded_by_subtokens(cached_dataset):
+    iterator = LengthBucketedIterator(cached_dataset, max_tokens_per_batch=200, vocab_file="stub", seed=1)
+    batches = list(iterator.gen_batches(batch_size=16, data_type="train"))
+
+    sentences = [sentence for x_batch, _ in batches for sentence in x_batch]
+    assert all(isinstance(sentence, CachedSentence) for sentence in sentences)
+    assert sorted(sentence.row for sentence in sentences) == list(range(40))
+    for x_batch, _ in batches:
+        # "слово" is split into 3 subwords, [CLS] and [SEP] are counted
+        assert all(sentence.n_subwords == 3 * len(sentence) + 2 for sentence in x_batch)
+        assert len(x_batch) * max(sentence.n_subwords for sentence in x_batch) <= 200
+
+
+def test_cached_sentences_are_bounded_by_words_without_vocab_file(cached_dataset):
+    iterator = LengthBucketedIterator(cached_dataset, max_tokens_per_batch=60, seed=1)
+    for x_batch, _ in iterator.gen_batches(batch_size=16, data_type="train"):
+        assert len(x_batch) * max(len(sentence) for sentence in x_batch) <= 60
+
+
+def test_raw_sentences_are_tokenized(stub_tokenizer):
+    data = {"train": [(["слово"] * n_words, ["O"] * n_words) for n_words in range(1, 21)], "valid": [], "test": []}
+    iterator = LengthBucketedIterator(data, max_tokens_per_batch=100, vocab_file="stub", seed=1)
+    for x_batch, _ in iterator.gen_batches(batch_size=16, data_type="train"):
+        assert len(x_batch) * max(3 * len(tokens) + 2 for tokens in x_batch) <= 100
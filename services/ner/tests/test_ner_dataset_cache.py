@@ -0,0 +1,35 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("deeppavlov")
+pytest.importorskip("transformers")
+
+from ner_dataset_cache import NerCachedReader
+
+
+def write_dataset(path, n_sentences):
+    sentences = [(["слово"] * n_words, ["O"] * n_words) for n_words in range(1, n_sentences + 1)]
+    with open(path, "w", encoding="utf8") as fl:
+        json.dump({"train": sentences, "valid": [], "test": []}, fl)
+
+
+def test_least_recently_used_datasets_are_evicted(tmp_path, stub_tokenizer):
+    cache_dir = tmp_path / "cache"
+    reader = NerCachedReader()
+    keys = []
+    for n_sentences in range(1, 6):
+        data_path = tmp_path / f"dataset_{n_sentences}.json"
+        write_dataset(data_path, n_sentences)
+        data = reader.read(str(data_path), vocab_file="stub", cache_dir=str(cache_dir), max_cached_datasets=3)
+        assert len(data["train"]) == n_sentences
+        keys.append(data["train"][0][0].cache_key)
+        # directories of the caches have distinct modification times
+        os.utime(cache_dir / keys[-1], (n_sentences, n_sentences))
+        if n_sentences == 3:
+            # the first dataset is used again, so the second one is the least recently used
+            reader.read(str(tmp_path / "dataset_1.json"), vocab_file="stub", cache_dir=str(cache_dir),
+                        max_cached_datasets=3)
+
+    assert sorted(path.name for path in cache_dir.iterdir()) == sorted([keys[0], keys[3], keys[4]])
@@ -24,7 +24,7 @@ from deeppavlov.core.common.registry import register
 from torch_model import TorchModel
 from deeppavlov.models.torch_bert.crf import CRF
 from overrides import overrides
-from transformers import AutoModelForTokenClassification, AutoConfig
+from transformers import AutoModel, AutoModelForTokenClassification, AutoConfig
 
 log = getLogger(__name__)
 
@@ -114,20 +114,35 @@ def token_from_subtoken(units: torch.Tensor, mask: torch.Tensor) -> torch.Tensor
     return tensor
 
 
-def token_labels_to_subtoken_labels(labels, y_mask, input_mask):
-    subtoken_labels = []
-    labels_ind = 0
-    n_tokens_with_special = int(np.sum(input_mask))
+def batch_token_labels_to_subtoken_labels(labels: List[List[int]],
+                                          y_masks: Union[List[List[int]], np.ndarray],
+                                          input_masks: Union[List[List[int]], np.ndarray]) -> np.ndarray:
+    """ Expand token level labels to subtoken level labels for the whole batch at once
 
-    for el in y_mask[1:n_tokens_with_special - 1]:
-        if el == 1:
-            subtoken_labels += [labels[labels_ind]]
-            labels_ind += 1
-        else:
-            subtoken_labels += [labels[labels_ind - 1]]
+    Args:
+        labels: batch of token level label indices
+        y_masks: mask of token beginnings of shape [batch_size, SUBTOKEN_seq_length]
+        input_masks: attention mask of shape [batch_size, SUBTOKEN_seq_length]
 
-    subtoken_labels = [0] + subtoken_labels + [0] * (len(input_mask) - n_tokens_with_special + 1)
-    return subtoken_labels
+    Returns:
+        subtoken level labels of shape [batch_size, SUBTOKEN_seq_length]: every subtoken gets the label
+            of the token it belongs to, ``[CLS]``, ``[SEP]`` and padding get 0
+    """
+    y_masks = np.asarray(y_masks)
+    input_masks = np.asarray(input_masks)
+    batch_size, seq_length = y_masks.shape
+    max_n_tokens = max([len(labels_list) for labels_list in labels] + [1])
+    labels_arr = np.zeros((batch_size, max_n_tokens), dtype=np.int64)
+    for i, labels_list in enumerate(labels):
+        labels_arr[i, :len(labels_list)] = labels_list
+
+    # number of the token which every subtoken belongs to
+    token_nums = np.clip(np.cumsum(y_masks, axis=1) - 1, 0, max_n_tokens - 1)
+    subtoken_labels = np.take_along_axis(labels_arr, token_nums, axis=1)
+    n_tokens_with_special = np.sum(input_masks, axis=1, keepdims=True)
+    positions = np.arange(seq_length)[None, :]
+    inside_text = (positions > 0) & (positions < n_tokens_with_special - 1)
+    return np.where(inside_text, subtoken_labels, 0)
 
 
 @register('torch_transformers_sequence_tagger')
@@ -151,6 +166,8 @@ class TorchTransformersSequenceTagger(TorchModel):
         clip_norm: clip gradients by norm
         min_learning_rate: min value of learning rate if learning rate decay is used
         use_crf: whether to use Conditional Ramdom Field to decode tags
+        use_amp: whether to train with automatic mixed precision (used only on `cuda` device)
+        gradient_accumulation_steps: number of batches to accumulate gradients over before the optimizer step
     """
 
     def __init__(self,
@@ -167,6 +184,8 @@ class TorchTransformersSequenceTagger(TorchModel):
                  clip_norm: Optional[float] = None,
                  min_learning_rate: float = 1e-07,
                  use_crf: bool = False,
+                 use_amp: bool = False,
+                 gradient_accumulation_steps: int = 1,
                  device: str = "cpu",
                  **kwargs) -> None:
 
@@ -188,6 +207,11 @@ class TorchTransformersSequenceTagger(TorchModel):
                          device=device,
                          **kwargs)
 
+        self.use_amp = use_amp and self.device.type == "cuda"
+        self.grad_scaler = torch.cuda.amp.GradScaler(enabled=self.use_amp)
+        self.gradient_accumulation_steps = gradient_accumulation_steps
+        self.accumulated_batches = 0
+
     def train_on_batch(self,
                        input_ids: Union[List[List[int]], np.ndarray],
                        input_masks: Union[List[List[int]], np.ndarray],
@@ -211,28 +235,107 @@ class TorchTransformersSequenceTagger(TorchModel):
         """
         b_input_ids = torch.from_numpy(input_ids).to(self.device)
         b_input_masks = torch.from_numpy(input_masks).to(self.device)
-        subtoken_labels = [token_labels_to_subtoken_labels(y_el, y_mask, input_mask)
-                           for y_el, y_mask, input_mask in zip(y, y_masks, input_masks)]
-        b_labels = torch.from_numpy(np.array(subtoken_labels)).to(torch.int64).to(self.device)
-        self.optimizer.zero_grad()
-
-        loss = self.model(input_ids=b_input_ids,
-                          attention_mask=b_input_masks,
-                          labels=b_labels).loss
-        loss.backward()
+        subtoken_labels = batch_token_labels_to_subtoken_labels(y, y_masks, input_masks)
+        b_labels = torch.from_numpy(subtoken_labels).to(self.device)
+
+        with torch.cuda.amp.autocast(enabled=self.use_amp):
+            loss = self.model(input_ids=b_input_ids,
+                              attention_mask=b_input_masks,
+                              labels=b_labels).loss
+        self.grad_scaler.scale(loss / self.gradient_accumulation_steps).backward()
         if self.use_crf:
             self.crf(y, y_masks)
+
+        self.accumulated_batches += 1
+        if self.accumulated_batches % self.gradient_accumulation_steps == 0:
+            self.optimizer_step()
+
+        return {'loss': loss.item()}
+
+    def distill_on_batch(self,
+                         input_ids: Union[List[List[int]], np.ndarray],
+                         input_masks: Union[List[List[int]], np.ndarray],
+                         y_masks: Union[List[List[int]], np.ndarray],
+                         soft_targets: List[np.ndarray],
+                         temperature: float = 1.0) -> Dict[str, float]:
+        """Trains the model to reproduce tag distributions of the teacher models
+
+        Args:
+            input_ids: batch of indices of subwords
+            input_masks: batch of masks which determine what should be attended
+            y_masks: mask which determines the first subword units in the the word
+            soft_targets: teacher probabilities of tags with shape (number of tokens, number of tags)
+                for every sample
+            temperature: softmax temperature of the student and the teacher distributions, the teacher probabilities
+                are softened as p ** (1 / temperature) renormalized over the tags of every token
+
+        Returns:
+            dict with field 'loss'
+        """
+        b_input_ids = torch.from_numpy(input_ids).to(self.device)
+        b_input_masks = torch.from_numpy(input_masks).to(self.device)
+        b_y_masks = torch.from_numpy(np.asarray(y_masks)).to(self.device).bool()
+        seq_lengths = np.sum(y_masks, axis=1)
+        # logits of the start-of-word subtokens are gathered in row-major order, so that the targets of all samples
+        # are concatenated in the same order
+        b_targets = torch.from_numpy(np.concatenate([targets[:length] for targets, length in
+                                                     zip(soft_targets, seq_lengths)]).astype(np.float32))
+        if temperature != 1.0:
+            # the teachers return probabilities (softmax of their logits at temperature 1), p ** (1 / T)
+            # renormalized is the softmax of the teacher logits divided by T
+            b_targets = b_targets.clamp(min=1e-12) ** (1.0 / temperature)
+            b_targets = b_targets / b_targets.sum(dim=-1, keepdim=True)
+        b_targets = b_targets.to(self.device)
+
+        with torch.cuda.amp.autocast(enabled=self.use_amp):
+            logits = self.model(input_ids=b_input_ids, attention_mask=b_input_masks).logits
+        log_probas = torch.nn.functional.log_softmax(logits[b_y_masks].float() / temperature, dim=-1)
+        loss = -(b_targets * log_probas).sum(dim=-1).mean() * temperature ** 2
+        self.grad_scaler.scale(loss / self.gradient_accumulation_steps).backward()
+
+        self.accumulated_batches += 1
+        if self.accumulated_batches % self.gradient_accumulation_steps == 0:
+            self.optimizer_step()
+
+        return {'loss': loss.item()}
+
+    def flush_gradients(self) -> None:
+        """Makes the optimizer step with the gradients of the batches accumulated since the last step (if their
+        number is less than gradient_accumulation_steps), so that they do not leak into the next epoch"""
+        remaining = self.accumulated_batches % self.gradient_accumulation_steps
+        if remaining:
+            # the losses were divided by gradient_accumulation_steps, the gradients are rescaled to the mean
+            # over the remaining batches
+            for param in self.model.parameters():
+                if param.grad is not None:
+                    param.grad.mul_(self.gradient_accumulation_steps / remaining)
+            self.optimizer_step()
+        self.accumulated_batches = 0
+
+    @overrides
+    def process_event(self, event_name: str, data: dict) -> None:
+        if event_name == "after_epoch":
+            self.flush_gradients()
+        super().process_event(event_name, data)
+
+    def optimizer_step(self) -> None:
+        """Makes the optimizer step with the gradients accumulated since the previous step"""
         # Clip the norm of the gradients to 1.0.
         # This is to help prevent the "exploding gradients" problem.
         if self.clip_norm:
+            # gradients should be unscaled before clipping when mixed precision is used
+            self.grad_scaler.unscale_(self.optimizer)
             torch.nn.utils.clip_grad_norm_(self.model.parameters(), self.clip_norm)
 
-        self.optimizer.step()
-        if self.lr_scheduler is not None:
+        scale = self.grad_scaler.get_scale()
+        self.grad_scaler.step(self.optimizer)
+        self.grad_scaler.update()
+        self.optimizer.zero_grad()
+        # the scaler skips the optimizer step and decreases the scale if the gradients have inf or nan values,
+        # the schedule follows the steps which were made
+        if self.lr_scheduler is not None and self.grad_scaler.get_scale() >= scale:
             self.lr_scheduler.step()
 
-        return {'loss': loss.item()}
-
     def __call__(self,
                  input_ids: Union[List[List[int]], np.ndarray],
                  input_masks: Union[List[List[int]], np.ndarray],
@@ -320,3 +423,146 @@ class TorchTransformersSequenceTagger(TorchModel):
             weights_path_crf = weights_path_crf.with_suffix(".pth.tar")
             torch.save({"model_state_dict": self.crf.cpu().state_dict()}, weights_path_crf)
             self.crf.to(self.device)
+
+
+class MultiHeadTokenClassifier(torch.nn.Module):
+    """Transformer encoder with several token classification heads"""
+
+    def __init__(self, encoder: torch.nn.Module, n_tags: List[int], dropout_prob: float) -> None:
+        super().__init__()
+        self.encoder = encoder
+        self.dropout = torch.nn.Dropout(dropout_prob)
+        self.heads = torch.nn.ModuleList([torch.nn.Linear(encoder.config.hidden_size, n_head_tags)
+                                          for n_head_tags in n_tags])
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> List[torch.Tensor]:
+        hidden_states = self.dropout(self.encoder(input_ids=input_ids, attention_mask=attention_mask)[0])
+        return [head(hidden_states) for head in self.heads]
+
+
+@register('torch_transformers_multihead_sequence_tagger')
+class TorchTransformersMultiHeadSequenceTagger(TorchTransformersSequenceTagger):
+    """Transformer-based sequence tagger with one encoder and several token classification heads, e.g. for tag sets
+    of different datasets. One forward pass of the encoder produces tag distributions of all heads.
+
+    Args:
+        n_tags: numbers of distinct tags of the heads
+        pretrained_bert: pretrained Bert checkpoint path or key title (e.g. "bert-base-uncased")
+        bert_config_file: path to Bert configuration file, or None, if `pretrained_bert` is a string name
+        **kwargs: parameters of ``TorchTransformersSequenceTagger``
+    """
+
+    def __init__(self,
+                 n_tags: List[int],
+                 pretrained_bert: str,
+                 bert_config_file: Optional[str] = None,
+                 **kwargs) -> None:
+        self.heads_n_tags = list(n_tags)
+        if kwargs.get("use_crf"):
+            raise ConfigError("CRF is not supported by the multi-head tagger.")
+        super().__init__(n_tags=sum(self.heads_n_tags), pretrained_bert=pretrained_bert,
+                         bert_config_file=bert_config_file, **kwargs)
+
+    def train_on_batch(self,
+                       input_ids: Union[List[List[int]], np.ndarray],
+                       input_masks: Union[List[List[int]], np.ndarray],
+                       y_masks: Union[List[List[int]], np.ndarray],
+                       *heads_y: List[List[int]],
+                       **kwargs) -> Dict[str, float]:
+        """
+
+        Args:
+            input_ids: batch of indices of subwords
+            input_masks: batch of masks which determine what should be attended
+            y_masks: mask which determines the first subword units in the the word
+            heads_y: tag indices of every head and the last argument is the batch of masks which determine
+                which heads have tags for the sample
+
+        Returns:
+            dict with field 'loss'
+        """
+        *heads_y, heads_mask = heads_y
+        b_input_ids = torch.from_numpy(input_ids).to(self.device)
+        b_input_masks = torch.from_numpy(input_masks).to(self.device)
+        heads_mask = np.asarray(heads_mask, dtype=bool)
+
+        with torch.cuda.amp.autocast(enabled=self.use_amp):
+            heads_logits = self.model(input_ids=b_input_ids, attention_mask=b_input_masks)
+        loss = torch.zeros((), device=self.device)
+        for head_num, (logits, y) in enumerate(zip(heads_logits, heads_y)):
+            subtoken_labels = batch_token_labels_to_subtoken_labels(y, y_masks, input_masks)
+            # the loss is not computed for padding subtokens and for the samples without tags of the head
+            subtoken_labels[np.asarray(input_masks) == 0] = -100
+            subtoken_labels[~heads_mask[:, head_num]] = -100
+            if (subtoken_labels != -100).any():
+                b_labels = torch.from_numpy(subtoken_labels).to(self.device)
+                loss = loss + torch.nn.functional.cross_entropy(logits.float().view(-1, logits.shape[-1]),
+                                                                b_labels.view(-1), ignore_index=-100)
+        self.grad_scaler.scale(loss / self.gradient_accumulation_steps).backward()
+
+        self.accumulated_batches += 1
+        if self.accumulated_batches % self.gradient_accumulation_steps == 0:
+            self.optimizer_step()
+
+        return {'loss': loss.item()}
+
+    def __call__(self,
+                 input_ids: Union[List[List[int]], np.ndarray],
+                 input_masks: Union[List[List[int]], np.ndarray],
+                 y_masks: Union[List[List[int]], np.ndarray]) -> Tuple[Union[List[List[int]], np.ndarray], ...]:
+        """ Predicts tag indices of every head for a given subword tokens batch
+
+        Args:
+            input_ids: indices of the subwords
+            input_masks: mask that determines where to attend and where not to
+            y_masks: mask which determines the first subword units in the the word
+
+        Returns:
+            label indices and class probabilities for each token (not subtoken) of the first head, then of
+                the second head, etc.
+        """
+        b_input_ids = torch.from_numpy(input_ids).to(self.device)
+        b_input_masks = torch.from_numpy(input_masks).to(self.device)
+        b_y_masks = torch.from_numpy(y_masks)
+        seq_lengths = np.sum(y_masks, axis=1)
+
+        with torch.no_grad():
+            heads_logits = self.model(b_input_ids, attention_mask=b_input_masks)
+
+        outputs = []
+        for logits in heads_logits:
+            logits = token_from_subtoken(logits.float().detach().cpu(), b_y_masks)
+            probas = torch.nn.functional.softmax(logits, dim=-1).numpy()
+            pred = np.argmax(probas, axis=-1)
+            outputs += [[p[:l] for l, p in zip(seq_lengths, pred)], probas]
+        return tuple(outputs)
+
+    @overrides
+    def load(self, fname=None):
+        if fname is not None:
+            self.load_path = fname
+
+        if self.pretrained_bert:
+            encoder = AutoModel.from_pretrained(self.pretrained_bert)
+        elif self.bert_config_file and Path(self.bert_config_file).is_file():
+            self.bert_config = AutoConfig.from_json_file(str(expand_path(self.bert_config_file)))
+
+            if self.attention_probs_keep_prob is not None:
+                self.bert_config.attention_probs_dropout_prob = 1.0 - self.attention_probs_keep_prob
+            if self.hidden_keep_prob is not None:
+                self.bert_config.hidden_dropout_prob = 1.0 - self.hidden_keep_prob
+            encoder = AutoModel.from_config(self.bert_config)
+        else:
+            raise ConfigError("No pre-trained BERT model is given.")
+
+        self.model = MultiHeadTokenClassifier(encoder, self.heads_n_tags, encoder.config.hidden_dropout_prob)
+        self.model.to(self.device)
+
+        self.optimizer = getattr(torch.optim, self.optimizer_name)(
+            self.model.parameters(), **self.optimizer_parameters)
+        if self.lr_scheduler_name is not None:
+            self.lr_scheduler = getattr(torch.optim.lr_scheduler, self.lr_scheduler_name)(
+                self.optimizer, **self.lr_scheduler_parameters)
+
+        if self.load_path:
+            TorchModel.load(self)
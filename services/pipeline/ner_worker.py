@@ -0,0 +1,132 @@
+"""Runs the NER models of the pipeline in the interpreter of the NER service.
+
+The NER service (deeppavlov==1.1.1) and the entity linking service (DeepPavlov 7518a97) need different DeepPavlov
+versions, both register components with the same names and have modules with the same names (main, server), so
+the NER models can not be built in the interpreter of the entity linker. The pipeline server starts this module
+with the interpreter of NER_PYTHON and exchanges length-prefixed msgpack messages with it over stdin and stdout:
+the worker sends {"ready": true} when the models are built, then it reads the lists of texts and answers with
+{"ner": <response of the NER service>} or {"error": <message>}.
+"""
+import os
+import struct
+import subprocess
+import sys
+import threading
+from logging import getLogger
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional
+
+import msgpack
+import numpy as np
+
+log = getLogger(__name__)
+
+SRC_PATH = Path(__file__).resolve().parent
+NER_PATH = SRC_PATH / 'ner'
+HEADER = struct.Struct(">I")
+
+SINGLE_NER_CONFIGS = {"distilled": "entity_detection_distilled.json",
+                      "multihead": "entity_detection_multihead.json"}
+
+
+def encode_default(obj: Any) -> Any:
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Type is not serializable: {type(obj)}")
+
+
+def write_message(stream: BinaryIO, message: Any) -> None:
+    payload = msgpack.packb(message, default=encode_default, use_bin_type=True)
+    stream.write(HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def read_message(stream: BinaryIO) -> Optional[Any]:
+    """Returns the next message of the stream, None if the stream is closed"""
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    size, = HEADER.unpack(header)
+    payload = stream.read(size)
+    if len(payload) < size:
+        return None
+    return msgpack.unpackb(payload, raw=False)
+
+
+class NerProcess:
+    """Runs the NER models in a subprocess with the interpreter of the NER service, the instance is called with
+    a list of texts and returns the response of the NER service for them.
+
+    Args:
+        python: interpreter of the NER service
+        env: environment of the subprocess (NER_MODEL and RURED_CONFIG select the models as in the NER service),
+            the environment of the server if None
+    """
+
+    def __init__(self, python: str, env: Optional[Dict[str, str]] = None) -> None:
+        self.process = subprocess.Popen([python, str(Path(__file__).resolve())], cwd=str(NER_PATH), env=env,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.lock = threading.Lock()
+        if read_message(self.process.stdout) is None:
+            raise RuntimeError(f"NER worker exited with code {self.process.wait()} before the models were built")
+
+    def __call__(self, texts: List[str]) -> Dict[str, list]:
+        with self.lock:
+            write_message(self.process.stdin, texts)
+            response = read_message(self.process.stdout)
+        if response is None:
+            raise RuntimeError(f"NER worker exited with code {self.process.wait()}")
+        if "error" in response:
+            raise RuntimeError(f"NER worker failed: {response['error']}")
+        return response["ner"]
+
+    def close(self) -> None:
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def build_ner():
+    from deeppavlov import build_model, deep_download
+    from deeppavlov.core.commands.utils import parse_config
+
+    from ner_merge import merge_ner_outputs
+
+    def build(config_name: str):
+        deep_download(config_name)
+        return build_model(parse_config(config_name), download=False)
+
+    # NER models are prepared in /data by the ner service
+    ner_model_name = os.getenv("NER_MODEL", "ensemble")
+    if ner_model_name in SINGLE_NER_CONFIGS:
+        ner_model = build(SINGLE_NER_CONFIGS[ner_model_name])
+        return lambda texts: merge_ner_outputs(ner_model(texts))
+    ner_model = build(os.getenv("RURED_CONFIG", "entity_detection_rured.json"))
+    ner_lower_model = build("entity_detection_collection3_lower.json")
+    return lambda texts: merge_ner_outputs(ner_model(texts), ner_lower_model(texts))
+
+
+def serve() -> None:
+    # the messages use the original stdout, the output of the models goes to stderr
+    output = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    # NER configs refer to the components and the configs of their models by the paths in the NER service
+    sys.path.insert(0, str(NER_PATH))
+    os.chdir(NER_PATH)
+    ner = build_ner()
+    write_message(output, {"ready": True})
+    while True:
+        texts = read_message(sys.stdin.buffer)
+        if texts is None:
+            return
+        try:
+            response = {"ner": ner(texts)}
+        except Exception as e:
+            log.exception("NER of the texts failed")
+            response = {"error": f"{type(e).__name__}: {e}"}
+        write_message(output, response)
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import Callable, Dict, List
+
+log = getLogger(__name__)
+
+# tags of the NER models which are linked and the tags of the entity linker they are mapped to, rured tags are
+# mapped to PER/LOC/ORG, collection3 tags are the same
+LINKING_TAGS = {"PER": "PER", "PERSON": "PER",
+                "LOC": "LOC", "LOCATION": "LOC", "CITY": "LOC", "COUNTRY": "LOC", "STATE_OR_PROVINCE": "LOC",
+                "DISTRICT": "LOC",
+                "ORG": "ORG", "ORGANIZATION": "ORG"}
+
+EL_OUTPUTS = ["entity_substr", "conf", "entity_offsets", "entity_ids", "entity_tags", "entity_labels",
+              "entity_wiki_types", "entity_wiki_tags", "status"]
+
+
+class NerLinkingPipeline:
+    """Runs NER and entity linking of the texts, outputs of NER are passed to the linker as Python objects.
+    Documents are processed in batches, linking of a batch runs in a separate thread while NER processes
+    the next batch.
+
+    Args:
+        ner_model: returns the response of the NER service for a list of texts (see ner_worker.NerProcess)
+        el_model: entity linking model
+        batch_size: number of documents in a batch
+    """
+
+    def __init__(self, ner_model: Callable[[List[str]], Dict[str, list]], el_model: Callable,
+                 batch_size: int = 16) -> None:
+        self.ner_model = ner_model
+        self.el_model = el_model
+        self.batch_size = batch_size
+        self.el_executor = ThreadPoolExecutor(max_workers=1)
+
+    def link(self, ner_response: Dict[str, list]) -> Dict[str, list]:
+        """Links the entities of NER response with the tags of LINKING_TAGS"""
+        entity_substr_batch, entity_offsets_batch, tags_batch, probas_batch = [], [], [], []
+        for entity_substr_list, entity_offsets_list, tags_list, probas_list in \
+                zip(ner_response["entity_substr"], ner_response["entity_offsets"], ner_response["tags"],
+                    ner_response["probas"]):
+            linked = [num for num, tag in enumerate(tags_list) if tag in LINKING_TAGS]
+            entity_substr_batch.append([entity_substr_list[num] for num in linked])
+            entity_offsets_batch.append([entity_offsets_list[num] for num in linked])
+            tags_batch.append([LINKING_TAGS[tags_list[num]] for num in linked])
+            probas_batch.append([probas_list[num] for num in linked])
+        el_outputs = self.el_model(entity_substr_batch, entity_offsets_batch, tags_batch,
+                                   ner_response["sentences_offsets"], ner_response["sentences"], probas_batch)
+        return dict(zip(EL_OUTPUTS, el_outputs))
+
+    def __call__(self, texts: List[str]) -> Dict[str, Dict[str, list]]:
+        """Returns NER response and linking results of the documents, every field has a list for every document"""
+        response = {"ner": {}, "linking": {}}
+        linking = None
+        for start in range(0, len(texts), self.batch_size):
+            ner_response = self.ner_model(texts[start:start + self.batch_size])
+            if linking is not None:
+                self.extend(response, linking.result())
+            # linking of the batch overlaps with NER of the next batch
+            linking = self.el_executor.submit(self.link_batch, ner_response)
+        if linking is not None:
+            self.extend(response, linking.result())
+        return response
+
+    def link_batch(self, ner_response: Dict[str, list]) -> Dict[str, Dict[str, list]]:
+        return {"ner": ner_response, "linking": self.link(ner_response)}
+
+    @staticmethod
+    def extend(response: Dict[str, Dict[str, list]], batch_response: Dict[str, Dict[str, list]]) -> None:
+        for part, fields in batch_response.items():
+            for field, values in fields.items():
+                response[part].setdefault(field, []).extend(values)
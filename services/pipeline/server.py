@@ -0,0 +1,79 @@
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from logging import getLogger
+from os import getenv
+from pathlib import Path
+from typing import List
+
+SRC_PATH = Path(__file__).resolve().parent
+EL_PATH = SRC_PATH / 'entity_linking'
+# components of the entity linking service are imported by their configs, the NER models run in the interpreter of
+# the NER service (see ner_worker.py), so the modules of the NER service are not on the path of this interpreter
+sys.path.insert(1, str(EL_PATH))
+
+import uvicorn
+from deeppavlov import build_model, deep_download
+from deeppavlov.core.commands.utils import parse_config
+from fastapi import FastAPI
+from pydantic import BaseModel
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+
+from common.responses import encode_response
+from entity_linking.main import initial_setup as el_initial_setup
+from ner_worker import NerProcess
+from pipeline import NerLinkingPipeline
+
+logger = getLogger(__file__)
+app = FastAPI()
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=['*'],
+    allow_credentials=True,
+    allow_methods=['*'],
+    allow_headers=['*']
+)
+
+# interpreter of the NER service, NER_MODEL and RURED_CONFIG are passed to it in the environment
+NER_PYTHON = getenv("NER_PYTHON", sys.executable)
+PIPELINE_BATCH_SIZE = int(getenv("PIPELINE_BATCH_SIZE", "16"))
+
+
+@contextmanager
+def working_dir(path: Path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+# NER models are prepared in /data by the ner service, the entity linking data is prepared here as in the
+# entity-linking service
+with working_dir(EL_PATH):
+    deep_download('entity_linking.json')
+    el_initial_setup()
+    el_model = build_model(parse_config('entity_linking.json'), download=False)
+ner_model = NerProcess(NER_PYTHON)
+
+pipeline = NerLinkingPipeline(ner_model, el_model, PIPELINE_BATCH_SIZE)
+# the models run in one thread outside of the event loop
+pipeline_executor = ThreadPoolExecutor(max_workers=1)
+
+
+class Payload(BaseModel):
+    x: List[str]
+
+
+@app.post("/model")
+async def model(payload: Payload, request: Request):
+    response = await asyncio.get_event_loop().run_in_executor(pipeline_executor, pipeline, payload.x)
+    return encode_response(request, response)
+
+
+uvicorn.run(app, host='0.0.0.0', port=8002)
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# modules of the service are imported from the service directory, as in the container, the modules of the other
+# services are imported by their qualified names (ner.ner_merge)
+sys.path[0:0] = [str(Path(__file__).resolve().parents[1]), str(Path(__file__).resolve().parents[2])]
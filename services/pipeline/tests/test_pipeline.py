@@ -0,0 +1,78 @@
+import io
+
+import numpy as np
+import pytest
+
+from ner.ner_merge import merge_ner_outputs
+from pipeline import EL_OUTPUTS, NerLinkingPipeline
+
+
+def stub_ner(entities):
+    """Returns the entity detection model which finds the entities (substring, tag) in the texts"""
+
+    def model(texts):
+        outputs = tuple([] for _ in range(7))
+        substr_b, offsets_b, pos_b, tags_b, sent_offsets_b, sent_b, probas_b = outputs
+        for text in texts:
+            found = [(substr, tag, text.find(substr)) for substr, tag in entities if substr in text]
+            substr_b.append([substr for substr, _, _ in found])
+            offsets_b.append([[start, start + len(substr)] for substr, _, start in found])
+            pos_b.append([[num] for num in range(len(found))])
+            tags_b.append([tag for _, tag, _ in found])
+            sent_offsets_b.append([[0, len(text)]])
+            sent_b.append([text])
+            probas_b.append([np.float32(0.9) for _ in found])
+        return outputs
+
+    return model
+
+
+class StubLinker:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, entity_substr_batch, entity_offsets_batch, tags_batch, sentences_offsets_batch,
+                 sentences_batch, probas_batch):
+        self.batches.append(entity_substr_batch)
+        outputs = {field: [] for field in EL_OUTPUTS}
+        for entity_substr_list, tags_list in zip(entity_substr_batch, tags_batch):
+            outputs["entity_substr"].append(entity_substr_list)
+            outputs["entity_ids"].append([[f"Q_{substr}"] for substr in entity_substr_list])
+            outputs["entity_tags"].append(tags_list)
+            for field in ["conf", "entity_offsets", "entity_labels", "entity_wiki_types", "entity_wiki_tags"]:
+                outputs[field].append([[] for _ in entity_substr_list])
+            outputs["status"].append("ok")
+        return tuple(outputs[field] for field in EL_OUTPUTS)
+
+
+def test_pipeline_links_merged_ner_entities():
+    rured = stub_ner([("Москва", "CITY"), ("Иванов", "PERSON"), ("вторник", "DATE")])
+    lower = stub_ner([("Москва", "LOC"), ("сбербанк", "ORG")])
+    linker = StubLinker()
+    pipeline = NerLinkingPipeline(lambda texts: merge_ner_outputs(rured(texts), lower(texts)), linker,
+                                  batch_size=2)
+    texts = ["Иванов приехал в Москва", "сбербанк во вторник", "нет сущностей"]
+    response = pipeline(texts)
+
+    assert response["ner"]["entity_substr"] == [["Москва", "Иванов"], ["вторник", "сбербанк"], []]
+    assert response["ner"]["tags"] == [["CITY", "PERSON"], ["DATE", "ORG"], []]
+    # the entities which are not linked (DATE) are not passed to the linker, the batches are linked separately
+    assert linker.batches == [[["Москва", "Иванов"], ["сбербанк"]], [[]]]
+    assert response["linking"]["entity_substr"] == [["Москва", "Иванов"], ["сбербанк"], []]
+    assert response["linking"]["entity_tags"] == [["LOC", "PER"], ["ORG"], []]
+    assert response["linking"]["entity_ids"] == [[["Q_Москва"], ["Q_Иванов"]], [["Q_сбербанк"]], []]
+    assert response["linking"]["status"] == ["ok", "ok", "ok"]
+
+
+def test_ner_worker_messages():
+    ner_worker = pytest.importorskip("ner_worker")
+    stream = io.BytesIO()
+    response = merge_ner_outputs(stub_ner([("Москва", "LOC")])(["в Москва"]))
+    ner_worker.write_message(stream, {"ner": response})
+    ner_worker.write_message(stream, ["текст"])
+    stream.seek(0)
+    message = ner_worker.read_message(stream)
+    assert message["ner"]["entity_offsets"] == [[[2, 8]]]
+    assert message["ner"]["probas"] == [[pytest.approx(0.9)]]
+    assert ner_worker.read_message(stream) == ["текст"]
+    assert ner_worker.read_message(stream) is None